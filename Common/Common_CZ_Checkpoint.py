@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Checkpoint of the outer folds (or the loops of LOOCV) of a cross-validation, so an interrupted run skips the finished folds
+# The checkpoint is one append-only file, ResultantFolder/<Name>.ckpt: the setting of the run, then one record for each finished fold
+# (e.g., the selected parameters and the predictions). Each record is written as
+#     'CZCK', payload length (uint32), crc32 of payload (uint32), payload (.npz of the arrays of the record)
+# and is flushed to the disk before the next fold, so a crash leaves at most a torn last record, which fails the length or crc32
+# check and is dropped at the next start; the file is then rewritten without it into a temporary file, and renamed over the old one
+#
+
+import io
+import os
+import zlib
+import struct
+import numpy as np
+from scipy import sparse
+
+_Checkpoint_Magic = b'CZCK'
+_Checkpoint_Header = struct.Struct('<4sII')
+
+def Checkpoint_Open(ResultantFolder, Setting, Name='Checkpoint'):
+    #
+    # Open the checkpoint of a run, with the records of the folds already finished by a previous run of the same setting
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results, the checkpoint is ResultantFolder/<Name>.ckpt
+    # Setting:
+    #     dict of the arrays (or numbers) identifying the run, e.g., the fold quantity, the parameter ranges, and 'Checkpoint_Hash'
+    #     of the data and the scores; if the setting in the file differs, the old records are discarded and the run starts over
+    # Name:
+    #     Name of the checkpoint file
+    #
+    # Return:
+    #     Checkpoint, dict with
+    #         'File': the path of the checkpoint file
+    #         'Record': dict of the records of the finished folds, Record[ID] is the dict given to 'Checkpoint_Append'
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    File = os.path.join(ResultantFolder, Name + '.ckpt')
+    # None (e.g., Seed) is saved as an empty array
+    Setting = {Key: np.asarray([] if Setting[Key] is None else Setting[Key]) for Key in Setting}
+    Payloads, Valid_Length, File_Length = Checkpoint_Read(File)
+    Checkpoint = {'File': File, 'Record': {}}
+    if Payloads and Checkpoint_Same(Checkpoint_Decode(Payloads[0]), Setting):
+        if Valid_Length < File_Length:
+            # Drop the torn last record, the valid records are written into a temporary file which then replaces the checkpoint
+            with open(File, 'rb') as Checkpoint_File:
+                Valid_Bytes = Checkpoint_File.read(Valid_Length)
+            Checkpoint_Replace(File, Valid_Bytes)
+        for Payload in Payloads[1:]:
+            Record = Checkpoint_Decode(Payload)
+            Checkpoint['Record'][int(Record.pop('Checkpoint_ID'))] = Record
+    else:
+        # New run, or another setting in the same folder
+        Checkpoint_Replace(File, Checkpoint_Frame(Checkpoint_Encode(Setting)))
+    return Checkpoint
+
+def Checkpoint_Append(Checkpoint, ID, Record):
+    #
+    # Append the record of a finished fold to the checkpoint
+    #
+    # Checkpoint:
+    #     Output of 'Checkpoint_Open'
+    # ID:
+    #     Integer, the index of the fold (or subject of LOOCV)
+    # Record:
+    #     dict of arrays or numbers, e.g., {'Alpha': Optimal_Alpha, 'Predict_Score': Fold_J_Score}
+    #
+
+    Record = dict(Record)
+    Record['Checkpoint_ID'] = ID
+    with open(Checkpoint['File'], 'ab') as Checkpoint_File:
+        Checkpoint_File.write(Checkpoint_Frame(Checkpoint_Encode(Record)))
+        Checkpoint_File.flush()
+        os.fsync(Checkpoint_File.fileno())
+    Record.pop('Checkpoint_ID')
+    Checkpoint['Record'][int(ID)] = Record
+
+def Checkpoint_Close(Checkpoint):
+    #
+    # Remove the checkpoint after the run finishes and its results are saved
+    #
+    if os.path.exists(Checkpoint['File']):
+        os.remove(Checkpoint['File'])
+
+def Checkpoint_Hash(*Arrays, Hash=0):
+    #
+    # crc32 of the values of the arrays, for the setting of 'Checkpoint_Open', so the records are not used for other data
+    # The rows are read block by block, so a memory-mapped array is not loaded at once
+    # A sparse matrix is hashed by its shape and the arrays of its CSR format
+    # Hash is the crc32 to continue from, e.g., of the arrays before
+    #
+
+    for Array in Arrays:
+        if sparse.issparse(Array):
+            Array = Array.tocsr()
+            Hash = Checkpoint_Hash(np.array(Array.shape), Array.data, Array.indices, Array.indptr, Hash=Hash)
+            continue
+        Array = np.atleast_1d(Array)
+        Hash = zlib.crc32(str((Array.shape, Array.dtype.str)).encode(), Hash)
+        Block_Rows = max(1, 2 ** 24 // max(1, Array[:1].nbytes))
+        for Block_Start in np.arange(0, len(Array), Block_Rows):
+            Hash = zlib.crc32(np.ascontiguousarray(Array[Block_Start:Block_Start + Block_Rows]).tobytes(), Hash)
+    return Hash
+
+def Checkpoint_Read(File, Offset=0):
+    #
+    # Payloads of the valid records of a checkpoint file, and the length of the valid records and of the file
+    # Offset is the position of the first record to read, e.g., the end of the records already read
+    #
+    Payloads = []
+    Valid_Length = Offset
+    if not os.path.exists(File):
+        return (Payloads, Valid_Length, Valid_Length)
+    with open(File, 'rb') as Checkpoint_File:
+        Checkpoint_File.seek(Offset)
+        Data = Checkpoint_File.read()
+    Position = 0
+    while Position + _Checkpoint_Header.size <= len(Data):
+        Magic, Length, Crc = _Checkpoint_Header.unpack_from(Data, Position)
+        Payload = Data[Position + _Checkpoint_Header.size:Position + _Checkpoint_Header.size + Length]
+        if Magic != _Checkpoint_Magic or len(Payload) != Length or zlib.crc32(Payload) != Crc:
+            break
+        Payloads.append(Payload)
+        Position = Position + _Checkpoint_Header.size + Length
+    return (Payloads, Offset + Position, Offset + len(Data))
+
+def Checkpoint_Header(Checkpoint_File, Offset):
+    #
+    # Header of the record at Offset of an open checkpoint file, without reading its payload
+    #
+    # Return:
+    #     (Payload_Offset, Length, Crc), the position, length and crc32 of the payload, or None if there is no record at Offset
+    #
+    Checkpoint_File.seek(Offset)
+    Header = Checkpoint_File.read(_Checkpoint_Header.size)
+    if len(Header) < _Checkpoint_Header.size:
+        return None
+    Magic, Length, Crc = _Checkpoint_Header.unpack(Header)
+    if Magic != _Checkpoint_Magic:
+        return None
+    return (Offset + _Checkpoint_Header.size, Length, Crc)
+
+def Checkpoint_Replace(File, Data):
+    #
+    # Write Data into a temporary file in the same folder, and rename it to File, so File is either the old or the new one
+    #
+    Temp_File = File + '.tmp'
+    with open(Temp_File, 'wb') as Checkpoint_File:
+        Checkpoint_File.write(Data)
+        Checkpoint_File.flush()
+        os.fsync(Checkpoint_File.fileno())
+    os.replace(Temp_File, File)
+
+def Checkpoint_Frame(Payload):
+    #
+    # A record of the checkpoint file, the header and the payload
+    #
+    return _Checkpoint_Header.pack(_Checkpoint_Magic, len(Payload), zlib.crc32(Payload)) + Payload
+
+def Checkpoint_Encode(Record):
+    #
+    # Payload of a record, the arrays of the dict in .npz format
+    #
+    Buffer = io.BytesIO()
+    np.savez(Buffer, **{Key: np.asarray(Record[Key]) for Key in Record})
+    return Buffer.getvalue()
+
+def Checkpoint_Decode(Payload):
+    #
+    # The dict of a payload, 0-d arrays are returned as numbers
+    #
+    with np.load(io.BytesIO(Payload), allow_pickle=False) as Data:
+        return {Key: Data[Key][()] if Data[Key].ndim == 0 else Data[Key] for Key in Data.files}
+
+def Checkpoint_Same(Setting_A, Setting_B):
+    #
+    # Whether two settings are the same
+    #
+    if set(Setting_A) != set(Setting_B):
+        return False
+    return all(np.shape(Setting_A[Key]) == np.shape(Setting_B[Key]) and np.array_equal(Setting_A[Key], Setting_B[Key]) for Key in Setting_A)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Input of Subjects_Data from files, for data larger than the memory (e.g., voxel-wise features of thousands of subjects)
+# A .npy file, or a contiguous HDF5 dataset, is memory-mapped read-only, so the data are read from the disk when used,
+# and the processes of the permutation test (forked, see 'Permutation_Run') and of 'Schedule_Run' map the same file,
+# i.e., the pages are shared by the page cache instead of a private copy of the data in each process
+# The kernel paths (see Common_CZ_Kernel and 'Scale_Gram') read the features block by block, so they never load the whole matrix
+#
+
+import os
+import tempfile
+import numpy as np
+import scipy.io as sio
+from scipy import sparse
+
+def Data_Open(Subjects_Data, Dataset_Name='Subjects_Data', Block_Size=4096):
+    #
+    # Subjects_Data of the cross-validation functions, from an array or a file
+    #
+    # Subjects_Data:
+    #     n*m matrix (np.ndarray, or np.memmap), returned as it is
+    #     Path of a .npy file: memory-mapped read-only
+    #     Path of a .mat file: the variable Dataset_Name is loaded into memory (.mat files are compressed, and not memory-mapped),
+    #     e.g., Subjects_Data.mat of the *_Permutation_Sub functions
+    #     Path of an HDF5 file (.h5 or .hdf5), or an h5py dataset: see 'Data_HDF5', h5py is needed only for this
+    #     scipy.sparse matrix, or path of a .npz file of scipy.sparse.save_npz: returned as a CSR matrix, see Common_CZ_Sparse
+    # Dataset_Name:
+    #     Name of the variable in the .mat file, or of the dataset in the HDF5 file
+    # Block_Size:
+    #     Quantity of features copied at a time, only for an HDF5 dataset which can not be memory-mapped
+    #
+    # Return:
+    #     Subjects_Data, n*m matrix, np.ndarray, read-only np.memmap or CSR matrix
+    #
+
+    if isinstance(Subjects_Data, str):
+        Extension = os.path.splitext(Subjects_Data)[1].lower()
+        if Extension == '.npy':
+            return np.load(Subjects_Data, mmap_mode='r')
+        if Extension == '.npz':
+            return sparse.load_npz(Subjects_Data).tocsr()
+        if Extension == '.mat':
+            return sio.loadmat(Subjects_Data)[Dataset_Name]
+        if Extension in ('.h5', '.hdf5'):
+            import h5py
+            return Data_HDF5(h5py.File(Subjects_Data, 'r')[Dataset_Name], Block_Size)
+        raise ValueError('Subjects_Data should be a .npy, .npz, .mat, .h5 or .hdf5 file: ' + Subjects_Data)
+    if type(Subjects_Data).__module__.startswith('h5py'):
+        return Data_HDF5(Subjects_Data, Block_Size)
+    if sparse.issparse(Subjects_Data):
+        # The rows of the folds are taken from a CSR matrix
+        return Subjects_Data.tocsr()
+    return Subjects_Data
+
+def Data_HDF5(Dataset, Block_Size=4096):
+    #
+    # Memory-mapped array of an HDF5 dataset
+    # A contiguous dataset without compression is mapped where it is in the HDF5 file, without copying
+    # A chunked or compressed dataset is copied block by block of features into a temporary .npy file, which is mapped;
+    # the file is removed at once (on Linux, the mapping keeps the data until it is closed), so no copy is left on the disk
+    #
+    # Dataset:
+    #     h5py dataset, n*m, n is subjects quantity, m is features quantity
+    # Block_Size:
+    #     Quantity of features copied at a time
+    #
+    # Return:
+    #     Subjects_Data, n*m read-only np.memmap
+    #
+
+    Offset = Dataset.id.get_offset()
+    if Dataset.chunks is None and Dataset.compression is None and Offset is not None:
+        return np.memmap(Dataset.file.filename, dtype=Dataset.dtype, mode='r', offset=Offset, shape=Dataset.shape)
+    Features_Quantity = Dataset.shape[1]
+    Temp_Handle, Temp_File = tempfile.mkstemp(suffix='.npy')
+    os.close(Temp_Handle)
+    Subjects_Data = np.lib.format.open_memmap(Temp_File, mode='w+', dtype=Dataset.dtype, shape=Dataset.shape)
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Subjects_Data[:, Block] = Dataset[:, Block]
+    Subjects_Data.flush()
+    del Subjects_Data
+    Subjects_Data = np.load(Temp_File, mmap_mode='r')
+    try:
+        os.remove(Temp_File)
+    except OSError:
+        # e.g., a mapped file can not be removed on Windows, it is left in the temporary folder
+        pass
+    return Subjects_Data
+
+def Data_Mapped(Subjects_Data):
+    #
+    # Whether Subjects_Data is memory-mapped from a file still on the disk, so other processes can map the same file
+    #
+    return isinstance(Subjects_Data, np.memmap) and Subjects_Data.filename is not None and os.path.exists(Subjects_Data.filename)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Data of the folds of a cross-validation, taken from the original data by index
+# np.delete and preprocessing.MinMaxScaler make two n*m copies for each fold; here the training and testing rows of a fold
+# are written into one buffer allocated once for all the folds, and MinMax scaled in place
+#
+
+import numpy as np
+from Common_CZ_Scale import Scale_Handle_Zeros
+from Common_CZ_Sparse import Sparse_Check, Sparse_Fold
+
+def Fold_Buffer(Subjects_Data):
+    #
+    # Buffer for the data of the folds, see 'Fold_Data'
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    #
+    # Return:
+    #     Buffer, n*m matrix, float64, or the dtype of Subjects_Data if it is floating, the same with preprocessing.MinMaxScaler
+    #     None for a sparse Subjects_Data, whose folds are not copied into a buffer
+    #
+
+    if Sparse_Check(Subjects_Data):
+        return None
+    Data_Type = Subjects_Data.dtype if np.issubdtype(Subjects_Data.dtype, np.floating) else np.float64
+    return np.empty(np.shape(Subjects_Data), dtype=Data_Type)
+
+def Fold_Data(Subjects_Data, Testing_Index, Buffer, Training_Index=None):
+    #
+    # MinMax scaled training and testing data of a fold, written into Buffer
+    # The same with np.delete(Subjects_Data, Testing_Index, axis=0) and Subjects_Data[Testing_Index, :] scaled by
+    # preprocessing.MinMaxScaler fitted on the training data
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity, it is not changed
+    # Testing_Index:
+    #     Index of the testing subjects in Subjects_Data
+    # Buffer:
+    #     Output of 'Fold_Buffer', with at least as many rows as the training and testing subjects
+    #     It is overwritten by each call, so the data of a fold should not be used after the next fold is taken
+    # Training_Index:
+    #     Index of the training subjects in Subjects_Data, in the order of the rows of the training data
+    #     By default, all the subjects out of Testing_Index in the original order, the same with np.delete
+    #
+    # Return:
+    #     Training_Data, the first rows of Buffer
+    #     Testing_Data, the next rows of Buffer
+    #
+
+    if Sparse_Check(Subjects_Data):
+        # The rows of the CSR matrix, MaxAbs scaled, see 'Sparse_Fold' in Common_CZ_Sparse
+        return Sparse_Fold(Subjects_Data, Testing_Index, Training_Index)
+    Testing_Index = np.atleast_1d(Testing_Index)
+    if Training_Index is None:
+        Training_Mask = np.ones(np.shape(Subjects_Data)[0], dtype=bool)
+        Training_Mask[Testing_Index] = False
+        Training_Index = np.flatnonzero(Training_Mask)
+    Training_Quantity = len(Training_Index)
+    Training_Data = Buffer[:Training_Quantity]
+    Testing_Data = Buffer[Training_Quantity:Training_Quantity + len(Testing_Index)]
+    if Subjects_Data.dtype == Buffer.dtype:
+        # With mode='clip' np.take writes into out directly, while mode='raise' makes a temporary copy; the index is valid here
+        np.take(Subjects_Data, Training_Index, axis=0, out=Training_Data, mode='clip')
+        np.take(Subjects_Data, Testing_Index, axis=0, out=Testing_Data, mode='clip')
+    else:
+        # e.g., integer data, converted to the dtype of Buffer
+        Training_Data[:] = Subjects_Data[Training_Index, :]
+        Testing_Data[:] = Subjects_Data[Testing_Index, :]
+    Fold_Scale(Training_Data, Testing_Data)
+    return (Training_Data, Testing_Data)
+
+def Fold_Scale(Training_Data, Testing_Data):
+    #
+    # MinMax scale the training and testing data in place, with the min and range of the training data
+    # The same operations with fit_transform and transform of preprocessing.MinMaxScaler, so the results are identical
+    #
+    # Training_Data:
+    #     n*m matrix, n is training subjects quantity
+    # Testing_Data:
+    #     n*m matrix, n is testing subjects quantity
+    #
+
+    Data_Min = np.min(Training_Data, axis=0)
+    Data_Scale = (1 / Scale_Handle_Zeros(np.max(Training_Data, axis=0) - Data_Min)).astype(Training_Data.dtype)
+    Data_Shift = 0 - Data_Min * Data_Scale
+    for Data in (Training_Data, Testing_Data):
+        Data *= Data_Scale
+        Data += Data_Shift
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Kernel cache: the Gram matrices of the MinMax scaled data of all the splits of a cross-validation, from one pass over the features
+# MinMax scaling is (x - min) / range for each feature, so the Gram matrix of a split is sum_f (x_f - Shift_f) * (x_f - Shift_f)' / Range_f^2
+# up to the shift absorbed by the intercept, and it differs from the Gram matrix of all the subjects only on the features
+# with the min or max out of the training subjects of the split
+# The features are read block by block, and each block is used for the Gram matrix of all the subjects and the corrections of all the splits,
+# so the m-dimensional data are read only once, instead of once for each fold
+#
+
+import numpy as np
+from Common_CZ_Scale import Scale_Handle_Zeros
+
+def Kernel_Cache(Subjects_Data, Training_Index, Kernel_Index=None, Base_Index=None, Block_Size=4096):
+    #
+    # Gram matrices of the data scaled by the MinMax range of the training subjects of each split
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity, it is not changed
+    #     It can be a memory-mapped array, each block of features is read once
+    # Training_Index:
+    #     List of S index arrays, the training subjects of each split, whose MinMax range scales the data of the split
+    # Kernel_Index:
+    #     List of S index arrays, the subjects (rows and columns) of the Gram matrix of each split, all the subjects by default
+    # Base_Index:
+    #     List of S integers, the Gram matrix of split s is the Gram matrix of split Base_Index[s] corrected on the features whose range
+    #     differs between the two splits, -1 is the Gram matrix of all the subjects (default)
+    #     A nested split should be based on its outer split, so fewer features are corrected;
+    #     the base split should be before split s, and include the subjects of Kernel_Index[s]
+    # Block_Size:
+    #     Quantity of features processed at a time
+    #
+    # Return:
+    #     Cache, dict with
+    #         'Shift': m*1 vector, the mean of each feature, used as the shift in all the Gram matrices
+    #         'Data_Range': m*1 vector, MinMax range of all the subjects, with near-constant features set to 1
+    #         'Kernel': n*n matrix, the Gram matrix of all the subjects scaled by Data_Range, the same with 'Scale_Gram'
+    #         'Gram': list of S matrices, the Gram matrix of the subjects Kernel_Index[s] scaled by the range of Training_Index[s]
+    #     The memory is n*n + sum_s len(Kernel_Index[s])^2 float64 values
+    #
+
+    Subjects_Quantity, Features_Quantity = np.shape(Subjects_Data)
+    Split_Quantity = len(Training_Index)
+    if Kernel_Index is None:
+        Kernel_Index = [np.arange(Subjects_Quantity)] * Split_Quantity
+    if Base_Index is None:
+        Base_Index = [-1] * Split_Quantity
+    Shift = np.zeros(Features_Quantity)
+    Data_Range = np.zeros(Features_Quantity)
+    Kernel = np.zeros((Subjects_Quantity, Subjects_Quantity))
+    Gram = [np.zeros((len(Kernel_Index[s]), len(Kernel_Index[s]))) for s in np.arange(Split_Quantity)]
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Block_Data = np.array(Subjects_Data[:, Block], dtype=np.float64)
+        Shift[Block] = np.mean(Block_Data, axis=0)
+        Data_Range[Block] = Scale_Handle_Zeros(np.max(Block_Data, axis=0) - np.min(Block_Data, axis=0))
+        # The range of each split is of the original data, the same with preprocessing.MinMaxScaler
+        Split_Range = [Scale_Handle_Zeros(np.max(Block_Data[Training_Index[s]], axis=0) - np.min(Block_Data[Training_Index[s]], axis=0)) \
+            for s in np.arange(Split_Quantity)]
+        Block_Data -= Shift[Block]
+        Kernel += np.dot(Block_Data / Data_Range[Block] ** 2, Block_Data.T)
+        for s in np.arange(Split_Quantity):
+            # Correction on the features whose range differs from the base
+            Base_Range = Data_Range[Block] if Base_Index[s] < 0 else Split_Range[Base_Index[s]]
+            Changed_Index = np.nonzero(Split_Range[s] != Base_Range)[0]
+            if not len(Changed_Index):
+                continue
+            Changed_Data = Block_Data[np.ix_(Kernel_Index[s], Changed_Index)]
+            Weight = 1 / Split_Range[s][Changed_Index] ** 2 - 1 / Base_Range[Changed_Index] ** 2
+            Gram[s] += np.dot(Changed_Data * Weight, Changed_Data.T)
+    for s in np.arange(Split_Quantity):
+        if Base_Index[s] < 0:
+            Gram[s] += Kernel[np.ix_(Kernel_Index[s], Kernel_Index[s])]
+        else:
+            # Position of the subjects of this split in the Gram matrix of the base
+            Position = np.zeros(Subjects_Quantity, dtype=int)
+            Position[Kernel_Index[Base_Index[s]]] = np.arange(len(Kernel_Index[Base_Index[s]]))
+            Position = Position[Kernel_Index[s]]
+            Gram[s] += Gram[Base_Index[s]][np.ix_(Position, Position)]
+    return {'Shift': Shift, 'Data_Range': Data_Range, 'Kernel': Kernel, 'Gram': Gram}
+
+def Kernel_Nested(Subjects_Data, Outer_Test_Index, Inner_Test_Index, Subjects_Index=None, Block_Size=4096):
+    #
+    # Kernel cache of a nested cross-validation, the Gram matrices of all the outer folds and all their inner folds from one pass
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Outer_Test_Index:
+    #     List of the testing subjects index of each outer fold, an empty array for a model of all the subjects (e.g., the weights)
+    # Inner_Test_Index:
+    #     Inner_Test_Index[j] is the list of the testing index of each inner fold of the j-th outer fold, as positions
+    #     in the training subjects of the outer fold, i.e., np.delete(np.arange(n), Outer_Test_Index[j])
+    # Subjects_Index:
+    #     Optional, the order of the subjects, e.g., sorted by the scores; the positions in Outer_Test_Index are of
+    #     Subjects_Data[Subjects_Index, :] and the Gram matrices are in this order, without a sorted copy of the data
+    # Block_Size:
+    #     Quantity of features processed at a time
+    #
+    # Return:
+    #     Cache, the output of 'Kernel_Cache', with
+    #         'Gram': Gram[j] is the n*n Gram matrix of all the subjects scaled by the range of the training subjects of the j-th outer fold
+    #         'Inner_Gram': Inner_Gram[j][k] is the Gram matrix of the training subjects of the j-th outer fold (in their order),
+    #                       scaled by the range of the training subjects of its k-th inner fold
+    #
+
+    Subjects_Quantity = np.shape(Subjects_Data)[0]
+    if Subjects_Index is None:
+        Subjects_Index = np.arange(Subjects_Quantity)
+    Training_Index = []
+    Kernel_Index = []
+    Base_Index = []
+    for j in np.arange(len(Outer_Test_Index)):
+        Outer_Training_Index = np.delete(Subjects_Index, Outer_Test_Index[j])
+        Outer_Position = len(Training_Index)
+        Training_Index.append(Outer_Training_Index)
+        Kernel_Index.append(Subjects_Index)
+        Base_Index.append(-1)
+        for Inner_Fold_K_Index in Inner_Test_Index[j]:
+            Training_Index.append(np.delete(Outer_Training_Index, Inner_Fold_K_Index))
+            Kernel_Index.append(Outer_Training_Index)
+            Base_Index.append(Outer_Position)
+    Cache = Kernel_Cache(Subjects_Data, Training_Index, Kernel_Index, Base_Index, Block_Size)
+
+    Gram = Cache['Gram']
+    Cache['Gram'] = []
+    Cache['Inner_Gram'] = []
+    Position = 0
+    for j in np.arange(len(Outer_Test_Index)):
+        Cache['Gram'].append(Gram[Position])
+        Cache['Inner_Gram'].append(Gram[Position + 1:Position + 1 + len(Inner_Test_Index[j])])
+        Position = Position + 1 + len(Inner_Test_Index[j])
+    return Cache
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Warm-started regularization path of Lasso and ElasticNet
+# The alphas are fitted from the largest to the smallest, and each coordinate descent starts from the coefficients
+# of the previous alpha instead of zero, so only a few iterations are needed for each alpha
+# 'Path_Screen_Predict' also screens the features of each alpha with the sequential strong rule, see Common_CZ_Screen
+#
+
+import numpy as np
+from sklearn import linear_model
+from Common_CZ_Score import Score_Evaluate
+from Common_CZ_Screen import Screen_Fit
+
+def Path_Predict(Training_Data, Training_Score, Testing_Data, Alpha_Range, L1_ratio=1, Saturation_Flag=0):
+    #
+    # Predictions of Lasso (L1_ratio = 1) or ElasticNet for all the alphas in Alpha_Range, along a warm-started path
+    # Each fit converges to the same solution with a new linear_model.Lasso / ElasticNet, up to the tolerance of coordinate descent
+    #
+    # Training_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    # Testing_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Alpha_Range:
+    #     Range of alpha, in any order
+    # L1_ratio:
+    #     The L1_ratio of ElasticNet, 1 is Lasso
+    # Saturation_Flag:
+    #     1: stop the path when the active set saturates, i.e., all the features are selected,
+    #        or, for Lasso, as many features as training subjects are selected;
+    #        the smaller alphas are not fitted and get the predictions of the last fitted alpha
+    #     0: fit all the alphas (default)
+    #
+    # Return:
+    #     Predict_Score, n*len(Alpha_Range) matrix, n is testing subjects quantity
+    #     The l-th column is the prediction with Alpha_Range[l]
+    #
+
+    Subjects_Quantity, Features_Quantity = np.shape(Training_Data)
+    if L1_ratio == 1:
+        clf = linear_model.Lasso(warm_start=True)
+        Saturation_Quantity = min(Subjects_Quantity, Features_Quantity)
+    else:
+        clf = linear_model.ElasticNet(l1_ratio=L1_ratio, warm_start=True)
+        Saturation_Quantity = Features_Quantity
+
+    Predict_Score = np.zeros((np.shape(Testing_Data)[0], len(Alpha_Range)))
+    Descending_Index = np.argsort(Alpha_Range)[::-1]
+    for l in np.arange(len(Descending_Index)):
+        clf.alpha = Alpha_Range[Descending_Index[l]]
+        clf.fit(Training_Data, Training_Score)
+        Predict_Score[:, Descending_Index[l]] = clf.predict(Testing_Data)
+        if Saturation_Flag and np.count_nonzero(clf.coef_) >= Saturation_Quantity:
+            Predict_Score[:, Descending_Index[l + 1:]] = Predict_Score[:, Descending_Index[l]][:, np.newaxis]
+            break
+    return Predict_Score
+
+def Path_Screen_Predict(Training_Data, Training_Score, Testing_Data, Alpha_Range, L1_ratio=1, Saturation_Flag=0):
+    #
+    # The same with 'Path_Predict', while each alpha is fitted by 'Screen_Fit' in Common_CZ_Screen with the previous alpha of the path:
+    # the features are screened by the sequential strong rule with the residual of the previous alpha, and the coordinate descent
+    # starts from its coefficients; the discarded features are checked with the KKT conditions, so the solutions are not changed
+    # Variables are the same with function 'Path_Predict'
+    #
+    # Return:
+    #     Predict_Score, the same with 'Path_Predict'
+    #     Screen_Info, dict of len(Alpha_Range)*1 vectors, 'Fit_Time', 'Discarded_Quantity' and 'KKT_Violation_Quantity'
+    #     of the fit of each alpha, see 'Screen_Fit'; 0 for the alphas not fitted with Saturation_Flag
+    #
+
+    Subjects_Quantity, Features_Quantity = np.shape(Training_Data)
+    if L1_ratio == 1:
+        Saturation_Quantity = min(Subjects_Quantity, Features_Quantity)
+    else:
+        Saturation_Quantity = Features_Quantity
+
+    Predict_Score = np.zeros((np.shape(Testing_Data)[0], len(Alpha_Range)))
+    Screen_Info = {'Fit_Time': np.zeros(len(Alpha_Range)), 'Discarded_Quantity': np.zeros(len(Alpha_Range)), \
+        'KKT_Violation_Quantity': np.zeros(len(Alpha_Range))}
+    Previous = None
+    Descending_Index = np.argsort(Alpha_Range)[::-1]
+    for l in np.arange(len(Descending_Index)):
+        clf, Alpha_Screen_Info = Screen_Fit(Training_Data, Training_Score, Alpha_Range[Descending_Index[l]], L1_ratio, Previous)
+        Predict_Score[:, Descending_Index[l]] = clf.predict(Testing_Data)
+        for Key in Screen_Info:
+            Screen_Info[Key][Descending_Index[l]] = Alpha_Screen_Info[Key]
+        if Saturation_Flag and np.count_nonzero(clf.coef_) >= Saturation_Quantity:
+            Predict_Score[:, Descending_Index[l + 1:]] = Predict_Score[:, Descending_Index[l]][:, np.newaxis]
+            break
+        Previous = {'Alpha': Alpha_Range[Descending_Index[l]], 'Coef': clf.coef_, 'Residual': Training_Score - clf.predict(Training_Data)}
+    return (Predict_Score, Screen_Info)
+
+def Path_Evaluate(Predict_Score, Testing_Score):
+    #
+    # Correlation and inverse MAE of each column of the output of 'Path_Predict' (or of 'Ridge_Path_Predict'), the same with the SubAlpha functions
+    #
+    # Predict_Score:
+    #     n*A matrix, output of 'Path_Predict'
+    # Testing_Score:
+    #     n*1 vector, n is testing subjects quantity
+    #
+    # Return:
+    #     Fold_Corr, A*1 vector
+    #     Fold_MAE_inv, A*1 vector
+    #
+
+    # All the columns at once, see 'Score_Evaluate' in Common_CZ_Score
+    Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Testing_Score)
+    return (Fold_Corr, Fold_MAE_inv)
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# In-process permutation test
+# The permutations run in a pool of processes on this computer, the data is passed to the processes once
+# (copy-on-write by fork on Linux), instead of saving the data into a .mat file and starting a new python for each permutation
+# For LOOCV, 'Permutation_LOOCV' runs the permutations in blocks in this process instead, see the *_LOOCV_Permutation_Batch functions
+# 'Permutation_Adaptive' runs the permutations in waves, and stops as soon as the p-value is known to be below or above a threshold
+# (the processes of 'Permutation_Pool' can be kept for all the waves)
+# With Store_Flag = 1, the results of all the permutations are kept in one file instead of a folder for each, see Common_CZ_Store
+#
+
+import os
+import time
+import functools
+import contextlib
+import multiprocessing
+import numpy as np
+import scipy.io as sio
+from scipy import special
+from Common_CZ_Split import Split_Seed, Split_Generator, Split_Shuffle
+from Common_CZ_Store import Store_Open, Store_Folder, Store_Collect, Store_Null
+from Common_CZ_Score import Score_Corr
+from Common_CZ_Checkpoint import Checkpoint_Hash, Checkpoint_Same
+
+def Permutation_Run(Function, Times_IDRange, ResultantFolder, Max_Queued, Callback=None, Log_Name=None, Seed=None, Store_Flag=0, Pool=None):
+    #
+    # Run the permutations in Times_IDRange, the results of the i-th permutation are in ResultantFolder/Time_i
+    # The permutations with ResultantFolder/Time_i/Res_NFold.mat already existing are skipped,
+    # so an interrupted permutation test can be resumed by calling this function again
+    #
+    # Function:
+    #     Called as Function(ResultantFolder=ResultantFolder_I) for each permutation, and writes Res_NFold.mat into ResultantFolder_I
+    #     e.g., functools.partial(Ridge_KFold_Sort, Subjects_Data=Subjects_Data, ..., Permutation_Flag=1)
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(1000)
+    # ResultantFolder:
+    #     Path of the folder storing the results
+    # Max_Queued:
+    #     The maximum permutations running at the same time, i.e., the quantity of processes
+    # Callback:
+    #     Called as Callback(ResultantFolder_I, Finished_Quantity, Jobs_Quantity) in this process after each permutation finishes
+    #     Default is 'Permutation_Progress', which prints the progress
+    # Log_Name:
+    #     If given, the output of each permutation is written into ResultantFolder_I/Log_Name instead of the screen
+    # Seed:
+    #     None: each permutation draws from the random state of numpy, seeded again in each process (default)
+    #     An integer: the i-th permutation is called as Function(ResultantFolder=ResultantFolder_I, Seed=Split_Seed(Seed, i)),
+    #     and draws from its own stream (see 'Split_Generator' in Common_CZ_Split), so the results do not depend on the processes,
+    #     and the i-th permutation can be recomputed alone, e.g., with Times_IDRange = [i]
+    # Store_Flag:
+    #     1: after each permutation finishes, its folder is appended to ResultantFolder/Res_Store.ckpt and removed, see 'Store_Folder'
+    #        in Common_CZ_Store; the permutations in the store are skipped, and finished folders not in the store are appended first
+    #     0: the results are kept in the folder of each permutation (default)
+    # Pool:
+    #     Optional, a pool of 'Permutation_Pool' with the same Function and Log_Name, which is left open for the next call,
+    #     e.g., the next wave of 'Permutation_Adaptive'; by default a pool is created for this call and closed after it
+    #
+    # Return:
+    #     Finished_Quantity, quantity of the permutations run by this call
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    if Callback is None:
+        Callback = Permutation_Progress
+    if Store_Flag:
+        Store = Store_Open(ResultantFolder)
+        Times_IDRange = Store_Collect(Store, ResultantFolder, Times_IDRange)
+        Callback = functools.partial(Permutation_Store, Store, Callback)
+    Task_Todo = []
+    for i in np.arange(len(Times_IDRange)):
+        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
+        if not os.path.exists(ResultantFolder_I):
+            os.mkdir(ResultantFolder_I)
+        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
+            Task_Todo.append((ResultantFolder_I, Split_Seed(Seed, Times_IDRange[i])))
+
+    Jobs_Quantity = len(Task_Todo)
+    Finished_Quantity = 0
+    if not Jobs_Quantity:
+        return Finished_Quantity
+    if Pool is not None:
+        for ResultantFolder_I in Pool.imap_unordered(Permutation_Task, Task_Todo):
+            Finished_Quantity = Finished_Quantity + 1
+            Callback(ResultantFolder_I, Finished_Quantity, Jobs_Quantity)
+        return Finished_Quantity
+    Pool = Permutation_Pool(Function, min(Max_Queued, Jobs_Quantity), Log_Name)
+    try:
+        for ResultantFolder_I in Pool.imap_unordered(Permutation_Task, Task_Todo):
+            Finished_Quantity = Finished_Quantity + 1
+            Callback(ResultantFolder_I, Finished_Quantity, Jobs_Quantity)
+        Pool.close()
+    finally:
+        Pool.terminate()
+        Pool.join()
+    return Finished_Quantity
+
+def Permutation_Pool(Function, Max_Queued, Log_Name=None):
+    #
+    # Pool of Max_Queued processes running the permutations of Function, see 'Permutation_Run'
+    # With fork, the processes share the data of Function with this process until it is modified
+    #
+    # Return:
+    #     Pool, multiprocessing.Pool, to be closed by the caller, e.g., with Pool.terminate() and Pool.join()
+    #
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        Context = multiprocessing.get_context('fork')
+    else:
+        Context = multiprocessing.get_context()
+    return Context.Pool(processes=Max_Queued, initializer=Permutation_Init, initargs=(Function, Log_Name))
+
+def Permutation_Progress(ResultantFolder_I, Finished_Quantity, Jobs_Quantity):
+    #
+    # Default callback of 'Permutation_Run', print the finished permutation
+    #
+    print(ResultantFolder_I + '/Res_NFold.mat')
+    print(time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime(time.time())))
+    print('Finish quantity = ' + str(Finished_Quantity) + '/' + str(Jobs_Quantity))
+
+def Permutation_Store(Store, Callback, ResultantFolder_I, Finished_Quantity, Jobs_Quantity):
+    #
+    # Callback of 'Permutation_Run' with Store_Flag = 1, the callback given, then the folder is moved into the store
+    #
+    Callback(ResultantFolder_I, Finished_Quantity, Jobs_Quantity)
+    Store_Folder(Store, ResultantFolder_I)
+
+_Permutation_Function = None
+_Permutation_Log_Name = None
+
+def Permutation_Init(Function, Log_Name):
+    #
+    # Initializer of each process of 'Permutation_Run'
+    #
+    global _Permutation_Function, _Permutation_Log_Name
+    _Permutation_Function = Function
+    _Permutation_Log_Name = Log_Name
+
+def Permutation_Task(Task):
+    #
+    # One permutation in a process of 'Permutation_Run', Task is (ResultantFolder_I, Seed_I)
+    #
+    ResultantFolder_I, Seed_I = Task
+    if Seed_I is None:
+        # Forked processes inherit the same random state, so each permutation is seeded separately
+        np.random.seed()
+        Function = _Permutation_Function
+    else:
+        Function = functools.partial(_Permutation_Function, Seed=Seed_I)
+    if _Permutation_Log_Name is None:
+        Function(ResultantFolder=ResultantFolder_I)
+    else:
+        with open(ResultantFolder_I + '/' + _Permutation_Log_Name, 'w') as Log_File, \
+                contextlib.redirect_stdout(Log_File), contextlib.redirect_stderr(Log_File):
+            Function(ResultantFolder=ResultantFolder_I)
+    return ResultantFolder_I
+
+def Permutation_LOOCV(Function, Subjects_Score, Times_IDRange, ResultantFolder, Block_Size=100, Seed=None, Setting=None):
+    #
+    # Permutation test of a LOOCV, with the permutations run in blocks, and the null distribution in one file
+    # Function gets the permutations of a block at once, so the work depending only on the data (scaling, decompositions)
+    # is shared by all the permutations of the block, instead of being repeated by a new process for each permutation
+    # The training scores of each permutation and each loop are permuted in the same order as the *_LOOCV functions with Permutation_Flag = 1,
+    # so for Ridge the permutations are the same with running 'Ridge_LOOCV' one by one with the same random state
+    # (linear_model.Lasso and ElasticNet also draw from the random state of numpy in each fit, so their permutations differ, not their distribution)
+    # With Seed, the i-th permutation is the same with the *_LOOCV functions with Seed = Split_Seed(Seed, i), for all the models
+    #
+    # Function:
+    #     Called as Function(Random_Index), Random_Index is a P*n*(n-1) array, Random_Index[i, j] is the permutation of
+    #     the training scores of the j-th loop in the i-th permutation; returns the n*P matrix of the LOOCV predictions
+    #     e.g., functools.partial(Ridge_LOOCV_Batch, Subjects_Data, Subjects_Score, Alpha_Range, ...)
+    # Subjects_Score:
+    #     n*1 vector, n is subjects quantity
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(1000)
+    # ResultantFolder:
+    #     Path of the folder storing ResultantFolder/Res_Permutation.mat, which is updated after each block
+    #     The permutations already in the file are skipped, so an interrupted permutation test can be resumed by calling this function again
+    #     with the same setting; a file of another setting (or without a setting) is discarded and the permutation test starts over
+    # Block_Size:
+    #     Quantity of permutations run together, the memory of a block is about Block_Size * n^2 values
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from Split_Generator(Split_Seed(Seed, i)), see 'Split_Generator' in Common_CZ_Split
+    # Setting:
+    #     dict of the arrays (or numbers) identifying the test, e.g., 'Checkpoint_Hash' of the data and the scores and the parameter ranges,
+    #     saved into Res_Permutation.mat as 'Setting_<Key>' with Seed and the hash of Subjects_Score, see 'Checkpoint_Open' in Common_CZ_Checkpoint
+    #
+    # Return:
+    #     Res_Permutation, dict with
+    #         'Times_IDRange': the index of the finished permutations
+    #         'Corr', 'MAE': the Corr and MAE of each finished permutation, the null distribution
+    #         'Observed_Corr', 'Observed_MAE': the Corr and MAE of the LOOCV without permutation
+    #         'P_Value_Corr': (1 + quantity of Corr >= Observed_Corr) / (1 + quantity of permutations)
+    #         'P_Value_MAE': (1 + quantity of MAE <= Observed_MAE) / (1 + quantity of permutations)
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    Subjects_Quantity = len(Subjects_Score)
+    ResultantFile = os.path.join(ResultantFolder, 'Res_Permutation.mat')
+    Setting = dict({} if Setting is None else Setting, Seed=Seed, Score=Checkpoint_Hash(Subjects_Score))
+    # None (e.g., Seed) is saved as an empty array, and the arrays are compared flattened as .mat files keep 2 dimensions at least
+    Setting = {'Setting_' + Key: np.ravel([] if Setting[Key] is None else Setting[Key]) for Key in Setting}
+    Res_Permutation = {}
+    if os.path.exists(ResultantFile):
+        Res_Permutation = sio.loadmat(ResultantFile, squeeze_me=True)
+        Setting_File = {Key: np.ravel(Res_Permutation[Key]) for Key in Res_Permutation if Key.startswith('Setting_')}
+        if not Checkpoint_Same(Setting_File, Setting):
+            # Another setting in the same folder
+            print('The setting differs from ' + ResultantFile + ', the permutation test starts over')
+            Res_Permutation = {}
+    if Res_Permutation:
+        Res_Permutation = {'Times_IDRange': np.atleast_1d(Res_Permutation['Times_IDRange']), 'Corr': np.atleast_1d(Res_Permutation['Corr']), \
+            'MAE': np.atleast_1d(Res_Permutation['MAE']), 'Observed_Corr': float(Res_Permutation['Observed_Corr']), \
+            'Observed_MAE': float(Res_Permutation['Observed_MAE'])}
+    else:
+        Res_Permutation = {'Times_IDRange': np.zeros(0, dtype=int), 'Corr': np.zeros(0), 'MAE': np.zeros(0)}
+
+    Times_Todo = np.asarray(Times_IDRange)[~np.isin(Times_IDRange, Res_Permutation['Times_IDRange'])]
+    Block_Start_Range = np.arange(0, len(Times_Todo), Block_Size)
+    if not len(Block_Start_Range) and 'Observed_Corr' not in Res_Permutation:
+        # Only the LOOCV without permutation
+        Block_Start_Range = [0]
+    for Block_Start in Block_Start_Range:
+        Times_Block = Times_Todo[Block_Start:Block_Start + Block_Size]
+        Random_Index = np.zeros((len(Times_Block), Subjects_Quantity, Subjects_Quantity - 1), dtype=int)
+        for i in np.arange(len(Times_Block)):
+            Random_Generator = Split_Generator(Split_Seed(Seed, Times_Block[i]))
+            for j in np.arange(Subjects_Quantity):
+                Subjects_Index_Random = np.arange(Subjects_Quantity - 1)
+                Split_Shuffle(Subjects_Index_Random, Random_Generator)
+                Random_Index[i, j] = Subjects_Index_Random
+        Observed_Flag = 'Observed_Corr' not in Res_Permutation
+        if Observed_Flag:
+            # The LOOCV without permutation, i.e., all the loops with the identity permutation, is run with the first block
+            Identity_Index = np.tile(np.arange(Subjects_Quantity - 1), (1, Subjects_Quantity, 1))
+            Random_Index = np.concatenate((Identity_Index, Random_Index))
+        Block_Corr, Block_MAE = Permutation_Evaluate(Function(Random_Index), Subjects_Score)
+        if Observed_Flag:
+            Res_Permutation['Observed_Corr'] = Block_Corr[0]
+            Res_Permutation['Observed_MAE'] = Block_MAE[0]
+            Block_Corr = Block_Corr[1:]
+            Block_MAE = Block_MAE[1:]
+        Res_Permutation['Times_IDRange'] = np.append(Res_Permutation['Times_IDRange'], Times_Block)
+        Res_Permutation['Corr'] = np.append(Res_Permutation['Corr'], Block_Corr)
+        Res_Permutation['MAE'] = np.append(Res_Permutation['MAE'], Block_MAE)
+        Permutation_P_Value(Res_Permutation)
+        sio.savemat(ResultantFile, dict(Res_Permutation, **Setting))
+        print('Finish quantity = ' + str(Block_Start + len(Times_Block)) + '/' + str(len(Times_Todo)))
+    Permutation_P_Value(Res_Permutation)
+    return Res_Permutation
+
+def Permutation_Evaluate(Predict_Score, Subjects_Score):
+    #
+    # Corr and MAE of each column of the LOOCV predictions, the same with np.corrcoef and the MAE of the *_LOOCV functions
+    #
+    # Predict_Score:
+    #     n*P matrix
+    # Subjects_Score:
+    #     n*1 vector
+    #
+    # Return:
+    #     Corr, P*1 vector
+    #     MAE, P*1 vector
+    #
+
+    Corr = Permutation_Corr(Predict_Score, Subjects_Score[:, np.newaxis])
+    MAE = np.mean(np.abs(Predict_Score - Subjects_Score[:, np.newaxis]), axis=0)
+    return (Corr, MAE)
+
+def Permutation_Corr(Predict_Score, Testing_Score):
+    #
+    # Correlation along the first axis, e.g., of the predictions of all the parameters and permutations with their scores,
+    # see 'Score_Corr' in Common_CZ_Score
+    #
+    return Score_Corr(Predict_Score, Testing_Score)
+
+def Permutation_P_Value(Res_Permutation):
+    #
+    # Empirical p-values of 'Permutation_LOOCV', written into Res_Permutation
+    #
+    Permutation_Quantity = len(Res_Permutation['Corr'])
+    Res_Permutation['P_Value_Corr'] = (1 + np.sum(Res_Permutation['Corr'] >= Res_Permutation['Observed_Corr'])) / (1 + Permutation_Quantity)
+    Res_Permutation['P_Value_MAE'] = (1 + np.sum(Res_Permutation['MAE'] <= Res_Permutation['Observed_MAE'])) / (1 + Permutation_Quantity)
+
+def Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Value, Result_Name, Statistic_Name, P_Threshold=0.05, Error_Rate=0.01, Wave_Size=10, Store_Flag=0, Pool=None):
+    #
+    # Adaptive permutation test, the permutations in Times_IDRange are run in waves until the p-value is decided
+    # After each wave, with g of the n finished permutations at least as large as Observed_Value, two anytime-valid tests are checked
+    # (mixture likelihood ratios of the binomial with the p-value uniform below or above P_Threshold, Ville's inequality):
+    #     p < P_Threshold is decided if  int_0^P_Threshold q^g (1-q)^(n-g) dq / P_Threshold >= P_Threshold^g (1-P_Threshold)^(n-g) / Error_Rate
+    #     p > P_Threshold is decided if  int_P_Threshold^1 q^g (1-q)^(n-g) dq / (1-P_Threshold) >= P_Threshold^g (1-P_Threshold)^(n-g) / Error_Rate
+    # The probability of a wrong decision is at most Error_Rate, however many waves are checked
+    # e.g., with P_Threshold = 0.05 and Error_Rate = 0.01, about 130 permutations decide an observed value larger than all of them,
+    # and a few tens decide a null result, instead of all the permutations of Times_IDRange
+    #
+    # Run_Function:
+    #     Called as Run_Function(Times_IDRange=Times_Wave), runs the permutations of Times_Wave, and writes ResultantFolder/Time_i/Result_Name
+    #     e.g., functools.partial(Ridge_KFold_Sort_Permutation, Subjects_Data=Subjects_Data, ...) without Times_IDRange
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(5000), the maximum quantity of permutations
+    # ResultantFolder:
+    #     Path of the folder storing the results, the summary is in ResultantFolder/Res_Adaptive.mat
+    # Observed_Value:
+    #     The statistic without permutation, e.g., Mean_Corr of 'Ridge_KFold_Sort' with Permutation_Flag = 0
+    # Result_Name:
+    #     Name of the result file of each permutation, e.g., 'Res_NFold.mat'
+    # Statistic_Name:
+    #     Name of the statistic in the result file, larger is better, e.g., 'Mean_Corr'; nan is taken as 0
+    # P_Threshold:
+    #     The threshold of the p-value, 0.05 by default
+    # Error_Rate:
+    #     The probability of a wrong decision, 0.01 by default
+    # Wave_Size:
+    #     Quantity of permutations run between two checks
+    # Store_Flag:
+    #     1: the statistic is read from the result store of Run_Function, ResultantFolder/Res_Store.ckpt, see 'Store_Null' in Common_CZ_Store
+    #     0: the statistic is read from ResultantFolder/Time_i/Result_Name (default)
+    # Pool:
+    #     Optional, the pool of 'Permutation_Pool' used by Run_Function in all the waves (see 'Permutation_Run'), instead of
+    #     a new pool of processes for each wave; it is closed by this function after the decision
+    #
+    # Return:
+    #     Res_Adaptive, dict with
+    #         'Times_IDRange': the index of the permutations run
+    #         'Null': the statistic of each permutation run, the partial null distribution
+    #         'Observed': Observed_Value
+    #         'Permutation_Quantity': quantity of the permutations run, n
+    #         'Exceed_Quantity': quantity of the permutations with the statistic at least Observed_Value, g
+    #         'P_Value': (g + 1) / (n + 1)
+    #         'Decision': 1, p < P_Threshold; -1, p > P_Threshold; 0, not decided after all the permutations of Times_IDRange
+    #         'P_Threshold', 'Error_Rate'
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    Times_IDRange = np.asarray(Times_IDRange)
+    Null = np.zeros(0)
+    Decision = 0
+    try:
+        for Wave_Start in np.arange(0, len(Times_IDRange), Wave_Size):
+            Times_Wave = Times_IDRange[Wave_Start:Wave_Start + Wave_Size]
+            # The permutations already finished are skipped by Run_Function
+            Run_Function(Times_IDRange=Times_Wave)
+            if Store_Flag:
+                Wave_Null = Store_Null(ResultantFolder, Result_Name[:-len('.mat')] + '/' + Statistic_Name, Times_Wave)[1]
+            else:
+                Wave_Null = [sio.loadmat(ResultantFolder + '/Time_' + str(Times_Wave[i]) + '/' + Result_Name)[Statistic_Name][0, 0] \
+                    for i in np.arange(len(Times_Wave))]
+            Null = np.append(Null, np.nan_to_num(Wave_Null))
+            Decision = Permutation_Decision(np.sum(Null >= Observed_Value), len(Null), P_Threshold, Error_Rate)
+            print('Permutation quantity = ' + str(len(Null)) + ', decision = ' + str(Decision))
+            if Decision:
+                break
+    finally:
+        if Pool is not None:
+            # All the permutations of the last wave are finished, or the waves are stopped by an error
+            Pool.terminate()
+            Pool.join()
+
+    Exceed_Quantity = np.sum(Null >= Observed_Value)
+    Res_Adaptive = {'Times_IDRange': Times_IDRange[:len(Null)], 'Null': Null, 'Observed': Observed_Value, 'Permutation_Quantity': len(Null), \
+        'Exceed_Quantity': Exceed_Quantity, 'P_Value': (Exceed_Quantity + 1) / (len(Null) + 1), 'Decision': Decision, \
+        'P_Threshold': P_Threshold, 'Error_Rate': Error_Rate}
+    sio.savemat(os.path.join(ResultantFolder, 'Res_Adaptive.mat'), Res_Adaptive)
+    return Res_Adaptive
+
+def Permutation_Decision(Exceed_Quantity, Permutation_Quantity, P_Threshold, Error_Rate):
+    #
+    # Decision of 'Permutation_Adaptive' after Permutation_Quantity permutations with Exceed_Quantity at least the observed value
+    #
+    # Return:
+    #     Decision, 1: p < P_Threshold; -1: p > P_Threshold; 0: not decided
+    #
+
+    g = Exceed_Quantity
+    n = Permutation_Quantity
+    # log of P_Threshold^g (1-P_Threshold)^(n-g), the likelihood at the threshold
+    Log_Null = special.xlogy(g, P_Threshold) + special.xlog1py(n - g, -P_Threshold)
+    Log_Beta = special.betaln(g + 1, n - g + 1)
+    with np.errstate(divide='ignore'):
+        # The integrals below and above P_Threshold, with 1 - I_x(a, b) = I_(1-x)(b, a)
+        Log_Below = Log_Beta + np.log(special.betainc(g + 1, n - g + 1, P_Threshold)) - np.log(P_Threshold)
+        Log_Above = Log_Beta + np.log(special.betainc(n - g + 1, g + 1, 1 - P_Threshold)) - np.log(1 - P_Threshold)
+    if Log_Below - Log_Null >= -np.log(Error_Rate):
+        return 1
+    if Log_Above - Log_Null >= -np.log(Error_Rate):
+        return -1
+    return 0
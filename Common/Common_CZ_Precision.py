@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# float32 computation of the cross-validation functions (Float32_Flag = 1)
+# The data are converted to float32 once; then the copies of the folds (np.delete, 'Fold_Data'), the MinMax scaled data
+# (preprocessing.MinMaxScaler keeps float32) and linear_model.Ridge / Lasso / ElasticNet work in float32,
+# i.e., half of the memory and about twice the BLAS throughput, while the scores, the predictions and Corr / MAE are float64
+# The Gram matrices of the kernel paths (see Common_CZ_Kernel and 'Scale_Gram') are still accumulated in float64
+# 'Precision_Validate' runs a function with float64 and float32 on reference datasets, and checks the selected parameters
+# and Corr / MAE are the same within tolerance
+#
+
+import os
+import numpy as np
+import scipy.io as sio
+from scipy import sparse
+
+_Precision_Parameter_Names = ('Alpha', 'L1_ratio', 'alpha', 'l1_ratio')
+
+def Precision_Data(Subjects_Data, Float32_Flag=0, Block_Size=4096):
+    #
+    # Subjects_Data in the precision of the computation
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity, e.g., the output of 'Data_Open' in Common_CZ_Data
+    # Float32_Flag:
+    #     1: a float32 copy of Subjects_Data, or Subjects_Data itself if it is already float32
+    #        A memory-mapped Subjects_Data is copied block by block of features, so the float64 data are never loaded at once
+    #     0: Subjects_Data as it is (default)
+    # Block_Size:
+    #     Quantity of features copied at a time, only for memory-mapped data
+    #
+    # Return:
+    #     Subjects_Data, n*m matrix
+    #
+
+    if not Float32_Flag or Subjects_Data.dtype == np.float32:
+        return Subjects_Data
+    if sparse.issparse(Subjects_Data):
+        return Subjects_Data.astype(np.float32)
+    if not isinstance(Subjects_Data, np.memmap):
+        return np.asarray(Subjects_Data, dtype=np.float32)
+    Features_Quantity = np.shape(Subjects_Data)[1]
+    Data_Float32 = np.empty(np.shape(Subjects_Data), dtype=np.float32)
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Data_Float32[:, Block] = Subjects_Data[:, Block]
+    return Data_Float32
+
+def Precision_Reference(Subjects_Quantity=100, Split_Flag=0, Seed=0):
+    #
+    # Reference datasets for 'Precision_Validate', simulated with a fixed seed
+    #     'Connectivity': more features than subjects, correlation coefficients in (-1, 1), e.g., functional connectivity
+    #     'Morphology': fewer features than subjects, with a large offset and a small spread, e.g., cortical thickness or volumes,
+    #                   where float32 loses the most digits in the MinMax scaling
+    #     'Sparse_Signal': more features than subjects, with the scores from only a few of the features
+    #
+    # Subjects_Quantity:
+    #     Quantity of subjects of each dataset
+    # Split_Flag:
+    #     1: the datasets of the *_APredictB functions, the first half of the subjects are training and the others are testing,
+    #        with 'Training_Data', 'Training_Score', 'Testing_Data' and 'Testing_Score'
+    #     0: the datasets of the *_KFold_Sort and *_LOOCV functions, with 'Subjects_Data' and 'Subjects_Score' (default)
+    # Seed:
+    #     Seed of np.random.RandomState
+    #
+    # Return:
+    #     Datasets, dict of the datasets keyed by name, each a dict of the data arguments of the function
+    #
+
+    Random_State = np.random.RandomState(Seed)
+    Datasets = {}
+
+    Latent = Random_State.randn(Subjects_Quantity, 10)
+    Subjects_Data = np.tanh(np.dot(Latent, Random_State.randn(10, 2000)) / 4 + 0.3 * Random_State.randn(Subjects_Quantity, 2000))
+    Subjects_Score = np.dot(Latent[:, :3], [1, -0.5, 0.25]) + 0.5 * Random_State.randn(Subjects_Quantity)
+    Datasets['Connectivity'] = (Subjects_Data, Subjects_Score)
+
+    Subjects_Data = 2500 + 0.05 * np.cumsum(Random_State.randn(Subjects_Quantity, 60), axis=1)
+    Subjects_Score = (Subjects_Data[:, 10] - Subjects_Data[:, 40]) * 10 + 0.5 * Random_State.randn(Subjects_Quantity)
+    Datasets['Morphology'] = (Subjects_Data, Subjects_Score)
+
+    Subjects_Data = Random_State.randn(Subjects_Quantity, 1000)
+    Subjects_Score = np.dot(Subjects_Data[:, :5], [2, -2, 1.5, -1, 1]) + Random_State.randn(Subjects_Quantity)
+    Datasets['Sparse_Signal'] = (Subjects_Data, Subjects_Score)
+
+    for Name in Datasets:
+        Subjects_Data, Subjects_Score = Datasets[Name]
+        if Split_Flag:
+            Training_Quantity = Subjects_Quantity // 2
+            Datasets[Name] = {'Training_Data': Subjects_Data[:Training_Quantity], 'Training_Score': Subjects_Score[:Training_Quantity], \
+                'Testing_Data': Subjects_Data[Training_Quantity:], 'Testing_Score': Subjects_Score[Training_Quantity:]}
+        else:
+            Datasets[Name] = {'Subjects_Data': Subjects_Data, 'Subjects_Score': Subjects_Score}
+    return Datasets
+
+def Precision_Validate(Run_Function, Datasets, ResultantFolder, Corr_Tolerance=0.01, MAE_Tolerance=0.01, Parameter_Agreement=0.8):
+    #
+    # Run a function with Float32_Flag = 0 and 1 on each dataset, and compare the selected parameters and Corr / MAE
+    #
+    # Run_Function:
+    #     One of the functions with Float32_Flag, with all the arguments except the data, ResultantFolder and Float32_Flag,
+    #     e.g., functools.partial(Ridge_KFold_Sort, Fold_Quantity=5, Alpha_Range=Alpha_Range, Parallel_Quantity=1, Permutation_Flag=0)
+    #     It is called as Run_Function(**Datasets[Name], ResultantFolder=..., Float32_Flag=...), and returns (Corr, MAE)
+    # Datasets:
+    #     dict of the datasets keyed by name, each a dict of the data arguments of Run_Function, e.g., the output of 'Precision_Reference'
+    # ResultantFolder:
+    #     Path of the folder storing the results, the results of each dataset are in ResultantFolder/<Name>/Float64 and
+    #     ResultantFolder/<Name>/Float32, and the comparison of all the datasets is in ResultantFolder/Res_Precision.mat
+    # Corr_Tolerance:
+    #     The largest absolute difference of Corr
+    # MAE_Tolerance:
+    #     The largest relative difference of MAE, |MAE_32 - MAE_64| / MAE_64
+    # Parameter_Agreement:
+    #     The smallest proportion of the selected parameters (alpha, and l1 ratio of ElasticNet, saved in the .mat files of the results,
+    #     e.g., of each outer fold of the *_KFold_Sort functions or each subject of the *_LOOCV functions) that are the same
+    #     A parameter may change where two neighbouring values have nearly the same inner evaluation, generally with nearly the same prediction
+    #
+    # Return:
+    #     Res_Precision, dict with
+    #         'Name': the names of the datasets
+    #         'Corr_64', 'Corr_32', 'MAE_64', 'MAE_32': Corr and MAE of each dataset
+    #         'Parameter_Agreement': the proportion of the same selected parameters of each dataset, 1 if there are none
+    #         'Pass': 1 if Corr, MAE and the parameters of each dataset are within tolerance
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    Name_List = sorted(Datasets)
+    Dataset_Quantity = len(Name_List)
+    Res_Precision = {'Name': np.array(Name_List, dtype=object), 'Corr_64': np.zeros(Dataset_Quantity), 'Corr_32': np.zeros(Dataset_Quantity), \
+        'MAE_64': np.zeros(Dataset_Quantity), 'MAE_32': np.zeros(Dataset_Quantity), 'Parameter_Agreement': np.zeros(Dataset_Quantity), \
+        'Pass': np.zeros(Dataset_Quantity, dtype=int)}
+    for i in np.arange(Dataset_Quantity):
+        ResultantFolder_I = os.path.join(ResultantFolder, Name_List[i])
+        if not os.path.exists(ResultantFolder_I):
+            os.mkdir(ResultantFolder_I)
+        Parameter = []
+        for Float32_Flag, Precision_Name in ((0, '64'), (1, '32')):
+            Precision_Folder = os.path.join(ResultantFolder_I, 'Float' + Precision_Name)
+            Corr, MAE = Run_Function(**Datasets[Name_List[i]], ResultantFolder=Precision_Folder, Float32_Flag=Float32_Flag)
+            Res_Precision['Corr_' + Precision_Name][i] = Corr
+            Res_Precision['MAE_' + Precision_Name][i] = MAE
+            Parameter.append(Precision_Parameter(Precision_Folder))
+        Res_Precision['Parameter_Agreement'][i] = np.mean(Parameter[0] == Parameter[1]) if len(Parameter[0]) else 1
+        Corr_Difference = np.abs(Res_Precision['Corr_32'][i] - Res_Precision['Corr_64'][i])
+        MAE_Difference = np.abs(Res_Precision['MAE_32'][i] - Res_Precision['MAE_64'][i]) / Res_Precision['MAE_64'][i]
+        Res_Precision['Pass'][i] = int(Corr_Difference <= Corr_Tolerance and MAE_Difference <= MAE_Tolerance and \
+            Res_Precision['Parameter_Agreement'][i] >= Parameter_Agreement)
+    sio.savemat(os.path.join(ResultantFolder, 'Res_Precision.mat'), Res_Precision)
+    return Res_Precision
+
+def Precision_Parameter(ResultantFolder):
+    #
+    # The selected parameters saved in the .mat files of a folder, in the order of the file names and the variable names
+    #
+    Parameter = []
+    for File_Name in sorted(os.listdir(ResultantFolder)):
+        if File_Name.endswith('.mat'):
+            Mat = sio.loadmat(os.path.join(ResultantFolder, File_Name))
+            for Key in _Precision_Parameter_Names:
+                if Key in Mat:
+                    Parameter.append(np.ravel(Mat[Key]))
+    return np.concatenate(Parameter) if Parameter else np.zeros(0)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Split-aware MinMax scaling
+# preprocessing.MinMaxScaler maps feature f to (x_f - min_f) / range_f, with min_f and range_f of the training subjects
+# The shift is absorbed by the intercept of linear models, so only the range of each training split matters,
+# and the per-split ranges are computed here for all the splits at once, without a scaled copy of the data per split
+#
+
+import numpy as np
+
+def Scale_Fold_Range(Subjects_Data, Fold_Index, Block_Size=4096):
+    #
+    # Min and range of the training subjects of all the folds of a K-fold cross-validation, from per-fold reductions
+    # The training subjects of fold k are all the subjects out of Fold_Index[k]
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Fold_Index:
+    #     List of the testing subjects index of each fold, the folds should not overlap
+    # Block_Size:
+    #     Quantity of features read at a time, so a memory-mapped Subjects_Data is not copied at once
+    #
+    # Return:
+    #     Fold_Min, K*m matrix, K is fold quantity
+    #     Fold_Range, K*m matrix, the same with data_range_ of preprocessing.MinMaxScaler,
+    #     except that near-constant features are set to 1 as in its scale_
+    #
+
+    Fold_Quantity = len(Fold_Index)
+    Features_Quantity = np.shape(Subjects_Data)[1]
+    Subjects_Index = np.arange(np.shape(Subjects_Data)[0])
+    Rest_Index = np.setdiff1d(Subjects_Index, np.concatenate(Fold_Index))
+    # Min and max of each fold, and the subjects not in any fold (always in training)
+    Block_Min = np.full((Fold_Quantity + 1, Features_Quantity), np.inf)
+    Block_Max = np.full((Fold_Quantity + 1, Features_Quantity), -np.inf)
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Block_Data = Subjects_Data[:, Block]
+        for k in np.arange(Fold_Quantity):
+            Block_Min[k, Block] = np.min(Block_Data[Fold_Index[k]], axis=0)
+            Block_Max[k, Block] = np.max(Block_Data[Fold_Index[k]], axis=0)
+        if len(Rest_Index):
+            Block_Min[Fold_Quantity, Block] = np.min(Block_Data[Rest_Index], axis=0)
+            Block_Max[Fold_Quantity, Block] = np.max(Block_Data[Rest_Index], axis=0)
+
+    # The training min of fold k is the min of all the other blocks, i.e., of blocks 0, ..., k-1 and k+1, ..., K
+    Prefix_Min = np.vstack((np.full(Features_Quantity, np.inf), np.minimum.accumulate(Block_Min, axis=0)))
+    Suffix_Min = np.minimum.accumulate(Block_Min[::-1], axis=0)[::-1]
+    Prefix_Max = np.vstack((np.full(Features_Quantity, -np.inf), np.maximum.accumulate(Block_Max, axis=0)))
+    Suffix_Max = np.maximum.accumulate(Block_Max[::-1], axis=0)[::-1]
+    Fold_Min = np.minimum(Prefix_Min[:Fold_Quantity], Suffix_Min[1:])
+    Fold_Max = np.maximum(Prefix_Max[:Fold_Quantity], Suffix_Max[1:])
+    Fold_Range = Scale_Handle_Zeros(Fold_Max - Fold_Min)
+    return (Fold_Min, Fold_Range)
+
+def Scale_Order(Subjects_Data, Depth):
+    #
+    # Order statistics of each feature for leave-one-out (or leave-several-out) splits
+    # With the Depth smallest and largest values, the min and max after excluding at most Depth-1 subjects are known,
+    # see 'Scale_Exclude_Range'
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Depth:
+    #     Quantity of the smallest (largest) values kept for each feature, 2 for LOOCV, 3 for nested LOOCV
+    #
+    # Return:
+    #     Order, dict with 'Min_Value', 'Min_Index', 'Max_Value', 'Max_Index', each is a Depth*m matrix
+    #     sorted from the smallest (largest) value
+    #
+
+    Subjects_Quantity = np.shape(Subjects_Data)[0]
+    Depth = min(Depth, Subjects_Quantity)
+    Columns = np.arange(np.shape(Subjects_Data)[1])
+    Min_Index = np.argpartition(Subjects_Data, np.arange(Depth), axis=0)[:Depth]
+    Max_Index = np.argpartition(Subjects_Data, np.arange(Subjects_Quantity - Depth, Subjects_Quantity), axis=0)[::-1][:Depth]
+    Order = {'Min_Value': Subjects_Data[Min_Index, Columns], 'Min_Index': Min_Index, \
+        'Max_Value': Subjects_Data[Max_Index, Columns], 'Max_Index': Max_Index}
+    return Order
+
+def Scale_Exclude_Range(Order, Exclude_Index):
+    #
+    # Min and range of the subjects except Exclude_Index, from the output of 'Scale_Order'
+    #
+    # Order:
+    #     Output of 'Scale_Order'
+    # Exclude_Index:
+    #     Index of the excluded subjects, the quantity should be smaller than the Depth of 'Scale_Order'
+    #
+    # Return:
+    #     Data_Min, m*1 vector
+    #     Data_Range, m*1 vector, with near-constant features set to 1 as preprocessing.MinMaxScaler
+    #
+
+    Columns = np.arange(np.shape(Order['Min_Index'])[1])
+    # The first subject not excluded in the sorted order
+    Min_First = np.argmax(~np.isin(Order['Min_Index'], Exclude_Index), axis=0)
+    Max_First = np.argmax(~np.isin(Order['Max_Index'], Exclude_Index), axis=0)
+    Data_Min = Order['Min_Value'][Min_First, Columns]
+    Data_Max = Order['Max_Value'][Max_First, Columns]
+    Data_Range = Scale_Handle_Zeros(Data_Max - Data_Min)
+    return (Data_Min, Data_Range)
+
+def Scale_Exclude_Change(Order, Base_Exclude_Index, Exclude_Index):
+    #
+    # Features whose range changes when Exclude_Index are excluded in addition to Base_Exclude_Index
+    # Only the features with the min or max in Exclude_Index can change, so the others are not checked
+    #
+    # Order:
+    #     Output of 'Scale_Order'
+    # Base_Exclude_Index:
+    #     Index of the subjects already excluded
+    # Exclude_Index:
+    #     Index of the subjects excluded in addition
+    #     The total quantity of the excluded subjects should be smaller than the Depth of 'Scale_Order'
+    #
+    # Return:
+    #     Changed_Index, index of the features whose range changes
+    #     Base_Range, range of the changed features with Base_Exclude_Index excluded
+    #     Exclude_Range, range of the changed features with both Base_Exclude_Index and Exclude_Index excluded
+    #
+
+    Columns = np.arange(np.shape(Order['Min_Index'])[1])
+    Min_First = np.argmax(~np.isin(Order['Min_Index'], Base_Exclude_Index), axis=0)
+    Max_First = np.argmax(~np.isin(Order['Max_Index'], Base_Exclude_Index), axis=0)
+    Candidate_Index = np.nonzero(np.isin(Order['Min_Index'][Min_First, Columns], Exclude_Index) | \
+        np.isin(Order['Max_Index'][Max_First, Columns], Exclude_Index))[0]
+    Candidate_Order = {Key: Order[Key][:, Candidate_Index] for Key in Order}
+    Base_Range = Scale_Exclude_Range(Candidate_Order, Base_Exclude_Index)[1]
+    Exclude_Range = Scale_Exclude_Range(Candidate_Order, np.append(Base_Exclude_Index, Exclude_Index))[1]
+    Changed = Base_Range != Exclude_Range
+    return (Candidate_Index[Changed], Base_Range[Changed], Exclude_Range[Changed])
+
+def Scale_Gram(Subjects_Data, Shift, Weight, Block_Size=4096):
+    #
+    # Gram matrix of the shifted and weighted data, sum_f Weight_f * (x_f - Shift_f) * (x_f - Shift_f)'
+    # With Weight = 1 / Range^2, it is the Gram matrix of the MinMax scaled data (up to the shift absorbed by the intercept)
+    # The features are processed by blocks, so only a block of the data is copied at a time
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Shift:
+    #     m*1 vector, a constant for each feature, e.g., the mean of all the subjects for numerical accuracy
+    # Weight:
+    #     m*1 vector
+    # Block_Size:
+    #     Quantity of features processed at a time
+    #
+    # Return:
+    #     Gram, n*n matrix
+    #
+
+    Subjects_Quantity, Features_Quantity = np.shape(Subjects_Data)
+    Gram = np.zeros((Subjects_Quantity, Subjects_Quantity))
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Block_Data = Subjects_Data[:, Block] - Shift[Block]
+        Gram += np.dot(Block_Data * Weight[Block], Block_Data.T)
+    return Gram
+
+def Scale_Handle_Zeros(Data_Range):
+    #
+    # Near-constant features are not scaled, the same with preprocessing.MinMaxScaler
+    #
+    Data_Range = np.array(Data_Range, dtype=np.float64)
+    Data_Range[Data_Range < 10 * np.finfo(Data_Range.dtype).eps] = 1
+    return Data_Range
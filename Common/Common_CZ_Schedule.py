@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Scheduling the fits of a nested cross-validation in a pool of processes
+# The fits of all the (outer fold, inner fold, parameter) are put into one queue, instead of parallel threads over the parameters
+# of one inner fold, so the processes do not wait for each other at the end of each fold
+#
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from sklearn import preprocessing
+from joblib import Parallel, delayed, parallel_backend
+from Common_CZ_Data import Data_Mapped
+
+def Schedule_Run(Function, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads=1):
+    #
+    # Run Function(Subjects_Data, *Task_Args[i]) for all the tasks in a pool of loky processes
+    # Subjects_Data is saved once into a temporary .npy file and memory-mapped by the processes, instead of being sent with each task;
+    # if it is already memory-mapped from a file (see 'Data_Open' in Common_CZ_Data), the processes map that file, without a copy
+    #
+    # Function:
+    #     Function of each task, e.g., 'Schedule_Fold'
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity, or np.memmap
+    # Task_Args:
+    #     List of the arguments of each task, after Subjects_Data
+    # Parallel_Quantity:
+    #     Quantity of processes
+    # BLAS_Threads:
+    #     Quantity of BLAS (and OpenMP) threads of each process, 1 by default
+    #     Parallel_Quantity * BLAS_Threads should not be larger than the quantity of cores
+    #
+    # Return:
+    #     Results, list of the return of each task, in the order of Task_Args
+    #
+
+    Temp_Folder = tempfile.mkdtemp()
+    try:
+        if not Data_Mapped(Subjects_Data):
+            Data_File = os.path.join(Temp_Folder, 'Subjects_Data.npy')
+            np.save(Data_File, Subjects_Data)
+            Subjects_Data = np.load(Data_File, mmap_mode='r')
+        with parallel_backend('loky', inner_max_num_threads=BLAS_Threads):
+            Results = Parallel(n_jobs=Parallel_Quantity)(delayed(Function)(Subjects_Data, *Args) for Args in Task_Args)
+    finally:
+        shutil.rmtree(Temp_Folder, ignore_errors=True)
+    return Results
+
+def Schedule_Fold(Subjects_Data, Training_Index, Testing_Index, Training_Score, Function, *Args):
+    #
+    # One task of 'Schedule_Run': MinMax scale the training and testing data of a split, and predict the testing subjects
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Training_Index:
+    #     Index of the training subjects in Subjects_Data, the rows of the training data are in this order
+    # Testing_Index:
+    #     Index of the testing subjects in Subjects_Data
+    # Training_Score:
+    #     Scores of the training subjects, in the order of Training_Index
+    # Function:
+    #     Called as Function(Training_Data, Training_Score, Testing_Data, *Args), returning the predictions,
+    #     e.g., 'Path_Predict' in Common_CZ_Path or 'Ridge_Path_Predict'
+    #
+    # Return:
+    #     Predict_Score, the return of Function
+    #
+
+    Scale = preprocessing.MinMaxScaler()
+    Training_Data = Scale.fit_transform(Subjects_Data[Training_Index, :])
+    Testing_Data = Scale.transform(Subjects_Data[Testing_Index, :])
+    return Function(Training_Data, Training_Score, Testing_Data, *Args)
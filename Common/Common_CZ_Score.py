@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Scoring of the predictions of the nested cross-validation
+# The correlation, MAE and inverse MAE of all the parameters (and all the targets) of a fold are computed at once
+# from the prediction matrix, instead of one np.corrcoef for each column
+# The inner evaluation which selects the parameter is one of the criteria of 'Score_Select'
+#
+
+import numpy as np
+
+def Score_Evaluate(Predict_Score, Testing_Score):
+    #
+    # Correlation, MAE and inverse MAE between each column of the predictions and the scores,
+    # the same with np.corrcoef(Predict_Score[:, l], Testing_Score)[0, 1] and np.mean(np.abs(Predict_Score[:, l] - Testing_Score))
+    #
+    # Predict_Score:
+    #     t*1 vector, t*P matrix or t*P*T array, t is testing subjects quantity, P is parameters quantity, T is targets quantity,
+    #     e.g., the output of 'Ridge_Path_Predict', 'Path_Predict' in Common_CZ_Path or 'Ridge_Kernel_MultiTarget_Predict'
+    # Testing_Score:
+    #     t*1 vector, or t*T matrix for the t*P*T predictions
+    #
+    # Return:
+    #     Corr, MAE, MAE_inv: each a scalar, P*1 vector or P*T matrix
+    #     Corr is nan for constant predictions, the same with np.corrcoef
+    #
+
+    Predict_Score = np.asarray(Predict_Score, dtype=np.float64)
+    Testing_Score = np.asarray(Testing_Score, dtype=np.float64)
+    if np.ndim(Predict_Score) > np.ndim(Testing_Score):
+        # The same scores for all the parameters
+        Testing_Score = np.expand_dims(Testing_Score, 1)
+    Corr = Score_Corr(Predict_Score, Testing_Score)
+    MAE = np.mean(np.abs(Predict_Score - Testing_Score), axis=0)
+    MAE_inv = np.divide(1, MAE)
+    return (Corr, MAE, MAE_inv)
+
+def Score_Corr(Predict_Score, Testing_Score):
+    #
+    # Correlation along the first axis, e.g., of the predictions of all the parameters and permutations with their scores
+    # nan for constant predictions, as np.corrcoef
+    #
+    # Predict_Score:
+    #     n*... array, e.g., n*A*P, A is parameters quantity, P is permutations quantity
+    # Testing_Score:
+    #     n*... array, broadcast with Predict_Score, e.g., n*1*P
+    #
+    # Return:
+    #     Corr, the shape of Predict_Score without the first axis
+    #
+
+    Predict_Centered = Predict_Score - np.mean(Predict_Score, axis=0)
+    Score_Centered = Testing_Score - np.mean(Testing_Score, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Corr = np.sum(Predict_Centered * Score_Centered, axis=0) / \
+            np.sqrt(np.sum(Predict_Centered ** 2, axis=0) * np.sum(Score_Centered ** 2, axis=0))
+    return np.clip(Corr, -1, 1)
+
+def Score_Standardize(Evaluation):
+    #
+    # z-score of the evaluation of each parameter across the parameters (the first axis), for each target
+    #
+    return (Evaluation - np.mean(Evaluation, axis=0)) / np.std(Evaluation, axis=0)
+
+def Score_Select(Inner_Corr, Inner_MAE_inv, Criterion='Corr_MAE_inv'):
+    #
+    # Inner evaluation of the parameters and the index of the optimal parameter
+    #
+    # Inner_Corr:
+    #     F*P matrix or F*P*T array, F is inner folds (or repeats) quantity, P is parameters quantity, T is targets quantity,
+    #     correlation of each fold, with nan replaced by 0
+    # Inner_MAE_inv:
+    #     The same size with Inner_Corr, inverse MAE of each fold
+    # Criterion:
+    #     'Corr_MAE_inv': the sum of the z-scored mean correlation and the z-scored mean inverse MAE (default),
+    #                     the criterion of the *_OptimalAlpha_KFold functions
+    #     'Corr': the mean correlation
+    #     'MAE_inv': the mean inverse MAE
+    #
+    # Return:
+    #     Inner_Evaluation, P*1 vector or P*T matrix
+    #     Optimal_Index, the index of the largest Inner_Evaluation, or T*1 vector of the index of each target
+    #
+
+    Inner_Corr_Mean = np.mean(Inner_Corr, axis=0)
+    Inner_MAE_inv_Mean = np.mean(Inner_MAE_inv, axis=0)
+    if Criterion == 'Corr_MAE_inv':
+        Inner_Evaluation = Score_Standardize(Inner_Corr_Mean) + Score_Standardize(Inner_MAE_inv_Mean)
+    elif Criterion == 'Corr':
+        Inner_Evaluation = Inner_Corr_Mean
+    elif Criterion == 'MAE_inv':
+        Inner_Evaluation = Inner_MAE_inv_Mean
+    else:
+        raise ValueError('Criterion should be Corr_MAE_inv, Corr or MAE_inv: ' + str(Criterion))
+    Optimal_Index = np.argmax(Inner_Evaluation, axis=0)
+    return (Inner_Evaluation, Optimal_Index)
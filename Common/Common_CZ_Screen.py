@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Feature screening for Lasso and ElasticNet
+# The strong rule (Tibshirani et al., 2012, JRSSB) discards the features that are very likely to get zero coefficient,
+# coordinate descent runs on the remaining features only, and the discarded features are then checked with the KKT conditions;
+# the violating features are added back and the fit is repeated, so the solution is the same with the fit of all the features
+# Along a path of decreasing alphas, the sequential strong rule screens with the residual of the previous alpha instead,
+# which keeps far fewer features, see 'Path_Screen_Predict' in Common_CZ_Path
+#
+
+import time
+import numpy as np
+from sklearn import linear_model
+
+def Screen_Fit(Training_Data, Training_Score, Alpha, L1_ratio=1, Previous=None):
+    #
+    # Fit linear_model.Lasso (L1_ratio = 1) or linear_model.ElasticNet with strong rule screening and KKT checks
+    #
+    # Training_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    # Alpha:
+    #     Value of alpha
+    # L1_ratio:
+    #     The L1_ratio of ElasticNet, 1 is Lasso
+    # Previous:
+    #     Optional, the fit of the previous alpha of a path, larger than Alpha, dict with
+    #         'Alpha': the previous alpha
+    #         'Coef': its coefficients of all the m features
+    #         'Residual': its training residual, n*1 vector
+    #     The features are also screened by the sequential strong rule with this residual, the features active at the previous
+    #     alpha are kept, and the coordinate descent starts from the previous coefficients
+    #     None: the basic strong rule with Alpha_Max, and the coordinate descent starts from zero (default)
+    #
+    # Return:
+    #     clf, the fitted linear_model.Lasso / ElasticNet, coef_ is of all the m features and predict() takes all the m features
+    #     Screen_Info, dict with
+    #         'Fit_Time': seconds of the screening and fitting
+    #         'Discarded_Quantity': quantity of the features finally left out of coordinate descent
+    #         'KKT_Violation_Quantity': quantity of the discarded features added back by the KKT checks
+    #
+
+    Start_Time = time.time()
+    Subjects_Quantity, Features_Quantity = np.shape(Training_Data)
+    if L1_ratio == 1:
+        clf = linear_model.Lasso(alpha=Alpha, warm_start=Previous is not None)
+    else:
+        clf = linear_model.ElasticNet(alpha=Alpha, l1_ratio=L1_ratio, warm_start=Previous is not None)
+    L1_Penalty = Alpha * L1_ratio
+
+    # With the intercept, the features are centered, and x_f' * (y - mean(y)) = (x_f - mean(x_f))' * (y - mean(y))
+    Training_Residual = Training_Score - np.mean(Training_Score)
+    Feature_Corr = np.abs(Training_Data.T.dot(Training_Residual)) / Subjects_Quantity
+    # All the coefficients are zero for the alphas above Alpha_Max
+    Alpha_Max = np.max(Feature_Corr) / L1_ratio
+    Keep = Feature_Corr >= L1_ratio * (2 * Alpha - Alpha_Max)
+    if Previous is not None:
+        # Sequential strong rule, the residual of the previous fit has zero mean with the intercept;
+        # a feature is discarded by either rule, since the KKT checks below add back any wrong discard
+        # (with alphas halving along the path, 2 * Alpha - Previous['Alpha'] is 0 and only the basic rule discards)
+        Sequential_Corr = np.abs(Training_Data.T.dot(Previous['Residual'])) / Subjects_Quantity
+        Keep = (Keep & (Sequential_Corr >= L1_ratio * (2 * Alpha - Previous['Alpha']))) | (Previous['Coef'] != 0)
+        Start_Coef = np.array(Previous['Coef'], dtype=Training_Data.dtype)
+    # At least one feature for fitting, it gets zero coefficient if Alpha >= Alpha_Max
+    Keep[np.argmax(Feature_Corr)] = True
+
+    KKT_Violation_Quantity = 0
+    while True:
+        Keep_Index = np.nonzero(Keep)[0]
+        if Previous is not None:
+            # Warm start from the previous coefficients, or from the fit before the KKT violations were added back
+            clf.coef_ = Start_Coef[Keep_Index]
+        clf.fit(Training_Data[:, Keep_Index], Training_Score)
+        if Previous is not None:
+            Start_Coef[Keep_Index] = clf.coef_
+        Training_Residual = Training_Score - clf.predict(Training_Data[:, Keep_Index])
+        # KKT conditions of the discarded features, i.e., zero coefficient is optimal
+        Discarded_Index = np.nonzero(~Keep)[0]
+        Violation_Index = Discarded_Index[np.abs(Training_Data[:, Discarded_Index].T.dot(Training_Residual)) / Subjects_Quantity > L1_Penalty]
+        if not len(Violation_Index):
+            break
+        Keep[Violation_Index] = True
+        KKT_Violation_Quantity = KKT_Violation_Quantity + len(Violation_Index)
+
+    Coef = np.zeros(Features_Quantity)
+    Coef[Keep_Index] = clf.coef_
+    clf.coef_ = Coef
+    clf.n_features_in_ = Features_Quantity
+    Screen_Info = {'Fit_Time': time.time() - Start_Time, 'Discarded_Quantity': Features_Quantity - len(Keep_Index), \
+        'KKT_Violation_Quantity': KKT_Violation_Quantity}
+    return (clf, Screen_Info)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Sparse Subjects_Data (scipy.sparse CSR matrix), e.g., thresholded structural connectivity or tract counts, mostly zeros
+# MinMax scaling subtracts the min of each feature, so the zeros become non-zero and the data become dense;
+# for sparse data, each feature is divided by its max absolute value of the training subjects (preprocessing.MaxAbsScaler)
+# instead, which keeps the zeros. For non-negative features with at least one zero in the training subjects (the min is 0),
+# e.g., tract counts, MaxAbs scaling is the same with MinMax scaling
+# The rows of the folds are taken from the CSR matrix, and linear_model.Ridge / Lasso / ElasticNet are fitted on the sparse data;
+# the ridge paths of the nested cross-validation are computed from the n*n Gram matrix of the sparse data, see 'Ridge_Path_Predict'
+#
+
+import os
+import time
+import tracemalloc
+import numpy as np
+import scipy.io as sio
+from scipy import sparse
+from sklearn import preprocessing
+
+def Sparse_Check(Subjects_Data):
+    #
+    # Whether Subjects_Data is a scipy.sparse matrix
+    #
+    return sparse.issparse(Subjects_Data)
+
+def Sparse_Delete(Subjects_Data, Index):
+    #
+    # The rows of Subjects_Data out of Index, the same with np.delete(Subjects_Data, Index, axis=0), also for a CSR matrix
+    #
+    if not Sparse_Check(Subjects_Data):
+        return np.delete(Subjects_Data, Index, axis=0)
+    Mask = np.ones(np.shape(Subjects_Data)[0], dtype=bool)
+    Mask[Index] = False
+    return Subjects_Data[np.flatnonzero(Mask)]
+
+def Sparse_Scaler(Training_Data):
+    #
+    # Scaler of the training data, preprocessing.MaxAbsScaler for a sparse matrix, otherwise preprocessing.MinMaxScaler as before
+    #
+    if Sparse_Check(Training_Data):
+        return preprocessing.MaxAbsScaler()
+    return preprocessing.MinMaxScaler()
+
+def Sparse_Fold(Subjects_Data, Testing_Index, Training_Index=None):
+    #
+    # MaxAbs scaled training and testing data of a fold of a CSR matrix, the sparse version of 'Fold_Data' in Common_CZ_Fold
+    #
+    # Subjects_Data:
+    #     n*m CSR matrix, n is subjects quantity, m is features quantity
+    # Testing_Index:
+    #     Index of the testing subjects in Subjects_Data
+    # Training_Index:
+    #     Index of the training subjects in Subjects_Data, in the order of the rows of the training data
+    #     By default, all the subjects out of Testing_Index in the original order
+    #
+    # Return:
+    #     Training_Data, CSR matrix
+    #     Testing_Data, CSR matrix
+    #
+
+    Testing_Index = np.atleast_1d(Testing_Index)
+    if Training_Index is None:
+        Training_Data = Sparse_Delete(Subjects_Data, Testing_Index)
+    else:
+        Training_Data = Subjects_Data[Training_Index]
+    Scale = preprocessing.MaxAbsScaler()
+    Training_Data = Scale.fit_transform(Training_Data)
+    Testing_Data = Scale.transform(Subjects_Data[Testing_Index])
+    return (Training_Data, Testing_Data)
+
+def Sparse_Benchmark(Run_Function, Subjects_Data, Subjects_Score, ResultantFolder):
+    #
+    # Time and peak memory of a function with the sparse data and with the same data as a dense matrix
+    # The memory is the peak of the memory allocated by Python and numpy during the run (tracemalloc), without the input data
+    # The dense run uses MinMax scaling, so Corr and MAE are the same only if MaxAbs and MinMax scaling are the same (see above)
+    #
+    # Run_Function:
+    #     One of the cross-validation functions, with all the arguments except Subjects_Data, Subjects_Score and ResultantFolder,
+    #     e.g., functools.partial(Ridge_KFold_Sort, Fold_Quantity=5, Alpha_Range=Alpha_Range, Parallel_Quantity=1, Permutation_Flag=0)
+    #     It is called as Run_Function(Subjects_Data=..., Subjects_Score=..., ResultantFolder=...), and returns (Corr, MAE)
+    # Subjects_Data:
+    #     n*m CSR matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*1 vector, n is subjects quantity
+    # ResultantFolder:
+    #     Path of the folder storing the results, the results of the runs are in ResultantFolder/Sparse and ResultantFolder/Dense,
+    #     and the benchmark is in ResultantFolder/Res_Sparse_Benchmark.mat
+    #
+    # Return:
+    #     Res_Benchmark, dict with 'Time', 'Peak_Memory' (bytes), 'Data_Memory' (bytes of the input data), 'Corr' and 'MAE',
+    #     each [sparse, dense], and 'Density', the proportion of non-zero values
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    Dense_Data = Subjects_Data.toarray()
+    Res_Benchmark = {'Time': np.zeros(2), 'Peak_Memory': np.zeros(2), 'Corr': np.zeros(2), 'MAE': np.zeros(2), \
+        'Data_Memory': np.array([Subjects_Data.data.nbytes + Subjects_Data.indices.nbytes + Subjects_Data.indptr.nbytes, Dense_Data.nbytes]), \
+        'Density': Subjects_Data.nnz / np.prod(np.shape(Subjects_Data))}
+    for i, (Data, Name) in enumerate(((Subjects_Data, 'Sparse'), (Dense_Data, 'Dense'))):
+        tracemalloc.start()
+        Start_Time = time.time()
+        Corr, MAE = Run_Function(Subjects_Data=Data, Subjects_Score=Subjects_Score, ResultantFolder=ResultantFolder + '/' + Name)
+        Res_Benchmark['Time'][i] = time.time() - Start_Time
+        Res_Benchmark['Peak_Memory'][i] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        Res_Benchmark['Corr'][i] = Corr
+        Res_Benchmark['MAE'][i] = MAE
+    sio.savemat(ResultantFolder + '/Res_Sparse_Benchmark.mat', Res_Benchmark)
+    return Res_Benchmark
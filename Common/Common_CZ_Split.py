@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Split plans of K-fold cross-validation, computed once and shared by all the models
+# A split is kept in memory with the key (subjects quantity, fold quantity, mode, seed), so Ridge, Lasso, ElasticNet and
+# LinearRegression on the same cohort use the same index arrays, and the per-split results (e.g., Gram matrices and MinMax ranges)
+# can be matched by the key
+# The permutations draw from 'Split_Generator', a separate random stream for each (seed, permutation ID), so they are reproducible
+# and independent of the process or computer they run on
+#
+
+import numpy as np
+
+_Split_Cache = {}
+
+def Split_Fold(Subjects_Quantity, Fold_Quantity, Mode='Sort', Seed=None):
+    #
+    # Split of subjects into K folds
+    #
+    # Subjects_Quantity:
+    #     Quantity of subjects
+    # Fold_Quantity:
+    #     Fold quantity for the cross-validation
+    # Mode:
+    #     'Sort': the subjects are sorted by the scores, and the 1st, (k+1)th, ... are the first fold, the 2nd, (k+2)th, ... are the second fold, ...
+    #             the index is the position in the sorted order, see the *_KFold_Sort functions
+    #     'Random': random split, the index is the index of subjects, see the *_KFold_RandomCV functions
+    # Seed:
+    #     Only for Mode = 'Random'
+    #     None: the split is drawn from the random state of numpy (np.random.shuffle) as before, and is not kept (default)
+    #     An integer or a sequence of integers (see 'Split_Seed'): the split is drawn from np.random.RandomState(Seed),
+    #     and is kept, so the same Seed gives the same split without drawing again
+    #
+    # Return:
+    #     Split, dict with 'Key', and 'Test_Index' and 'Train_Index', the lists of the testing and training index of each fold
+    #     The index arrays are read-only, as they are shared
+    #
+
+    if Mode == 'Sort':
+        Key = (Subjects_Quantity, Fold_Quantity, Mode, None)
+    elif Seed is None:
+        RandIndex = np.arange(Subjects_Quantity)
+        np.random.shuffle(RandIndex)
+        return Split_Random_Layout(RandIndex, Fold_Quantity, None)
+    else:
+        Key = (Subjects_Quantity, Fold_Quantity, Mode, tuple(np.atleast_1d(Seed).tolist()))
+    if Key not in _Split_Cache:
+        if Mode == 'Sort':
+            Test_Index = [np.arange(k, Subjects_Quantity, Fold_Quantity) for k in np.arange(Fold_Quantity)]
+            _Split_Cache[Key] = Split_Layout(Test_Index, Subjects_Quantity, Key)
+        else:
+            RandIndex = np.random.RandomState(list(Key[3])).permutation(Subjects_Quantity)
+            _Split_Cache[Key] = Split_Random_Layout(RandIndex, Fold_Quantity, Key)
+    return _Split_Cache[Key]
+
+def Split_Plan(Subjects_Quantity, Fold_Quantity, Mode='Sort', Seed=None, Inner_Repeat=1):
+    #
+    # Split plan of a nested cross-validation, the outer split and the inner splits of the training subjects of each outer fold
+    # These are the same splits used by the *_KFold_Sort and *_KFold_RandomCV functions with the same Seed
+    #
+    # Subjects_Quantity, Fold_Quantity, Mode, Seed:
+    #     See 'Split_Fold'
+    # Inner_Repeat:
+    #     Quantity of the inner splits of each outer fold, i.e., the repeat times of the inner random CV, 1 for Mode = 'Sort'
+    #
+    # Return:
+    #     Plan, the outer split of 'Split_Fold' with 'Inner' in addition,
+    #     Plan['Inner'][j][r] is the r-th inner split of the training subjects of the j-th outer fold, whose index is the position in
+    #     Plan['Train_Index'][j] (for Mode = 'Sort', in the order of the scores of the training subjects)
+    #
+
+    Plan = dict(Split_Fold(Subjects_Quantity, Fold_Quantity, Mode, Seed))
+    Plan['Inner'] = []
+    for j in np.arange(Fold_Quantity):
+        Training_Quantity = len(Plan['Train_Index'][j])
+        Seed_J = Split_Seed(Seed, j)
+        Plan['Inner'].append([Split_Fold(Training_Quantity, Fold_Quantity, Mode, Split_Seed(Seed_J, r)) for r in np.arange(Inner_Repeat)])
+    return Plan
+
+def Split_Seed(Seed, *ID):
+    #
+    # Seed of a sub-split, e.g., of the inner split of the j-th outer fold, Split_Seed(Seed, j)
+    #
+    # Return:
+    #     None if Seed is None, otherwise the tuple of Seed and ID
+    #
+
+    if Seed is None:
+        return None
+    return tuple(np.atleast_1d(Seed).tolist()) + tuple(int(x) for x in ID)
+
+def Split_Generator(Seed):
+    #
+    # Random generator of the permutation scores, e.g., of the i-th permutation, Split_Generator(Split_Seed(Seed, i))
+    #
+    # Seed:
+    #     None: no generator, the random state of numpy is used as before
+    #     An integer Seed, or a tuple (Seed, ID_1, ID_2, ...) from 'Split_Seed': the generator of
+    #     np.random.SeedSequence(Seed, spawn_key=(ID_1, ID_2, ...)), the same stream with np.random.SeedSequence(Seed).spawn(...)[ID_1]
+    #     for one ID, so the streams of different IDs are independent, and any of them can be recomputed alone
+    #
+    # Return:
+    #     Random_Generator, np.random.Generator, or None if Seed is None
+    #
+
+    if Seed is None:
+        return None
+    Seed = tuple(np.atleast_1d(Seed).tolist())
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(Seed[0], spawn_key=Seed[1:])))
+
+def Split_Shuffle(Index, Random_Generator=None):
+    #
+    # Shuffle Index in place with Random_Generator of 'Split_Generator', or with np.random.shuffle if it is None
+    #
+    if Random_Generator is None:
+        np.random.shuffle(Index)
+    else:
+        Random_Generator.shuffle(Index)
+
+def Split_Clear():
+    #
+    # Remove all the kept splits
+    #
+    _Split_Cache.clear()
+
+def Split_Random_Layout(RandIndex, Fold_Quantity, Key):
+    #
+    # Random K folds from the shuffled index, the same with the split of the *_KFold_RandomCV functions
+    #
+    Subjects_Quantity = len(RandIndex)
+    EachFold_Size = int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
+    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
+    Test_Index = []
+    for k in np.arange(Fold_Quantity):
+        Fold_K_Index = RandIndex[EachFold_Size * k + np.arange(EachFold_Size)]
+        if Remain > k:
+            Fold_K_Index = np.insert(Fold_K_Index, len(Fold_K_Index), RandIndex[EachFold_Size * Fold_Quantity + k])
+        Test_Index.append(Fold_K_Index)
+    return Split_Layout(Test_Index, Subjects_Quantity, Key)
+
+def Split_Layout(Test_Index, Subjects_Quantity, Key):
+    #
+    # The split dict of 'Split_Fold' from the testing index of each fold
+    #
+    Train_Index = [np.delete(np.arange(Subjects_Quantity), Fold_K_Index) for Fold_K_Index in Test_Index]
+    for Index in Test_Index + Train_Index:
+        Index.flags.writeable = False
+    return {'Key': Key, 'Test_Index': Test_Index, 'Train_Index': Train_Index}
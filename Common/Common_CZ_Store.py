@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Result store of a permutation test: the results of all the permutations in one file, instead of a folder of small .mat files
+# for each permutation (Res_NFold.mat, Fold_<j>_Score.mat, Inner_Evaluation.mat, the log, ...)
+# The store is one append-only file, ResultantFolder/<Name>.ckpt, in the record format of Common_CZ_Checkpoint; each record is
+# one permutation, with 'Time_ID' and one array for each variable of its .mat files, keyed '<file name>/<variable name>'
+# (e.g., 'Res_NFold/Mean_Corr', 'Fold_0_Score/Predict_Score'), and the text of the logs, keyed by the log file name
+# The permutations still write their .mat files into ResultantFolder/Time_i; after a permutation finishes, its files are appended
+# to the store and the folder is removed, so only the folders of the running permutations exist at any time
+# 'Store_Null' gives the null distribution as one array, and 'Store_Export_Mat' writes the Time_i folders back for MATLAB
+# The offset of each record is kept in ResultantFolder/<Name>.idx, so the loaders seek to the records of the permutations asked for,
+# and read only the arrays asked for, instead of reading and decoding the whole store, see 'Store_Index'
+#
+
+import io
+import os
+import zlib
+import shutil
+import numpy as np
+import scipy.io as sio
+from Common_CZ_Checkpoint import Checkpoint_Read, Checkpoint_Header, Checkpoint_Replace, Checkpoint_Frame, Checkpoint_Encode, Checkpoint_Decode
+
+# One entry of the index for each record: the permutation, the position of the record, the length and crc32 of its payload
+_Store_Index_Type = np.dtype([('Time_ID', '<i8'), ('Offset', '<i8'), ('Length', '<u4'), ('Crc', '<u4')])
+
+def Store_Open(ResultantFolder, Name='Res_Store'):
+    #
+    # Open the result store of a permutation test, created if it does not exist
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results, the store is ResultantFolder/<Name>.ckpt
+    # Name:
+    #     Name of the store file
+    #
+    # Return:
+    #     Store, dict with
+    #         'File': the path of the store file
+    #         'Times_ID': set of the index of the permutations in the store
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    File = os.path.join(ResultantFolder, Name + '.ckpt')
+    Index, Valid_Length, File_Length = Store_Index(File)
+    if Valid_Length < File_Length:
+        # Drop the torn last record of an interrupted append, its permutation is run again
+        with open(File, 'rb') as Store_File:
+            Valid_Bytes = Store_File.read(Valid_Length)
+        Checkpoint_Replace(File, Valid_Bytes)
+    return {'File': File, 'Times_ID': set(Index)}
+
+def Store_Folder(Store, ResultantFolder_I):
+    #
+    # Append the results of a finished permutation to the store, and remove its folder
+    #
+    # Store:
+    #     Output of 'Store_Open'
+    # ResultantFolder_I:
+    #     ResultantFolder/Time_i, the folder of the i-th permutation
+    #     The variables of each .mat file are kept as read by scipy.io.loadmat, and the .log files as text
+    #
+
+    Time_ID = int(os.path.basename(os.path.normpath(ResultantFolder_I))[len('Time_'):])
+    Record = {'Time_ID': Time_ID}
+    for File_Name in sorted(os.listdir(ResultantFolder_I)):
+        File_Path = os.path.join(ResultantFolder_I, File_Name)
+        if File_Name.endswith('.mat'):
+            Mat = sio.loadmat(File_Path)
+            for Key in Mat:
+                if not Key.startswith('__'):
+                    Record[File_Name[:-len('.mat')] + '/' + Key] = Mat[Key]
+        elif File_Name.endswith('.log'):
+            with open(File_Path, 'r') as Log_File:
+                Record[File_Name] = np.array(Log_File.read())
+    Payload = Checkpoint_Encode(Record)
+    Offset = os.path.getsize(Store['File']) if os.path.exists(Store['File']) else 0
+    with open(Store['File'], 'ab') as Store_File:
+        Store_File.write(Checkpoint_Frame(Payload))
+        Store_File.flush()
+        os.fsync(Store_File.fileno())
+    # The index entry is written after the record, so an entry always has its record
+    Entry = np.array([(Time_ID, Offset, len(Payload), zlib.crc32(Payload))], dtype=_Store_Index_Type)
+    with open(Store_Index_File(Store['File']), 'ab') as Index_File:
+        Index_File.write(Entry.tobytes())
+    Store['Times_ID'].add(Time_ID)
+    shutil.rmtree(ResultantFolder_I)
+
+def Store_Collect(Store, ResultantFolder, Times_IDRange, Result_Name='Res_NFold.mat'):
+    #
+    # Append the finished permutations of Times_IDRange not in the store yet, e.g., run by the batch functions,
+    # from a test interrupted before the results were stored, or from a test without the store
+    #
+    # Store:
+    #     Output of 'Store_Open'
+    # ResultantFolder:
+    #     Path of the folder storing the results, the results of the i-th permutation are in ResultantFolder/Time_i
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(1000)
+    # Result_Name:
+    #     The last file written by a permutation, a permutation is finished if ResultantFolder/Time_i/Result_Name exists
+    #
+    # Return:
+    #     Times_Todo, the index of the permutations of Times_IDRange still not in the store
+    #
+
+    Times_Todo = []
+    for Time_ID in Times_IDRange:
+        if int(Time_ID) in Store['Times_ID']:
+            continue
+        ResultantFolder_I = ResultantFolder + '/Time_' + str(Time_ID)
+        if os.path.exists(os.path.join(ResultantFolder_I, Result_Name)):
+            Store_Folder(Store, ResultantFolder_I)
+        else:
+            Times_Todo.append(Time_ID)
+    return np.array(Times_Todo, dtype=np.asarray(Times_IDRange).dtype)
+
+def Store_Load(ResultantFolder, Times_IDRange=None, Fields=None, Name='Res_Store'):
+    #
+    # Records of the permutations in the store
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results
+    # Times_IDRange:
+    #     The index of the permutations to load, all the permutations in the store by default
+    # Fields:
+    #     List of the keys to load, e.g., ['Res_NFold/Mean_Corr'], all the keys by default
+    #     Only these arrays of each record are decoded
+    # Name:
+    #     Name of the store file
+    #
+    # Return:
+    #     Record, dict, Record[i] is the dict of the arrays of the i-th permutation, keyed '<file name>/<variable name>'
+    #
+
+    File = os.path.join(ResultantFolder, Name + '.ckpt')
+    Index = Store_Index(File)[0]
+    if Times_IDRange is None:
+        Times_Load = list(Index)
+    else:
+        # Only the records of these permutations are read from the store
+        Times_Load = [int(Time_ID) for Time_ID in Times_IDRange if int(Time_ID) in Index]
+    Record = {}
+    if not Times_Load:
+        return Record
+    with open(File, 'rb') as Store_File:
+        for Time_ID in Times_Load:
+            Payload_Offset, Length = Index[Time_ID]
+            Store_File.seek(Payload_Offset)
+            Payload = Store_File.read(Length)
+            if Fields is None:
+                Record[Time_ID] = Checkpoint_Decode(Payload)
+                Record[Time_ID].pop('Time_ID')
+            else:
+                Record[Time_ID] = {Field: Store_Field(Payload, Field) for Field in Fields}
+    return Record
+
+def Store_Null(ResultantFolder, Field='Res_NFold/Mean_Corr', Times_IDRange=None, Name='Res_Store'):
+    #
+    # Null distribution of a statistic, from all the permutations in the store
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results
+    # Field:
+    #     Key of the statistic, '<file name>/<variable name>', 'Res_NFold/Mean_Corr' by default
+    # Times_IDRange:
+    #     The index of the permutations, all the permutations in the store by default
+    #     Missing permutations raise KeyError
+    # Name:
+    #     Name of the store file
+    #
+    # Return:
+    #     Times_ID, P*1 vector, the index of the permutations, sorted, or in the order of Times_IDRange
+    #     Null, P*1 vector of the statistic of each permutation, or P*k matrix for a statistic of k values (e.g., 'Fold_0_Score/Predict_Score')
+    #
+
+    Record = Store_Load(ResultantFolder, Times_IDRange, [Field], Name)
+    if Times_IDRange is None:
+        Times_ID = np.array(sorted(Record), dtype=int)
+    else:
+        Times_ID = np.array([int(Time_ID) for Time_ID in Times_IDRange], dtype=int)
+    Null = np.array([np.ravel(Record[Time_ID][Field]) for Time_ID in Times_ID])
+    if Null.ndim == 2 and Null.shape[1] == 1:
+        Null = Null[:, 0]
+    return (Times_ID, Null)
+
+def Store_Export_Mat(ResultantFolder, Export_Folder=None, Times_IDRange=None, Name='Res_Store'):
+    #
+    # Write the permutations in the store back as .mat files, Export_Folder/Time_i/<file name>.mat, for MATLAB
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results
+    # Export_Folder:
+    #     Path of the folder of the .mat files, ResultantFolder by default, i.e., the layout without the store
+    # Times_IDRange:
+    #     The index of the permutations to export, all the permutations in the store by default
+    # Name:
+    #     Name of the store file
+    #
+
+    if Export_Folder is None:
+        Export_Folder = ResultantFolder
+    if not os.path.exists(Export_Folder):
+        os.mkdir(Export_Folder)
+    Record = Store_Load(ResultantFolder, Times_IDRange, None, Name)
+    for Time_ID in sorted(Record):
+        Export_Folder_I = Export_Folder + '/Time_' + str(Time_ID)
+        if not os.path.exists(Export_Folder_I):
+            os.mkdir(Export_Folder_I)
+        Mat = {}
+        for Key in Record[Time_ID]:
+            if '/' in Key:
+                File_Name, Variable_Name = Key.split('/', 1)
+                Mat.setdefault(File_Name, {})[Variable_Name] = Record[Time_ID][Key]
+            else:
+                with open(os.path.join(Export_Folder_I, Key), 'w') as Log_File:
+                    Log_File.write(str(Record[Time_ID][Key]))
+        for File_Name in Mat:
+            sio.savemat(os.path.join(Export_Folder_I, File_Name + '.mat'), Mat[File_Name])
+
+def Store_Index(File):
+    #
+    # Offset index of the store file, kept in <Name>.idx next to it and checked against the headers of the records
+    # The entries not matching the header of their record (e.g., of a store removed or rewritten) are dropped, and the records
+    # after the last matching entry (e.g., appended before the index was, or by a store without the index) are read and indexed,
+    # then the index file is rewritten
+    #
+    # Return:
+    #     Index, dict, Index[i] = (Payload_Offset, Length) of the record of the i-th permutation, in the order of the records
+    #     Valid_Length, the length of the valid records of the store file
+    #     File_Length, the length of the store file
+    #
+
+    Index = {}
+    if not os.path.exists(File):
+        return (Index, 0, 0)
+    File_Length = os.path.getsize(File)
+    Entries = np.zeros(0, dtype=_Store_Index_Type)
+    if os.path.exists(Store_Index_File(File)):
+        with open(Store_Index_File(File), 'rb') as Index_File:
+            Index_Bytes = Index_File.read()
+        # A torn last entry is dropped
+        Entries = np.frombuffer(Index_Bytes[:len(Index_Bytes) - len(Index_Bytes) % _Store_Index_Type.itemsize], dtype=_Store_Index_Type)
+    Valid_Length = 0
+    Valid_Quantity = 0
+    with open(File, 'rb') as Store_File:
+        for Entry in Entries:
+            Header = Checkpoint_Header(Store_File, Valid_Length) if Entry['Offset'] == Valid_Length else None
+            if Header is None or Header[1:] != (Entry['Length'], Entry['Crc']) or Header[0] + Header[1] > File_Length:
+                break
+            Index[int(Entry['Time_ID'])] = Header[:2]
+            Valid_Length = Header[0] + Header[1]
+            Valid_Quantity = Valid_Quantity + 1
+        # Only the records not in the index are read
+        Payloads, Read_Length, File_Length = Checkpoint_Read(File, Valid_Length)
+        if Valid_Quantity == len(Entries) and not Payloads:
+            return (Index, Read_Length, File_Length)
+        Entries = [tuple(Entry) for Entry in Entries[:Valid_Quantity]]
+        for Payload in Payloads:
+            Payload_Offset, Length, Crc = Checkpoint_Header(Store_File, Valid_Length)
+            Time_ID = int(Store_Field(Payload, 'Time_ID'))
+            Entries.append((Time_ID, Valid_Length, Length, Crc))
+            Index[Time_ID] = (Payload_Offset, Length)
+            Valid_Length = Payload_Offset + Length
+    Checkpoint_Replace(Store_Index_File(File), np.array(Entries, dtype=_Store_Index_Type).tobytes())
+    return (Index, Read_Length, File_Length)
+
+def Store_Index_File(File):
+    #
+    # Path of the index of a store file, <Name>.idx
+    #
+    return File[:-len('.ckpt')] + '.idx'
+
+def Store_Field(Payload, Field):
+    #
+    # One array of a record, without reading the other arrays of the payload
+    #
+    with np.load(io.BytesIO(Payload), allow_pickle=False) as Data:
+        Value = Data[Field]
+    return Value[()] if Value.ndim == 0 else Value
@@ -10,13 +10,20 @@
 # (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
 #
 import os
+import sys
 import scipy.io as sio
 import numpy as np
 from sklearn import linear_model
 from sklearn import preprocessing
 from joblib import Parallel, delayed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Path import Path_Predict, Path_Evaluate
+from Common_CZ_Score import Score_Evaluate, Score_Select, Score_Standardize
+from Common_CZ_Split import Split_Fold, Split_Seed
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Data import Data_Open
 
-def ElasticNet_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity):
+def ElasticNet_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, Seed=None, Path_Flag=0, Saturation_Flag=0):
     #
     # Elastic-Net regression with random K-fold cross-validation 
     # Because the k-fold separation is random, this prediction generally needed to be repeated several times.
@@ -24,6 +31,7 @@ def ElasticNet_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alph
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -42,32 +50,42 @@ def ElasticNet_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alph
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Seed:
+    #     None: the split is drawn from the random state of numpy (default)
+    #     An integer: the split is drawn from this seed (see 'Split_Fold' in Common_CZ_Split), and the same Seed gives the same
+    #     outer and inner splits for all the models
+    # Path_Flag:
+    #     1: the alphas of each inner fold are fitted along one warm-started path, see 'Path_Predict' in Common_CZ_Path,
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas are not fitted and get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
 
     Subjects_Quantity = len(Subjects_Score)
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    RandIndex = np.arange(Subjects_Quantity)
-    np.random.shuffle(RandIndex)
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Seed)['Test_Index']
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = RandIndex[EachFold_Size * j + np.arange(EachFold_Size)]
-        if Remain > j:
-            Fold_J_Index = np.insert(Fold_J_Index, len(Fold_J_Index), RandIndex[EachFold_Size * Fold_Quantity + j])
+        Fold_J_Index = Fold_Index[j]
 
         Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
         Subjects_Data_train = np.delete(Subjects_Data, Fold_J_Index, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index) 
 
-        Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity)
+        Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, \
+            Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag, Seed=Split_Seed(Seed, j))
 
         normalize = preprocessing.MinMaxScaler()
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
@@ -96,7 +114,7 @@ def ElasticNet_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alph
     sio.savemat(ResultantFile, Res_NFold)
     return (Mean_Corr, Mean_MAE)  
 
-def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity):
+def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity, Debug_Flag=0, Path_Flag=0, Saturation_Flag=0, Seed=None):
     #
     # Select optimal regularization parameter using nested random k-fold cross-validation
     #
@@ -120,22 +138,36 @@ def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity,
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Debug_Flag:
+    #     1: also write the result of each parameter into ResultantFolder as a .mat file, for debugging
+    #     0: keep the results of each parameter in memory only (default)
+    # Path_Flag:
+    #     1: fit all the alphas of a fold along one warm-started path (from the largest alpha), see 'Path_Predict' in Common_CZ_Path
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately from zero coefficients (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
+    # Seed:
+    #     None: the splits are drawn from the random state of numpy (default)
+    #     Otherwise, the split of the i-th repeat is drawn from Split_Seed(Seed, i), see 'Split_Fold' in Common_CZ_Split
     #
     
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder);
 
     Subjects_Quantity = len(Training_Score)
-    Inner_EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
+    # The data of each inner fold are taken by index into one buffer, see 'Fold_Data' in Common_CZ_Fold
+    Fold_Data_Buffer = Fold_Buffer(Training_Data)
     
     Parameter_Combination_Quantity = len(Alpha_Range) * len(L1_ratio_Range)
     Inner_Corr_Mean = np.zeros((CVRepeatTimes, Parameter_Combination_Quantity))
     Inner_MAE_inv_Mean = np.zeros((CVRepeatTimes, Parameter_Combination_Quantity))
     for i in np.arange(CVRepeatTimes):
 
-        RandIndex = np.arange(Subjects_Quantity)
-        np.random.shuffle(RandIndex)
+        Inner_Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Split_Seed(Seed, i))['Test_Index']
 
         Inner_Corr = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
         Inner_MAE_inv = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
@@ -143,49 +175,49 @@ def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity,
         for k in np.arange(Fold_Quantity):
           
             print(k)
-            Inner_Fold_K_Index = RandIndex[Inner_EachFold_Size * k + np.arange(Inner_EachFold_Size)]
-            if Remain > k:
-                Inner_Fold_K_Index = np.insert(Inner_Fold_K_Index, len(Inner_Fold_K_Index), RandIndex[Inner_EachFold_Size * Fold_Quantity + k])
+            Inner_Fold_K_Index = Inner_Fold_Index[k]
 
-            Inner_Fold_K_Data_test = Training_Data[Inner_Fold_K_Index, :]
             Inner_Fold_K_Score_test = Training_Score[Inner_Fold_K_Index]
-            Inner_Fold_K_Data_train = np.delete(Training_Data, Inner_Fold_K_Index, axis=0)
             Inner_Fold_K_Score_train = np.delete(Training_Score, Inner_Fold_K_Index)
         
-            Scale = preprocessing.MinMaxScaler()
-            Inner_Fold_K_Data_train = Scale.fit_transform(Inner_Fold_K_Data_train)
-            Inner_Fold_K_Data_test = Scale.transform(Inner_Fold_K_Data_test)    
+            Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Training_Data, Inner_Fold_K_Index, Fold_Data_Buffer)
         
-            Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(ElasticNet_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range, L1_ratio_Range, l, ResultantFolder) for l in np.arange(Parameter_Combination_Quantity))        
+            if Path_Flag:
+                # One warm-started path of all the alphas for each l1 ratio
+                Path_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Path_Predict)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range, L1_ratio_Range[r], Saturation_Flag) for r in np.arange(len(L1_ratio_Range)))
+                # The l-th combination is (Alpha_Range[l // len(L1_ratio_Range)], L1_ratio_Range[l % len(L1_ratio_Range)]),
+                # i.e., the columns of the t*len(Alpha_Range)*len(L1_ratio_Range) predictions in order
+                Predict_Score = np.stack(Path_Results, axis=2).reshape(len(Inner_Fold_K_Score_test), Parameter_Combination_Quantity)
+                Fold_Corr, Fold_MAE_inv = Path_Evaluate(Predict_Score, Inner_Fold_K_Score_test)
+                Alpha_Results = list(zip(Fold_Corr, Fold_MAE_inv))
+                if Debug_Flag:
+                    for l in np.arange(Parameter_Combination_Quantity):
+                        Fold_result = {'Corr': Fold_Corr[l], 'MAE_inv':Fold_MAE_inv[l]}
+                        sio.savemat(ResultantFolder + '/Alpha_' + str(l) + '.mat', Fold_result)
+            else:
+                Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(ElasticNet_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range, L1_ratio_Range, l, ResultantFolder, Debug_Flag) for l in np.arange(Parameter_Combination_Quantity))
             for l in np.arange(Parameter_Combination_Quantity):
-                Fold_l_Mat_Path = ResultantFolder + '/Alpha_' + str(l) + '.mat';
-                Fold_l_Mat = sio.loadmat(Fold_l_Mat_Path)
-                Inner_Corr[k, l] = Fold_l_Mat['Corr'][0][0]
-                Inner_MAE_inv[k, l] = Fold_l_Mat['MAE_inv']
-                os.remove(Fold_l_Mat_Path)
+                Inner_Corr[k, l], Inner_MAE_inv[k, l] = Alpha_Results[l]
             
             Inner_Corr = np.nan_to_num(Inner_Corr)
         Inner_Corr_Mean[i, :] = np.mean(Inner_Corr, axis=0)
         Inner_MAE_inv_Mean[i, :] = np.mean(Inner_MAE_inv, axis=0)
 
-    Inner_Corr_CVMean = np.mean(Inner_Corr_Mean, axis=0)
-    Inner_MAE_inv_CVMean = np.mean(Inner_MAE_inv_Mean, axis=0)
-    Inner_Corr_CVMean = (Inner_Corr_CVMean - np.mean(Inner_Corr_CVMean)) / np.std(Inner_Corr_CVMean)
-    Inner_MAE_inv_CVMean = (Inner_MAE_inv_CVMean - np.mean(Inner_MAE_inv_CVMean)) / np.std(Inner_MAE_inv_CVMean)
-    Inner_Evaluation = Inner_Corr_CVMean + Inner_MAE_inv_CVMean
+    Inner_Evaluation, Optimal_Combination_Index = Score_Select(Inner_Corr_Mean, Inner_MAE_inv_Mean)
+    # The z-scored means of the repeats
+    Inner_Corr_CVMean = Score_Standardize(np.mean(Inner_Corr_Mean, axis=0))
+    Inner_MAE_inv_CVMean = Score_Standardize(np.mean(Inner_MAE_inv_Mean, axis=0))
     
     Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Corr_CVMean':Inner_Corr_CVMean, 'Inner_MAE_inv_CVMean':Inner_MAE_inv_CVMean, 'Inner_Evaluation':Inner_Evaluation}
     sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
     
-    Optimal_Combination_Index = np.argmax(Inner_Evaluation) 
-    
     Optimal_Alpha_Index = np.int64(np.ceil((Optimal_Combination_Index + 1) / len(L1_ratio_Range))) - 1
     Optimal_Alpha = Alpha_Range[Optimal_Alpha_Index]
     Optimal_L1_ratio_Index = np.mod(Optimal_Combination_Index, len(L1_ratio_Range))
     Optimal_L1_ratio = L1_ratio_Range[Optimal_L1_ratio_Index]
     return (Optimal_Alpha, Optimal_L1_ratio)
 
-def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Parameter_Combination_Index, ResultantFolder):
+def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Parameter_Combination_Index, ResultantFolder, Debug_Flag=0):
     #
     # Sub-function for optimal regularization parameter selection
     # The range of Parameter_Combination_Index is: 0----(len(Alpha_Range)*len(L1_ratio_Range)-1))
@@ -207,6 +239,9 @@ def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Sco
     #     The indice of the (alpha, L1_ratio) combination we tested in the whole range
     # ResultantFolder:
     #     Folder to storing the results
+    # Debug_Flag:
+    #     1: also write the result of this parameter into ResultantFolder as a .mat file, for debugging
+    #     0: only return the result, nothing is written (default)
     #
    
     Alpha_Index = np.int64(np.ceil((Parameter_Combination_Index + 1) / len(L1_ratio_Range))) - 1
@@ -214,12 +249,12 @@ def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Sco
     clf = linear_model.ElasticNet(l1_ratio=L1_ratio_Range[L1_ratio_Index], alpha=Alpha_Range[Alpha_Index])
     clf.fit(Training_Data, Training_Score)
     Predict_Score = clf.predict(Testing_Data)
-    Fold_Corr = np.corrcoef(Predict_Score, Testing_Score)
-    Fold_Corr = Fold_Corr[0,1]
-    Fold_MAE_inv = np.divide(1, np.mean(np.abs(Predict_Score - Testing_Score)))
-    Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
-    ResultantFile = ResultantFolder + '/Alpha_' + str(Parameter_Combination_Index) + '.mat'
-    sio.savemat(ResultantFile, Fold_result)
+    Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Testing_Score)
+    if Debug_Flag:
+        Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
+        ResultantFile = ResultantFolder + '/Alpha_' + str(Parameter_Combination_Index) + '.mat'
+        sio.savemat(ResultantFile, Fold_result)
+    return (Fold_Corr, Fold_MAE_inv)
     
 def ElasticNet_Weight(Subjects_Data, Subjects_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
     #
@@ -10,20 +10,35 @@
 # (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
 #
 import os
+import sys
+import functools
 import scipy.io as sio
 import numpy as np
 import time
 from sklearn import linear_model
 from sklearn import preprocessing
 from joblib import Parallel, delayed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Path import Path_Predict, Path_Screen_Predict, Path_Evaluate
+from Common_CZ_Score import Score_Evaluate, Score_Select
+from Common_CZ_Screen import Screen_Fit
+from Common_CZ_Schedule import Schedule_Run, Schedule_Fold
+from Common_CZ_Permutation import Permutation_Run, Permutation_Pool, Permutation_Adaptive
+from Common_CZ_Split import Split_Fold, Split_Seed, Split_Generator, Split_Shuffle
+from Common_CZ_Checkpoint import Checkpoint_Open, Checkpoint_Append, Checkpoint_Close, Checkpoint_Hash
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Data import Data_Open
+from Common_CZ_Precision import Precision_Data
+from Common_CZ_Sparse import Sparse_Check, Sparse_Delete, Sparse_Scaler
 
-def ElasticNet_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions):
+def ElasticNet_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions, Screen_Flag=0, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None, Store_Flag=0, Path_Flag=0, Saturation_Flag=0):
      
     #
     # Elastic-net regression with K-fold cross-validation
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Times_IDRange:
@@ -42,95 +57,60 @@ def ElasticNet_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRan
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
     # Max_Queued:
-    #     The maximum jobs to be submitted to SGE cluster at the same time 
+    #     The maximum permutations running at the same time on this computer, see 'Permutation_Run'
     # QueueOptions:
-    #     Generally is '-q all.q' for SGE cluster 
+    #     Not used, kept for compatibility (permutations were submitted as jobs of SGE cluster)
+    # Screen_Flag:
+    #     1: fit ElasticNet with strong rule screening and KKT checks, see 'Screen_Fit' in Common_CZ_Screen,
+    #        the solution is not changed, and the fitting time and the quantity of discarded features are also saved
+    #     0: fit with all the features (default)
+    # Observed_Corr:
+    #     Optional, Mean_Corr of 'ElasticNet_KFold_Sort' without permutation
+    #     If given, the permutations of Times_IDRange are run in waves until p < P_Threshold or p > P_Threshold is decided,
+    #     with the probability of a wrong decision at most Error_Rate, see 'Permutation_Adaptive' in Common_CZ_Permutation;
+    #     the quantity of permutations run, the partial null distribution, the p-value and the decision are in ResultantFolder/Res_Adaptive.mat
+    # P_Threshold, Error_Rate:
+    #     Only for Observed_Corr, see 'Permutation_Adaptive'
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Store_Flag:
+    #     1: the results of all the permutations are kept in ResultantFolder/Res_Store.ckpt instead of a folder for each,
+    #        see Common_CZ_Store; 'Store_Null' gives the null distribution, and 'Store_Export_Mat' the .mat files
+    #     0: the results of the i-th permutation are in ResultantFolder/Time_i (default)
+    # Path_Flag, Saturation_Flag:
+    #     See 'ElasticNet_KFold_Sort'
     #
    
-    if not os.path.exists(ResultantFolder):
-        os.mkdir(ResultantFolder)
-    Subjects_Data_Mat = {'Subjects_Data': Subjects_Data}
-    Subjects_Data_Mat_Path = ResultantFolder + '/Subjects_Data.mat'
-    sio.savemat(Subjects_Data_Mat_Path, Subjects_Data_Mat)
-    Finish_File = []
-    Times_IDRange_Todo = np.int64(np.array([]))
-    for i in np.arange(len(Times_IDRange)):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
-        if not os.path.exists(ResultantFolder_I):
-            os.mkdir(ResultantFolder_I)
-        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
-            Times_IDRange_Todo = np.insert(Times_IDRange_Todo, len(Times_IDRange_Todo), Times_IDRange[i])
-            Configuration_Mat = {'Subjects_Data_Mat_Path': Subjects_Data_Mat_Path, 'Subjects_Score': Subjects_Score, 'Fold_Quantity': Fold_Quantity, \
-                'Alpha_Range': Alpha_Range, 'L1_ratio_Range': L1_ratio_Range, 'ResultantFolder_I': ResultantFolder_I, 'Parallel_Quantity': Parallel_Quantity};
-            sio.savemat(ResultantFolder_I + '/Configuration.mat', Configuration_Mat)
-            system_cmd = 'python3 -c ' + '\'import sys;\
-                sys.path.append("' + os.getcwd() + '");\
-                from ElasticNet_CZ_Sort import ElasticNet_KFold_Sort_Permutation_Sub;\
-                import os;\
-                import scipy.io as sio;\
-                configuration = sio.loadmat("' + ResultantFolder_I + '/Configuration.mat");\
-                Subjects_Data_Mat_Path = configuration["Subjects_Data_Mat_Path"];\
-                Subjects_Score = configuration["Subjects_Score"];\
-                Fold_Quantity = configuration["Fold_Quantity"];\
-                Alpha_Range = configuration["Alpha_Range"];\
-                L1_ratio_Range = configuration["L1_ratio_Range"];\
-                ResultantFolder_I = configuration["ResultantFolder_I"];\
-                Parallel_Quantity = configuration["Parallel_Quantity"];\
-                ElasticNet_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path[0], Subjects_Score[0], Fold_Quantity[0][0], Alpha_Range[0], L1_ratio_Range[0], ResultantFolder_I[0], Parallel_Quantity[0][0])\' ';
-            system_cmd = system_cmd + ' > "' + ResultantFolder_I + '/ElasticNet.log" 2>&1\n'
-            Finish_File.append(ResultantFolder_I + '/Res_NFold.mat')
-            script = open(ResultantFolder_I + '/script.sh', 'w')
-            script.write(system_cmd)
-            script.close()
-
-    Jobs_Quantity = len(Finish_File)
-    if len(Times_IDRange_Todo) > Max_Queued:
-        Submit_Quantity = Max_Queued
-    else:
-        Submit_Quantity = len(Times_IDRange_Todo)
-    for i in np.arange(Submit_Quantity):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[i])
-        #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.e"';
-        #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[i]) + Option;
-        #print(cmd);
-        #os.system(cmd)
-        os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-    Finished_Quantity = 0;
-    while 1:        
-        for i in np.arange(len(Finish_File)):
-             if os.path.exists(Finish_File[i]):
-                 Finished_Quantity = Finished_Quantity + 1
-                 print(Finish_File[i])
-                 del(Finish_File[i])
-                 print(time.strftime('%Y-%m-%d-%H-%M-%S',time.localtime(time.time())))
-                 print('Finish quantity = ' + str(Finished_Quantity))
-                 if Submit_Quantity < len(Times_IDRange_Todo):
-                     ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[Submit_Quantity]);
-                     #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.e"';     
-                     #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + Option
-                     #print(cmd);
-                     #os.system(cmd);
-                     os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-                     Submit_Quantity = Submit_Quantity + 1
-                 break;
-        if Finished_Quantity >= Jobs_Quantity:
-            break;    
-
-def ElasticNet_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity):
+    Subjects_Data = Data_Open(Subjects_Data)
+    Permutation_Function = functools.partial(ElasticNet_KFold_Sort, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, Fold_Quantity=Fold_Quantity, Alpha_Range=Alpha_Range, \
+        L1_ratio_Range=L1_ratio_Range, Parallel_Quantity=Parallel_Quantity, Permutation_Flag=1, Screen_Flag=Screen_Flag, \
+        Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag)
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided, by one pool of processes for all the waves
+        Pool = Permutation_Pool(Permutation_Function, Max_Queued, 'ElasticNet.log')
+        Run_Function = functools.partial(Permutation_Run, Permutation_Function, ResultantFolder=ResultantFolder, Max_Queued=Max_Queued, \
+            Log_Name='ElasticNet.log', Seed=Seed, Store_Flag=Store_Flag, Pool=Pool)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'Res_NFold.mat', 'Mean_Corr', P_Threshold, Error_Rate, max(Max_Queued, 10), Store_Flag, Pool)
+    Permutation_Run(Permutation_Function, Times_IDRange, ResultantFolder, Max_Queued, Log_Name='ElasticNet.log', Seed=Seed, Store_Flag=Store_Flag)
+
+def ElasticNet_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Seed=None):
     #
     # For permutation test, This function will call 'ElasticNet_KFold_Sort' function
     #
     # Subjects_Data_Mat_Path:
     #     The path of .mat file that contain a variable named 'Subjects_Data'
     #     Variable 'Subjects_Data' is a n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Other variables are the same with function 'ElasticNet_KFold_Sort'
+    # Seed: see 'ElasticNet_KFold_Sort'
     #
     
-    data = sio.loadmat(Subjects_Data_Mat_Path)
-    Subjects_Data = data['Subjects_Data']
-    ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, 1); 
+    Subjects_Data = Data_Open(Subjects_Data_Mat_Path)
+    ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, 1, Seed=Seed); 
 
-def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag):
+def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Screen_Flag=0, Schedule_Flag=0, BLAS_Threads=1, Seed=None, Checkpoint_Flag=0, Float32_Flag=0, Path_Flag=0, Saturation_Flag=0):
     #
     # Elastic-Net regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
@@ -142,6 +122,9 @@ def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ra
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
+    #     or a scipy.sparse CSR matrix (or the path of a .npz file of scipy.sparse.save_npz), which is MaxAbs scaled instead of
+    #     MinMax scaled, so the folds and the fits stay sparse, see Common_CZ_Sparse, then Schedule_Flag is not used
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -160,8 +143,46 @@ def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ra
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Screen_Flag:
+    #     1: fit ElasticNet with strong rule screening and KKT checks, see 'Screen_Fit' in Common_CZ_Screen,
+    #        the solution is not changed, and the fitting time and the quantity of discarded features are also saved
+    #     0: fit with all the features (default)
+    # Schedule_Flag:
+    #     1: schedule the fits of all the folds and parameters in Parallel_Quantity processes, see 'ElasticNet_KFold_Sort_Schedule'
+    #        Screen_Flag, Path_Flag and Saturation_Flag are not used
+    #     0: the folds one by one, with Parallel_Quantity threads over the parameters (default)
+    # BLAS_Threads:
+    #     Only for Schedule_Flag = 1, quantity of BLAS threads of each process
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'ElasticNet_KFold_Sort_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
+    # Checkpoint_Flag:
+    #     1: the selected parameters and the results of each finished outer fold are appended to ResultantFolder/Checkpoint.ckpt,
+    #        and a restarted run with the same data and setting skips these folds, see 'Checkpoint_Open' in Common_CZ_Checkpoint;
+    #        the checkpoint is removed when the run finishes (only for Schedule_Flag = 0)
+    #     0: no checkpoint (default)
+    # Float32_Flag:
+    #     1: the data are converted to float32 and the scaling and fitting are in float32, half of the memory of float64,
+    #        see Common_CZ_Precision; 'Precision_Validate' compares the results with float64
+    #     0: the data as they are, generally float64 (default)
+    # Path_Flag:
+    #     1: the alphas of each inner fold are fitted along one warm-started path, see 'Path_Predict' in Common_CZ_Path,
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas are not fitted and get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
+    Subjects_Data = Precision_Data(Subjects_Data, Float32_Flag)
+    if Schedule_Flag and not Sparse_Check(Subjects_Data):
+        return ElasticNet_KFold_Sort_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, BLAS_Threads, Seed)
+
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     Subjects_Quantity = len(Subjects_Score)
@@ -170,44 +191,54 @@ def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ra
     Subjects_Data = Subjects_Data[Sorted_Index, :]
     Subjects_Score = Subjects_Score[Sorted_Index]
 
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    MaxSize = EachFold_Size * Fold_Quantity
-    EachFold_Max = np.ones(Fold_Quantity, np.int) * MaxSize
-    tmp = np.arange(Fold_Quantity - 1, -1, -1)
-    EachFold_Max = EachFold_Max - tmp;
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    for j in np.arange(Remain):
-        EachFold_Max[j] = EachFold_Max[j] + Fold_Quantity
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
+    if Checkpoint_Flag:
+        Checkpoint = Checkpoint_Open(ResultantFolder, {'Data': Checkpoint_Hash(Subjects_Data, Subjects_Score), 'Permutation_Flag': Permutation_Flag, 'Seed': Seed, \
+            'Fold_Quantity': Fold_Quantity, 'Alpha_Range': Alpha_Range, 'L1_ratio_Range': L1_ratio_Range, 'Screen_Flag': Screen_Flag, \
+            'Path_Flag': Path_Flag, 'Saturation_Flag': Saturation_Flag})
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = np.arange(j, EachFold_Max[j], Fold_Quantity)
-        Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
+        Fold_J_Index = Fold_Index[j]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
-        Subjects_Data_train = np.delete(Subjects_Data, Fold_J_Index, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index) 
 
         if Permutation_Flag:
             # If doing permutation, the training scores should be permuted, while the testing scores remain
             Subjects_Index_Random = np.arange(len(Subjects_Score_train));
-            np.random.shuffle(Subjects_Index_Random);
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
             Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
             if j == 0:
                 RandIndex = {'Fold_0': Subjects_Index_Random}
             else:
                 RandIndex['Fold_' + str(j)] = Subjects_Index_Random  
 
-        Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity)
+        if Checkpoint_Flag and j in Checkpoint['Record']:
+            # The fold finished before the restart, its results are in Fold_<j>_Score.mat
+            Fold_Corr.append(Checkpoint['Record'][j]['Corr'])
+            Fold_MAE.append(Checkpoint['Record'][j]['MAE'])
+            continue
+
+        # The data are copied only for the folds to compute
+        Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
+        Subjects_Data_train = Sparse_Delete(Subjects_Data, Fold_J_Index)
+
+        Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, \
+            Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag, Screen_Flag=Screen_Flag)
 
-        normalize = preprocessing.MinMaxScaler()
+        normalize = Sparse_Scaler(Subjects_Data_train)
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
         Subjects_Data_test = normalize.transform(Subjects_Data_test)
 
-        clf = linear_model.ElasticNet(alpha=Optimal_Alpha, l1_ratio=Optimal_L1_ratio)
-        clf.fit(Subjects_Data_train, Subjects_Score_train)
+        if Screen_Flag:
+            clf, Screen_Info = Screen_Fit(Subjects_Data_train, Subjects_Score_train, Optimal_Alpha, Optimal_L1_ratio)
+        else:
+            clf = linear_model.ElasticNet(alpha=Optimal_Alpha, l1_ratio=Optimal_L1_ratio)
+            clf.fit(Subjects_Data_train, Subjects_Score_train)
         Fold_J_Score = clf.predict(Subjects_Data_test)
 
         Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
@@ -216,10 +247,14 @@ def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ra
         Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
         Fold_MAE.append(Fold_J_MAE)
     
-        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE}
+        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE, 'Alpha':Optimal_Alpha, 'L1_ratio':Optimal_L1_ratio}
+        if Screen_Flag:
+            Fold_J_result.update(Screen_Info)
         Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
         ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
         sio.savemat(ResultantFile, Fold_J_result)
+        if Checkpoint_Flag:
+            Checkpoint_Append(Checkpoint, j, Fold_J_result)
 
     Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
     Mean_Corr = np.mean(Fold_Corr)
@@ -227,13 +262,128 @@ def ElasticNet_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ra
     Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
     ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
     sio.savemat(ResultantFile, Res_NFold)
+    if Checkpoint_Flag:
+        Checkpoint_Close(Checkpoint)
     return (Mean_Corr, Mean_MAE)  
 
-def ElasticNet_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
+def ElasticNet_KFold_Sort_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, BLAS_Threads=1, Seed=None):
+    #
+    # The same with 'ElasticNet_KFold_Sort', while the fits are scheduled in a pool of Parallel_Quantity processes, see 'Schedule_Run'
+    # The fits of all the (outer fold, inner fold, alpha & l1 ratio) are one queue, and then the fits of all the outer folds with their optimal parameters
+    # The splits are the same with 'ElasticNet_KFold_Sort'; with Permutation_Flag, the permutations of all the outer folds are drawn
+    # before the fits, so they differ from 'ElasticNet_KFold_Sort' with the same seed, where each fit also draws from the random state
+    #
+    # BLAS_Threads:
+    #     Quantity of BLAS threads of each process, Parallel_Quantity * BLAS_Threads should not be larger than the quantity of cores
+    # Other variables are the same with function 'ElasticNet_KFold_Sort'
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+    Subjects_Quantity = len(Subjects_Score)
+    # The subjects are sorted by the scores, and the splits are the index of the subjects in Subjects_Data
+    Sorted_Index = np.argsort(Subjects_Score)
+    Subjects_Score = Subjects_Score[Sorted_Index]
+    Parameter_Combination_Quantity = len(Alpha_Range) * len(L1_ratio_Range)
+
+    Random_Generator = Split_Generator(Seed)
+    Fold_Index = []
+    Training_Index = []
+    Training_Score = []
+    for j in np.arange(Fold_Quantity):
+        # The same folds with 'ElasticNet_KFold_Sort'
+        Fold_J_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index'][j]
+        Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index)
+        if Permutation_Flag:
+            # If doing permutation, the training scores should be permuted, while the testing scores remain
+            Subjects_Index_Random = np.arange(len(Subjects_Score_train))
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
+        Fold_Index.append(Fold_J_Index)
+        Training_Index.append(np.delete(Sorted_Index, Fold_J_Index))
+        Training_Score.append(Subjects_Score_train)
+
+    # Queue of the inner fits, the inner training data is sorted by the scores as in 'ElasticNet_OptimalAlpha_KFold'
+    Task_Args = []
+    Inner_Score_test = []
+    for j in np.arange(Fold_Quantity):
+        Inner_Sorted_Index = np.argsort(Training_Score[j])
+        for k in np.arange(Fold_Quantity):
+            Inner_Fold_K_Position = Split_Fold(len(Inner_Sorted_Index), Fold_Quantity)['Test_Index'][k]
+            Inner_Fold_K_Index = Inner_Sorted_Index[Inner_Fold_K_Position]
+            Inner_Fold_K_Train_Index = np.delete(Inner_Sorted_Index, Inner_Fold_K_Position)
+            Inner_Score_test.append(Training_Score[j][Inner_Fold_K_Index])
+            for l in np.arange(Parameter_Combination_Quantity):
+                Alpha_Index = np.int64(np.ceil((l + 1) / len(L1_ratio_Range))) - 1
+                L1_ratio_Index = np.mod(l, len(L1_ratio_Range))
+                Task_Args.append((Training_Index[j][Inner_Fold_K_Train_Index], Training_Index[j][Inner_Fold_K_Index], \
+                    Training_Score[j][Inner_Fold_K_Train_Index], Path_Predict, [Alpha_Range[Alpha_Index]], L1_ratio_Range[L1_ratio_Index]))
+    Inner_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Optimal_Alpha = np.zeros(Fold_Quantity)
+    Optimal_L1_ratio = np.zeros(Fold_Quantity)
+    for j in np.arange(Fold_Quantity):
+        Inner_Corr = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
+        Inner_MAE_inv = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
+        for k in np.arange(Fold_Quantity):
+            Task_ID = (j * Fold_Quantity + k) * Parameter_Combination_Quantity
+            Predict_Score = np.hstack(Inner_Results[Task_ID:Task_ID + Parameter_Combination_Quantity])
+            Inner_Corr[k, :], Inner_MAE_inv[k, :] = Path_Evaluate(Predict_Score, Inner_Score_test[j * Fold_Quantity + k])
+        Inner_Corr = np.nan_to_num(Inner_Corr)
+        Inner_Evaluation, Optimal_Combination_Index = Score_Select(Inner_Corr, Inner_MAE_inv)
+        Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Evaluation':Inner_Evaluation}
+        sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
+        Optimal_Alpha[j] = Alpha_Range[np.int64(np.ceil((Optimal_Combination_Index + 1) / len(L1_ratio_Range))) - 1]
+        Optimal_L1_ratio[j] = L1_ratio_Range[np.mod(Optimal_Combination_Index, len(L1_ratio_Range))]
+
+    # Queue of the outer fits
+    Task_Args = [(Training_Index[j], Sorted_Index[Fold_Index[j]], Training_Score[j], Path_Predict, [Optimal_Alpha[j]], Optimal_L1_ratio[j]) for j in np.arange(Fold_Quantity)]
+    Outer_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Fold_Corr = [];
+    Fold_MAE = [];
+    for j in np.arange(Fold_Quantity):
+        Subjects_Score_test = Subjects_Score[Fold_Index[j]]
+        Fold_J_Score = Outer_Results[j][:, 0]
+        Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
+        Fold_J_Corr = Fold_J_Corr[0,1]
+        Fold_Corr.append(Fold_J_Corr)
+        Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
+        Fold_MAE.append(Fold_J_MAE)
+
+        Fold_J_result = {'Index':Fold_Index[j], 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE, 'Alpha':Optimal_Alpha[j], 'L1_ratio':Optimal_L1_ratio[j]}
+        Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
+        ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
+        sio.savemat(ResultantFile, Fold_J_result)
+
+    Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
+    Mean_Corr = np.mean(Fold_Corr)
+    Mean_MAE = np.mean(Fold_MAE)
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def ElasticNet_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Screen_Flag=0, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None, Path_Flag=0, Saturation_Flag=0):
     #
     # Permutation test for 'ElasticNet_APredictB'
+    # Screen_Flag, Path_Flag, Saturation_Flag: see 'ElasticNet_APredictB'
+    # Observed_Corr, P_Threshold, Error_Rate:
+    #     Optional, Predict_Corr of 'ElasticNet_APredictB' without permutation; if given, the permutations stop once p < P_Threshold or
+    #     p > P_Threshold is decided, see 'Permutation_Adaptive' in Common_CZ_Permutation, the summary is in ResultantFolder/Res_Adaptive.mat
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
     #
      
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided
+        Run_Function = functools.partial(ElasticNet_APredictB_Permutation, Training_Data=Training_Data, Training_Score=Training_Score, \
+            Testing_Data=Testing_Data, Testing_Score=Testing_Score, Alpha_Range=Alpha_Range, L1_ratio_Range=L1_ratio_Range, \
+            Nested_Fold_Quantity=Nested_Fold_Quantity, ResultantFolder=ResultantFolder, Parallel_Quantity=Parallel_Quantity, Screen_Flag=Screen_Flag, Seed=Seed, \
+            Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'APredictB.mat', 'Predict_Corr', P_Threshold, Error_Rate)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     for i in np.arange(len(Times_IDRange)):
@@ -241,14 +391,17 @@ def ElasticNet_APredictB_Permutation(Training_Data, Training_Score, Testing_Data
         if not os.path.exists(ResultantFolder_I):
             os.mkdir(ResultantFolder_I)
         if not os.path.exists(ResultantFolder_I + '/APredictB.mat'):
-            ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder_I, Parallel_Quantity, 1)
+            ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder_I, Parallel_Quantity, 1, Screen_Flag, Split_Seed(Seed, Times_IDRange[i]), \
+                Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag)
 
-def ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Permutation_Flag):
+def ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Permutation_Flag, Screen_Flag=0, Seed=None, Float32_Flag=0, Path_Flag=0, Saturation_Flag=0):
     #
     # Elastic-Net regression with training data to predict testing data
     #
     # Training_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     Training_Data and Testing_Data can also be the paths of .npy or HDF5 files, which are memory-mapped, see 'Data_Open' in Common_CZ_Data
+    #     or scipy.sparse CSR matrices, which are MaxAbs scaled instead of MinMax scaled, see Common_CZ_Sparse
     # Training_Score:
     #     n*1 vector, n is subjects quantity
     # Testing_Data:
@@ -271,8 +424,34 @@ def ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Sc
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Screen_Flag:
+    #     1: fit ElasticNet with strong rule screening and KKT checks, see 'Screen_Fit' in Common_CZ_Screen,
+    #        the solution is not changed, and the fitting time and the quantity of discarded features are also saved
+    #     0: fit with all the features (default)
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'ElasticNet_APredictB_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
+    # Float32_Flag:
+    #     1: the data are converted to float32 and the scaling and fitting are in float32, half of the memory of float64,
+    #        see Common_CZ_Precision; 'Precision_Validate' compares the results with float64
+    #     0: the data as they are, generally float64 (default)
+    # Path_Flag:
+    #     1: the alphas of each inner fold are fitted along one warm-started path, see 'Path_Predict' in Common_CZ_Path,
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas are not fitted and get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
     #
     
+    Training_Data = Data_Open(Training_Data)
+    Testing_Data = Data_Open(Testing_Data)
+    Training_Data = Precision_Data(Training_Data, Float32_Flag)
+    Testing_Data = Precision_Data(Testing_Data, Float32_Flag)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
 
@@ -280,30 +459,36 @@ def ElasticNet_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Sc
         # If do permutation, the training scores should be permuted, while the testing scores remain
         # Fold12
         Training_Index_Random = np.arange(len(Training_Score))
-        np.random.shuffle(Training_Index_Random)
+        Split_Shuffle(Training_Index_Random, Split_Generator(Seed))
         Training_Score = Training_Score[Training_Index_Random]
         Random_Index = {'Training_Index_Random': Training_Index_Random}
         sio.savemat(ResultantFolder + '/Random_Index.mat', Random_Index);
 
     # Select optimal alpha & L1_ratio using inner fold cross validation
-    Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Nested_Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity)
+    Optimal_Alpha, Optimal_L1_ratio = ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Nested_Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, \
+        Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag, Screen_Flag=Screen_Flag)
 
-    Scale = preprocessing.MinMaxScaler()
+    Scale = Sparse_Scaler(Training_Data)
     Training_Data = Scale.fit_transform(Training_Data)
     Testing_Data = Scale.transform(Testing_Data)  
     
-    clf = linear_model.ElasticNet(alpha=Optimal_Alpha, l1_ratio=Optimal_L1_ratio)
-    clf.fit(Training_Data, Training_Score)
+    if Screen_Flag:
+        clf, Screen_Info = Screen_Fit(Training_Data, Training_Score, Optimal_Alpha, Optimal_L1_ratio)
+    else:
+        clf = linear_model.ElasticNet(alpha=Optimal_Alpha, l1_ratio=Optimal_L1_ratio)
+        clf.fit(Training_Data, Training_Score)
     Predict_Score = clf.predict(Testing_Data)
 
     Predict_Corr = np.corrcoef(Predict_Score, Testing_Score)
     Predict_Corr = Predict_Corr[0,1]
     Predict_MAE = np.mean(np.abs(np.subtract(Predict_Score, Testing_Score)))
     Predict_result = {'Test_Score':Testing_Score, 'Predict_Score':Predict_Score, 'Weight':clf.coef_, 'Predict_Corr':Predict_Corr, 'Predict_MAE':Predict_MAE, 'alpha':Optimal_Alpha, 'l1_ratio':Optimal_L1_ratio}
+    if Screen_Flag:
+        Predict_result.update(Screen_Info)
     sio.savemat(ResultantFolder+'/APredictB.mat', Predict_result)
     return (Predict_Corr, Predict_MAE)
 
-def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity):
+def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, L1_ratio_Range, ResultantFolder, Parallel_Quantity, Debug_Flag=0, Path_Flag=0, Saturation_Flag=0, Screen_Flag=0):
     #
     # Select optimal regularization parameter using nested cross-validation
     #
@@ -324,68 +509,97 @@ def ElasticNet_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity,
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Debug_Flag:
+    #     1: also write the result of each parameter into ResultantFolder as a .mat file, for debugging
+    #     0: keep the results of each parameter in memory only (default)
+    # Path_Flag:
+    #     1: fit all the alphas of a fold along one warm-started path (from the largest alpha), see 'Path_Predict' in Common_CZ_Path
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately from zero coefficients (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
+    # Screen_Flag:
+    #     1: fit with strong rule screening and KKT checks, the fitting time and the quantity of discarded features
+    #        of each fit are also saved into Inner_Evaluation.mat; with Path_Flag = 1, the path is screened by the
+    #        sequential strong rule, see 'Path_Screen_Predict' in Common_CZ_Path
+    #     0: fit with all the features (default)
     #
    
     Subjects_Quantity = len(Training_Score)
     # Sort the subjects score
     Sorted_Index = np.argsort(Training_Score)
-    Training_Data = Training_Data[Sorted_Index, :]
     Training_Score = Training_Score[Sorted_Index]
     
-    Inner_EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    MaxSize = Inner_EachFold_Size * Fold_Quantity
-    EachFold_Max = np.ones(Fold_Quantity, np.int) * MaxSize
-    tmp = np.arange(Fold_Quantity - 1, -1, -1)
-    EachFold_Max = EachFold_Max - tmp
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    for j in np.arange(Remain):
-    	EachFold_Max[j] = EachFold_Max[j] + Fold_Quantity
+    Inner_Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    # Training_Data is not sorted, the data of each inner fold are taken by index into one buffer, see 'Fold_Data' in Common_CZ_Fold
+    Fold_Data_Buffer = Fold_Buffer(Training_Data)
     
     Parameter_Combination_Quantity = len(Alpha_Range) * len(L1_ratio_Range)
     Inner_Corr = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
     Inner_MAE_inv = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
+    if Screen_Flag:
+        Inner_Fit_Time = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
+        Inner_Discarded_Quantity = np.zeros((Fold_Quantity, Parameter_Combination_Quantity))
 
     for k in np.arange(Fold_Quantity):
         
-        Inner_Fold_K_Index = np.arange(k, EachFold_Max[k], Fold_Quantity)
-        Inner_Fold_K_Data_test = Training_Data[Inner_Fold_K_Index, :]
+        Inner_Fold_K_Index = Inner_Fold_Index[k]
         Inner_Fold_K_Score_test = Training_Score[Inner_Fold_K_Index]
-        Inner_Fold_K_Data_train = np.delete(Training_Data, Inner_Fold_K_Index, axis=0)
         Inner_Fold_K_Score_train = np.delete(Training_Score, Inner_Fold_K_Index)
         
-        Scale = preprocessing.MinMaxScaler()
-        Inner_Fold_K_Data_train = Scale.fit_transform(Inner_Fold_K_Data_train)
-        Inner_Fold_K_Data_test = Scale.transform(Inner_Fold_K_Data_test)    
+        # The rows of Training_Data are taken in the sorted order
+        Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Training_Data, Sorted_Index[Inner_Fold_K_Index], Fold_Data_Buffer, np.delete(Sorted_Index, Inner_Fold_K_Index))
         
-        Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(ElasticNet_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range, L1_ratio_Range, l, ResultantFolder) for l in np.arange(Parameter_Combination_Quantity))        
+        if Path_Flag:
+            # One warm-started path of all the alphas for each l1 ratio
+            if Screen_Flag:
+                Path_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Path_Screen_Predict)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range, L1_ratio_Range[r], Saturation_Flag) for r in np.arange(len(L1_ratio_Range)))
+                # The screening of each combination, in the order of the combinations as the predictions below
+                Fit_Time = np.stack([Path_Result[1]['Fit_Time'] for Path_Result in Path_Results], axis=1).reshape(-1)
+                Discarded_Quantity = np.stack([Path_Result[1]['Discarded_Quantity'] for Path_Result in Path_Results], axis=1).reshape(-1)
+                Path_Results = [Path_Result[0] for Path_Result in Path_Results]
+            else:
+                Path_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Path_Predict)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range, L1_ratio_Range[r], Saturation_Flag) for r in np.arange(len(L1_ratio_Range)))
+            # The l-th combination is (Alpha_Range[l // len(L1_ratio_Range)], L1_ratio_Range[l % len(L1_ratio_Range)]),
+            # i.e., the columns of the t*len(Alpha_Range)*len(L1_ratio_Range) predictions in order
+            Predict_Score = np.stack(Path_Results, axis=2).reshape(len(Inner_Fold_K_Score_test), Parameter_Combination_Quantity)
+            Fold_Corr, Fold_MAE_inv = Path_Evaluate(Predict_Score, Inner_Fold_K_Score_test)
+            if Screen_Flag:
+                Alpha_Results = [(Fold_Corr[l], Fold_MAE_inv[l], {'Fit_Time': Fit_Time[l], 'Discarded_Quantity': Discarded_Quantity[l]}) for l in np.arange(Parameter_Combination_Quantity)]
+            else:
+                Alpha_Results = list(zip(Fold_Corr, Fold_MAE_inv))
+            if Debug_Flag:
+                for l in np.arange(Parameter_Combination_Quantity):
+                    Fold_result = {'Corr': Fold_Corr[l], 'MAE_inv':Fold_MAE_inv[l]}
+                    sio.savemat(ResultantFolder + '/Alpha_' + str(l) + '.mat', Fold_result)
+        else:
+            Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(ElasticNet_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range, L1_ratio_Range, l, ResultantFolder, Debug_Flag, Screen_Flag) for l in np.arange(Parameter_Combination_Quantity))
         for l in np.arange(Parameter_Combination_Quantity):
-            print(l)
-            Fold_l_Mat_Path = ResultantFolder + '/Alpha_' + str(l) + '.mat';
-            Fold_l_Mat = sio.loadmat(Fold_l_Mat_Path)
-            Inner_Corr[k, l] = Fold_l_Mat['Corr'][0][0]
-            Inner_MAE_inv[k, l] = Fold_l_Mat['MAE_inv']
-            os.remove(Fold_l_Mat_Path)
+            Inner_Corr[k, l], Inner_MAE_inv[k, l] = Alpha_Results[l][:2]
+            if Screen_Flag:
+                Inner_Fit_Time[k, l] = Alpha_Results[l][2]['Fit_Time']
+                Inner_Discarded_Quantity[k, l] = Alpha_Results[l][2]['Discarded_Quantity']
             
         Inner_Corr = np.nan_to_num(Inner_Corr)
 
-    Inner_Corr_Mean = np.mean(Inner_Corr, axis=0)
-    Inner_Corr_Mean = (Inner_Corr_Mean - np.mean(Inner_Corr_Mean)) / np.std(Inner_Corr_Mean)
-    Inner_MAE_inv_Mean = np.mean(Inner_MAE_inv, axis=0)
-    Inner_MAE_inv_Mean = (Inner_MAE_inv_Mean - np.mean(Inner_MAE_inv_Mean)) / np.std(Inner_MAE_inv_Mean)
-    Inner_Evaluation = Inner_Corr_Mean + Inner_MAE_inv_Mean
+    Inner_Evaluation, Optimal_Combination_Index = Score_Select(Inner_Corr, Inner_MAE_inv)
     
     Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Evaluation':Inner_Evaluation}
+    if Screen_Flag:
+        Inner_Evaluation_Mat['Inner_Fit_Time'] = Inner_Fit_Time
+        Inner_Evaluation_Mat['Inner_Discarded_Quantity'] = Inner_Discarded_Quantity
     sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
     
-    Optimal_Combination_Index = np.argmax(Inner_Evaluation) 
-    
     Optimal_Alpha_Index = np.int64(np.ceil((Optimal_Combination_Index + 1) / len(L1_ratio_Range))) - 1
     Optimal_Alpha = Alpha_Range[Optimal_Alpha_Index]
     Optimal_L1_ratio_Index = np.mod(Optimal_Combination_Index, len(L1_ratio_Range))
     Optimal_L1_ratio = L1_ratio_Range[Optimal_L1_ratio_Index]
     return (Optimal_Alpha, Optimal_L1_ratio)
 
-def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Parameter_Combination_Index, ResultantFolder):
+def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, L1_ratio_Range, Parameter_Combination_Index, ResultantFolder, Debug_Flag=0, Screen_Flag=0):
     #
     # Sub-function for optimal regularization parameter selection
     # The range of Parameter_Combination_Index is: 0----(len(Alpha_Range)*len(L1_ratio_Range)-1))
@@ -407,19 +621,32 @@ def ElasticNet_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Sco
     #     The indice of the (alpha, L1_ratio) combination we tested in the whole range
     # ResultantFolder:
     #     Folder to storing the results
+    # Debug_Flag:
+    #     1: also write the result of this parameter into ResultantFolder as a .mat file, for debugging
+    #     0: only return the result, nothing is written (default)
+    # Screen_Flag:
+    #     1: fit with strong rule screening and KKT checks, and also return the 'Screen_Info' of 'Screen_Fit'
+    #     0: fit with all the features (default)
     #
 
     Alpha_Index = np.int64(np.ceil((Parameter_Combination_Index + 1) / len(L1_ratio_Range))) - 1
     L1_ratio_Index = np.mod(Parameter_Combination_Index, len(L1_ratio_Range))
-    clf = linear_model.ElasticNet(l1_ratio=L1_ratio_Range[L1_ratio_Index], alpha=Alpha_Range[Alpha_Index])
-    clf.fit(Training_Data, Training_Score)
+    if Screen_Flag:
+        clf, Screen_Info = Screen_Fit(Training_Data, Training_Score, Alpha_Range[Alpha_Index], L1_ratio_Range[L1_ratio_Index])
+    else:
+        clf = linear_model.ElasticNet(l1_ratio=L1_ratio_Range[L1_ratio_Index], alpha=Alpha_Range[Alpha_Index])
+        clf.fit(Training_Data, Training_Score)
     Predict_Score = clf.predict(Testing_Data)
-    Fold_Corr = np.corrcoef(Predict_Score, Testing_Score)
-    Fold_Corr = Fold_Corr[0,1]
-    Fold_MAE_inv = np.divide(1, np.mean(np.abs(Predict_Score - Testing_Score)))
-    Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
-    ResultantFile = ResultantFolder + '/Alpha_' + str(Parameter_Combination_Index) + '.mat'
-    sio.savemat(ResultantFile, Fold_result)
+    Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Testing_Score)
+    if Debug_Flag:
+        Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
+        if Screen_Flag:
+            Fold_result.update(Screen_Info)
+        ResultantFile = ResultantFolder + '/Alpha_' + str(Parameter_Combination_Index) + '.mat'
+        sio.savemat(ResultantFile, Fold_result)
+    if Screen_Flag:
+        return (Fold_Corr, Fold_MAE_inv, Screen_Info)
+    return (Fold_Corr, Fold_MAE_inv)
     
 def ElasticNet_Weight(Subjects_Data, Subjects_Score, Alpha_Range, L1_ratio_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
     #
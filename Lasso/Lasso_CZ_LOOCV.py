@@ -11,20 +11,33 @@
 #
 
 import os
+import sys
+import functools
 import scipy.io as sio
 import numpy as np
 import time
 from sklearn import linear_model
 from sklearn import preprocessing
 from joblib import Parallel, delayed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Path import Path_Predict
+from Common_CZ_Score import Score_Evaluate
+from Common_CZ_Split import Split_Generator, Split_Shuffle
+from Common_CZ_Permutation import Permutation_Run, Permutation_LOOCV, Permutation_Corr
+from Common_CZ_Checkpoint import Checkpoint_Open, Checkpoint_Append, Checkpoint_Close, Checkpoint_Hash
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Data import Data_Open
+from Common_CZ_Precision import Precision_Data
+from Common_CZ_Sparse import Sparse_Delete, Sparse_Scaler
   
-def Lasso_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Alpha_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions):
+def Lasso_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Alpha_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions, Batch_Flag=0, Seed=None, Store_Flag=0, Path_Flag=0, Saturation_Flag=0):
     
     #
     # Lasso regression with leave-one-out cross-validation (LOOCV)
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Times_IDRange:
@@ -36,97 +49,139 @@ def Lasso_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Alpha_
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
     # Max_Queued:
-    #     The maximum jobs to be submitted to SGE cluster at the same time 
+    #     The maximum permutations running at the same time on this computer, see 'Permutation_Run'
     # QueueOptions:
-    #     Generally is '-q all.q' for SGE cluster 
+    #     Not used, kept for compatibility (permutations were submitted as jobs of SGE cluster)
+    # Batch_Flag:
+    #     1: run the permutations in blocks in this process, with the null distribution in ResultantFolder/Res_Permutation.mat,
+    #        see 'Lasso_LOOCV_Permutation_Batch', and returns its Res_Permutation
+    #     0: run each permutation by 'Lasso_LOOCV' in a pool of Max_Queued processes (default)
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Store_Flag:
+    #     Only for Batch_Flag = 0 (the batch test keeps the null distribution in one file already)
+    #     1: the results of all the permutations are kept in ResultantFolder/Res_Store.ckpt instead of a folder for each,
+    #        see Common_CZ_Store; 'Store_Null' gives the null distribution, and 'Store_Export_Mat' the .mat files
+    #     0: the results of the i-th permutation are in ResultantFolder/Time_i (default)
+    # Path_Flag, Saturation_Flag:
+    #     Only for Batch_Flag = 0, see 'Lasso_LOOCV'
     #
 
-    if not os.path.exists(ResultantFolder):
-        os.mkdir(ResultantFolder)
-    Subjects_Data_Mat = {'Subjects_Data': Subjects_Data}
-    Subjects_Data_Mat_Path = ResultantFolder + '/Subjects_Data.mat'
-    sio.savemat(Subjects_Data_Mat_Path, Subjects_Data_Mat)
-    Finish_File = []
-    Times_IDRange_Todo = np.int64(np.array([]))
-    for i in np.arange(len(Times_IDRange)):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
-        if not os.path.exists(ResultantFolder_I):
-            os.mkdir(ResultantFolder_I)
-        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
-            Times_IDRange_Todo = np.insert(Times_IDRange_Todo, len(Times_IDRange_Todo), Times_IDRange[i])
-            Configuration_Mat = {'Subjects_Data_Mat_Path': Subjects_Data_Mat_Path, 'Subjects_Score': Subjects_Score, \
-                'Alpha_Range': Alpha_Range, 'ResultantFolder_I': ResultantFolder_I, 'Parallel_Quantity': Parallel_Quantity};
-            sio.savemat(ResultantFolder_I + '/Configuration.mat', Configuration_Mat)
-            system_cmd = 'python3 -c ' + '\'import sys;\
-                sys.path.append("' + os.getcwd() + '");\
-                from Lasso_CZ_Sort import Lasso_KFold_Sort_Permutation_Sub;\
-                import os;\
-                import scipy.io as sio;\
-                configuration = sio.loadmat("' + ResultantFolder_I + '/Configuration.mat");\
-                Subjects_Data_Mat_Path = configuration["Subjects_Data_Mat_Path"];\
-                Subjects_Score = configuration["Subjects_Score"];\
-                Alpha_Range = configuration["Alpha_Range"];\
-                ResultantFolder_I = configuration["ResultantFolder_I"];\
-                Parallel_Quantity = configuration["Parallel_Quantity"];\
-                Lasso_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path[0], Subjects_Score[0], Alpha_Range[0], ResultantFolder_I[0], Parallel_Quantity[0][0])\' ';
-            system_cmd = system_cmd + ' > "' + ResultantFolder_I + '/Lasso.log" 2>&1\n'
-            Finish_File.append(ResultantFolder_I + '/Res_NFold.mat')
-            script = open(ResultantFolder_I + '/script.sh', 'w') 
-            script.write(system_cmd)
-            script.close()
+    Subjects_Data = Data_Open(Subjects_Data)
+    if Batch_Flag:
+        return Lasso_LOOCV_Permutation_Batch(Subjects_Data, Subjects_Score, Times_IDRange, Alpha_Range, ResultantFolder, Parallel_Quantity, Seed=Seed)
+    Permutation_Function = functools.partial(Lasso_LOOCV, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, Alpha_Range=Alpha_Range, \
+        Parallel_Quantity=Parallel_Quantity, Permutation_Flag=1, Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag)
+    Permutation_Run(Permutation_Function, Times_IDRange, ResultantFolder, Max_Queued, Log_Name='Lasso.log', Seed=Seed, Store_Flag=Store_Flag)
+
+def Lasso_LOOCV_Permutation_Batch(Subjects_Data, Subjects_Score, Times_IDRange, Alpha_Range, ResultantFolder, Parallel_Quantity, Block_Size=100, Seed=None):
+    #
+    # Permutation test of 'Lasso_LOOCV' with the permutations run in blocks, see 'Permutation_LOOCV' in Common_CZ_Permutation
+    # Lasso has no closed form, but only the training scores change between the permutations, so the data of each outer and inner loop
+    # are scaled once for all the permutations of a block, and each alpha is fitted once with the permuted scores as the targets
+    # (linear_model.Lasso fits each target separately, so the predictions of each permutation are the same with 'Lasso_LOOCV' with its permuted scores)
+    #
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(1000)
+    # ResultantFolder:
+    #     Path of the folder storing Res_Permutation.mat, with the Corr and MAE of each permutation and the empirical p-values
+    # Block_Size:
+    #     Quantity of permutations run together
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is the same with 'Lasso_LOOCV' with Seed = Split_Seed(Seed, i), see 'Permutation_LOOCV'
+    # Other variables are the same with function 'Lasso_LOOCV'
+    #
+    # Return:
+    #     Res_Permutation, see 'Permutation_LOOCV'
+    #
 
-    Jobs_Quantity = len(Finish_File)
-    if len(Times_IDRange_Todo) > Max_Queued:
-        Submit_Quantity = Max_Queued
-    else:
-        Submit_Quantity = len(Times_IDRange_Todo)
-    for i in np.arange(Submit_Quantity):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[i])
-        #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.e"';
-        #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[i]) + Option;
-        #print(cmd);
-        #os.system(cmd)
-        os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-    Finished_Quantity = 0;
-    while 1:        
-        for i in np.arange(len(Finish_File)):
-             if os.path.exists(Finish_File[i]):
-                 Finished_Quantity = Finished_Quantity + 1
-                 print(Finish_File[i])
-                 del(Finish_File[i])
-                 print(time.strftime('%Y-%m-%d-%H-%M-%S',time.localtime(time.time())))
-                 print('Finish quantity = ' + str(Finished_Quantity))
-                 if Submit_Quantity < len(Times_IDRange_Todo):
-                     ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[Submit_Quantity]);
-                     #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.e"';     
-                     #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + Option
-                     #print(cmd);
-                     #os.system(cmd);
-                     os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-                     Submit_Quantity = Submit_Quantity + 1
-                 break;
-        if Finished_Quantity >= Jobs_Quantity:
-            break;    
+    Batch_Function = functools.partial(Lasso_LOOCV_Batch, Subjects_Data, Subjects_Score, Alpha_Range, Parallel_Quantity)
+    Setting = {'Data': Checkpoint_Hash(Subjects_Data, Subjects_Score), 'Alpha_Range': Alpha_Range}
+    return Permutation_LOOCV(Batch_Function, Subjects_Score, Times_IDRange, ResultantFolder, Block_Size, Seed, Setting)
 
-def Lasso_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity):
+def Lasso_LOOCV_Batch(Subjects_Data, Subjects_Score, Alpha_Range, Parallel_Quantity, Random_Index):
+    #
+    # LOOCV predictions of a block of permutations, see 'Lasso_LOOCV_Permutation_Batch'
+    #
+    # Random_Index:
+    #     P*n*(n-1) array, Random_Index[i, j] is the permutation of the training scores of the j-th loop in the i-th permutation
+    #
+    # Return:
+    #     Predicted_Score, n*P matrix
+    #
+
+    Subjects_Quantity = len(Subjects_Score)
+    Permutation_Quantity = np.shape(Random_Index)[0]
+    # The data of the outer and inner loops are taken by index into two buffers, see 'Fold_Data' in Common_CZ_Fold
+    Fold_Data_Buffer = Fold_Buffer(Subjects_Data)
+    Inner_Fold_Data_Buffer = Fold_Buffer(Subjects_Data)
+    Predicted_Score = np.zeros((Subjects_Quantity, Permutation_Quantity))
+    for j in np.arange(Subjects_Quantity):
+
+        Training_Index = np.delete(np.arange(Subjects_Quantity), j)
+        # The training scores of all the permutations, (n-1)*P
+        Subjects_Score_train = Subjects_Score[Training_Index][Random_Index[:, j].T]
+
+        Inner_Predicted_Score = np.zeros((len(Training_Index), len(Alpha_Range), Permutation_Quantity))
+        for k in np.arange(len(Training_Index)):
+            Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Subjects_Data, Training_Index[k], Inner_Fold_Data_Buffer, np.delete(Training_Index, k))
+            Inner_Fold_K_Score_train = np.delete(Subjects_Score_train, k, axis=0)
+            Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Lasso_SubAlpha_Batch)(Inner_Fold_K_Data_train, \
+                Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range[l]) for l in np.arange(len(Alpha_Range)))
+            for l in np.arange(len(Alpha_Range)):
+                Inner_Predicted_Score[k, l] = Alpha_Results[l][0]
+        Inner_Evaluation = Permutation_Corr(Inner_Predicted_Score, Subjects_Score_train[:, np.newaxis, :])
+        Optimal_Alpha_Index = np.argmax(Inner_Evaluation, axis=0)
+
+        # The permutations with the same optimal alpha are fitted together
+        Subjects_Data_train, Subjects_Data_test = Fold_Data(Subjects_Data, j, Fold_Data_Buffer)
+        for l in np.unique(Optimal_Alpha_Index):
+            Permutation_Index = np.nonzero(Optimal_Alpha_Index == l)[0]
+            Predicted_Score[j, Permutation_Index] = Lasso_SubAlpha_Batch(Subjects_Data_train, Subjects_Score_train[:, Permutation_Index], \
+                Subjects_Data_test, Alpha_Range[l])[0]
+    return Predicted_Score
+
+def Lasso_SubAlpha_Batch(Training_Data, Training_Score, Testing_Data, Alpha):
+    #
+    # Lasso of several score vectors on the same data with one alpha, each score vector is fitted separately
+    #
+    # Training_Score:
+    #     n*P matrix, P is the quantity of score vectors
+    #
+    # Return:
+    #     Predicted_Score, t*P matrix, t is testing subjects quantity
+    #
+
+    clf = linear_model.Lasso(alpha=Alpha)
+    clf.fit(Training_Data, Training_Score)
+    return np.reshape(clf.predict(Testing_Data), (np.shape(Testing_Data)[0], -1))
+
+def Lasso_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, Seed=None):
     #
     # For permutation test, This function will call 'Lasso_LOOCV' function
     #
     # Subjects_Data_Mat_Path:
     #     The path of .mat file that contain a variable named 'Subjects_Data'
     #     Variable 'Subjects_Data' is a n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Other variables are the same with function 'Lasso_KFold_Sort'
+    # Seed: see 'Lasso_LOOCV'
     #
 
-    data = sio.loadmat(Subjects_Data_Mat_Path)
-    Subjects_Data = data['Subjects_Data']
-    Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, 1);
+    Subjects_Data = Data_Open(Subjects_Data_Mat_Path)
+    Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, 1, Seed=Seed);
 
-def Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag):
+def Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Seed=None, Checkpoint_Flag=0, Float32_Flag=0, Path_Flag=0, Saturation_Flag=0):
     #
     # Lasso regression with leave-one-out cross-validation (LOOCV)   
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
+    #     or a scipy.sparse CSR matrix (or the path of a .npz file of scipy.sparse.save_npz), which is MaxAbs scaled instead of
+    #     MinMax scaled, so the folds and the fits stay sparse, see Common_CZ_Sparse
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Alpha_Range:
@@ -139,35 +194,74 @@ def Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Par
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'Lasso_LOOCV_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
+    # Checkpoint_Flag:
+    #     1: the selected parameter and the prediction of each finished loop are appended to ResultantFolder/Checkpoint.ckpt,
+    #        and a restarted run with the same data and setting skips these loops, see 'Checkpoint_Open' in Common_CZ_Checkpoint;
+    #        the checkpoint is removed when the run finishes
+    #     0: no checkpoint (default)
+    # Float32_Flag:
+    #     1: the data are converted to float32 and the scaling and fitting are in float32, half of the memory of float64,
+    #        see Common_CZ_Precision; 'Precision_Validate' compares the results with float64
+    #     0: the data as they are, generally float64 (default)
+    # Path_Flag:
+    #     1: the alphas of each inner loop are fitted along one warm-started path, see 'Path_Predict' in Common_CZ_Path,
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas are not fitted and get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
+    Subjects_Data = Precision_Data(Subjects_Data, Float32_Flag)
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
     Subjects_Quantity = len(Subjects_Score)
     
+    Random_Generator = Split_Generator(Seed)
+    if Checkpoint_Flag:
+        Checkpoint = Checkpoint_Open(ResultantFolder, {'Data': Checkpoint_Hash(Subjects_Data, Subjects_Score), 'Permutation_Flag': Permutation_Flag, 'Seed': Seed, \
+            'Alpha_Range': Alpha_Range, 'Path_Flag': Path_Flag, 'Saturation_Flag': Saturation_Flag})
     Predicted_Score = np.zeros((1, Subjects_Quantity))
     Predicted_Score = Predicted_Score[0]
+    Selected_Alpha = np.zeros(Subjects_Quantity)
     for j in np.arange(Subjects_Quantity):
 
-        Subjects_Data_test = Subjects_Data[j, :]
-        Subjects_Data_test = Subjects_Data_test.reshape(1,-1)
         Subjects_Score_test = Subjects_Score[j]
-        Subjects_Data_train = np.delete(Subjects_Data, j, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, j) 
 
         if Permutation_Flag:
             # If doing permutation, the training scores should be permuted, while the testing scores remain
             Subjects_Index_Random = np.arange(len(Subjects_Score_train));
-            np.random.shuffle(Subjects_Index_Random);
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
             Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
             if j == 0:
                 RandIndex = {'Fold_0': Subjects_Index_Random}
             else:
                 RandIndex['Fold_' + str(j)] = Subjects_Index_Random
 
-        Optimal_Alpha, Inner_Evaluation = Lasso_OptimalAlpha_LOOCV(Subjects_Data_train, Subjects_Score_train, Alpha_Range, ResultantFolder, Parallel_Quantity)
+        if Checkpoint_Flag and j in Checkpoint['Record']:
+            # The loop finished before the restart
+            Predicted_Score[j] = Checkpoint['Record'][j]['Predict_Score']
+            Selected_Alpha[j] = Checkpoint['Record'][j]['Alpha']
+            continue
 
-        normalize = preprocessing.MinMaxScaler()
+        # The data are copied only for the loops to compute
+        Subjects_Data_test = Subjects_Data[j, :]
+        Subjects_Data_test = Subjects_Data_test.reshape(1,-1)
+        Subjects_Data_train = Sparse_Delete(Subjects_Data, j)
+
+        Optimal_Alpha, Inner_Evaluation = Lasso_OptimalAlpha_LOOCV(Subjects_Data_train, Subjects_Score_train, Alpha_Range, ResultantFolder, Parallel_Quantity, \
+            Path_Flag=Path_Flag, Saturation_Flag=Saturation_Flag)
+
+        normalize = Sparse_Scaler(Subjects_Data_train)
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
         Subjects_Data_test = normalize.transform(Subjects_Data_test)
 
@@ -175,17 +269,22 @@ def Lasso_LOOCV(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Par
         clf.fit(Subjects_Data_train, Subjects_Score_train)
         Fold_J_Score = clf.predict(Subjects_Data_test)
         Predicted_Score[j] = Fold_J_Score[0]
+        Selected_Alpha[j] = Optimal_Alpha
+        if Checkpoint_Flag:
+            Checkpoint_Append(Checkpoint, j, {'Alpha': Optimal_Alpha, 'Predict_Score': Predicted_Score[j]})
 
     Corr = np.corrcoef(Predicted_Score, Subjects_Score)
     Corr = Corr[0,1]
     MAE = np.mean(np.abs(np.subtract(Predicted_Score, Subjects_Score)))
  
-    Res_NFold = {'Corr':Corr, 'MAE':MAE, 'Test_Score':Subjects_Score, 'Predicted_Score':Predicted_Score};
+    Res_NFold = {'Corr':Corr, 'MAE':MAE, 'Test_Score':Subjects_Score, 'Predicted_Score':Predicted_Score, 'Alpha':Selected_Alpha};
     ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
     sio.savemat(ResultantFile, Res_NFold)
+    if Checkpoint_Flag:
+        Checkpoint_Close(Checkpoint)
     return (Corr, MAE)
 
-def Lasso_OptimalAlpha_LOOCV(Training_Data, Training_Score, Alpha_Range, ResultantFolder, Parallel_Quantity):
+def Lasso_OptimalAlpha_LOOCV(Training_Data, Training_Score, Alpha_Range, ResultantFolder, Parallel_Quantity, Debug_Flag=0, Path_Flag=0, Saturation_Flag=0):
     #
     # Select optimal regularization parameter using nested LOOCV
     #
@@ -200,38 +299,46 @@ def Lasso_OptimalAlpha_LOOCV(Training_Data, Training_Score, Alpha_Range, Resulta
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Debug_Flag:
+    #     1: also write the result of each parameter into ResultantFolder as a .mat file, for debugging
+    #     0: keep the results of each parameter in memory only (default)
+    # Path_Flag:
+    #     1: fit all the alphas of a fold along one warm-started path (from the largest alpha), see 'Path_Predict' in Common_CZ_Path
+    #        the predictions agree with the separate fits up to the tolerance of coordinate descent
+    #     0: fit each alpha separately from zero coefficients (default)
+    # Saturation_Flag:
+    #     Only for Path_Flag = 1
+    #     1: stop the path when the active set saturates, the smaller alphas get the predictions of the last fitted alpha,
+    #        and so its inner evaluation, which can change the selected alpha
+    #     0: fit all the alphas (default)
     #
     
     Subjects_Quantity = len(Training_Score)
+    # The data of each inner fold are taken by index into one buffer, see 'Fold_Data' in Common_CZ_Fold
+    Fold_Data_Buffer = Fold_Buffer(Training_Data)
     
     Inner_Predicted_Score = np.zeros((Subjects_Quantity, len(Alpha_Range)))
     Alpha_Quantity = len(Alpha_Range)
     for k in np.arange(Subjects_Quantity):
         
-        Inner_Fold_K_Data_test = Training_Data[k, :]
-        Inner_Fold_K_Data_test = Inner_Fold_K_Data_test.reshape(1,-1)
         Inner_Fold_K_Score_test = Training_Score[k]
-        Inner_Fold_K_Data_train = np.delete(Training_Data, k, axis=0)
         Inner_Fold_K_Score_train = np.delete(Training_Score, k)
         
-        Scale = preprocessing.MinMaxScaler()
-        Inner_Fold_K_Data_train = Scale.fit_transform(Inner_Fold_K_Data_train)
-        Inner_Fold_K_Data_test = Scale.transform(Inner_Fold_K_Data_test)    
-        
-        Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Lasso_SubAlpha_LOOCV)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder) for l in np.arange(len(Alpha_Range)))        
+        Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Training_Data, k, Fold_Data_Buffer)
         
-        for l in np.arange(Alpha_Quantity):
-            print(l)
-            Fold_l_Mat_Path = ResultantFolder + '/Alpha_' + str(l) + '.mat';
-            Fold_l_Mat = sio.loadmat(Fold_l_Mat_Path)
-            Inner_Predicted_Score[k, l] = Fold_l_Mat['Predicted_Score']
-            os.remove(Fold_l_Mat_Path)
+        if Path_Flag:
+            Inner_Predicted_Score[k, :] = Path_Predict(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range, 1, Saturation_Flag)[0]
+            if Debug_Flag:
+                for l in np.arange(Alpha_Quantity):
+                    Fold_result = {'Predicted_Score': Inner_Predicted_Score[k, [l]]}
+                    sio.savemat(ResultantFolder + '/Alpha_' + str(l) + '.mat', Fold_result)
+        else:
+            Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Lasso_SubAlpha_LOOCV)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder, Debug_Flag) for l in np.arange(len(Alpha_Range)))
+            for l in np.arange(Alpha_Quantity):
+                Inner_Predicted_Score[k, l] = Alpha_Results[l]
       
-    Inner_Evaluation = np.zeros((1, len(Alpha_Range)))
-    Inner_Evaluation = Inner_Evaluation[0]
-    for l in np.arange(len(Alpha_Range)):
-        Corr_tmp = np.corrcoef(Inner_Predicted_Score[:,l], Training_Score)
-        Inner_Evaluation[l] = Corr_tmp[0,1]
+    # Correlation of the LOO predictions of each parameter, see 'Score_Evaluate' in Common_CZ_Score
+    Inner_Evaluation = Score_Evaluate(Inner_Predicted_Score, Training_Score)[0]
     
     Inner_Evaluation_Mat = {'Inner_Evaluation':Inner_Evaluation}
     sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
@@ -240,7 +347,7 @@ def Lasso_OptimalAlpha_LOOCV(Training_Data, Training_Score, Alpha_Range, Resulta
     Optimal_Alpha = Alpha_Range[Optimal_Alpha_Index]
     return (Optimal_Alpha, Inner_Evaluation)
 
-def Lasso_SubAlpha_LOOCV(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder):
+def Lasso_SubAlpha_LOOCV(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder, Debug_Flag=0):
     #
     # Sub-function for optimal regularization parameter selection
     #
@@ -258,14 +365,19 @@ def Lasso_SubAlpha_LOOCV(Training_Data, Training_Score, Testing_Data, Testing_Sc
     #     The indice of the alpha we tested in the alpha range
     # ResultantFolder:
     #     Folder to storing the results
+    # Debug_Flag:
+    #     1: also write the result of this parameter into ResultantFolder as a .mat file, for debugging
+    #     0: only return the result, nothing is written (default)
     #
 
     clf = linear_model.Lasso(alpha=Alpha)
     clf.fit(Training_Data, Training_Score)
     Predicted_Score = clf.predict(Testing_Data)
-    Fold_result = {'Predicted_Score': Predicted_Score}
-    ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
-    sio.savemat(ResultantFile, Fold_result)
+    if Debug_Flag:
+        Fold_result = {'Predicted_Score': Predicted_Score}
+        ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
+        sio.savemat(ResultantFile, Fold_result)
+    return Predicted_Score[0]
     
 def Lasso_Weight(Subjects_Data, Subjects_Score, Alpha_Range, ResultantFolder, Parallel_Quantity):
     #
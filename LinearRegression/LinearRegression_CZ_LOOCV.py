@@ -11,19 +11,28 @@
 #
 
 import os
+import sys
+import functools
 import scipy.io as sio
 import numpy as np
 import time
 from sklearn import linear_model
 from sklearn import preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Split import Split_Generator, Split_Shuffle
+from Common_CZ_Permutation import Permutation_Run
+from Common_CZ_Scale import Scale_Order, Scale_Exclude_Change, Scale_Gram, Scale_Handle_Zeros
+from Common_CZ_Kernel import Kernel_Cache
+from Common_CZ_Data import Data_Open
   
-def LinearRegression_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, ResultantFolder, Max_Queued, QueueOptions):
+def LinearRegression_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, ResultantFolder, Max_Queued, QueueOptions, Seed=None, Store_Flag=0):
     
     #
     # Linear regression with leave-one-out cross-validation (LOOCV)
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Times_IDRange:
@@ -31,94 +40,44 @@ def LinearRegression_LOOCV_Permutation(Subjects_Data, Subjects_Score, Times_IDRa
     # ResultantFolder:
     #     Path of the folder storing the results
     # Max_Queued:
-    #     The maximum jobs to be submitted to SGE cluster at the same time 
+    #     The maximum permutations running at the same time on this computer, see 'Permutation_Run'
     # QueueOptions:
-    #     Generally is '-q all.q' for SGE cluster 
+    #     Not used, kept for compatibility (permutations were submitted as jobs of SGE cluster)
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Store_Flag:
+    #     1: the results of all the permutations are kept in ResultantFolder/Res_Store.ckpt instead of a folder for each,
+    #        see Common_CZ_Store; 'Store_Null' gives the null distribution, and 'Store_Export_Mat' the .mat files
+    #     0: the results of the i-th permutation are in ResultantFolder/Time_i (default)
     #
 
-    if not os.path.exists(ResultantFolder):
-        os.mkdir(ResultantFolder)
-    Subjects_Data_Mat = {'Subjects_Data': Subjects_Data}
-    Subjects_Data_Mat_Path = ResultantFolder + '/Subjects_Data.mat'
-    sio.savemat(Subjects_Data_Mat_Path, Subjects_Data_Mat)
-    Finish_File = []
-    Times_IDRange_Todo = np.int64(np.array([]))
-    for i in np.arange(len(Times_IDRange)):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
-        if not os.path.exists(ResultantFolder_I):
-            os.mkdir(ResultantFolder_I)
-        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
-            Times_IDRange_Todo = np.insert(Times_IDRange_Todo, len(Times_IDRange_Todo), Times_IDRange[i])
-            Configuration_Mat = {'Subjects_Data_Mat_Path': Subjects_Data_Mat_Path, 'Subjects_Score': Subjects_Score, 'ResultantFolder_I': ResultantFolder_I};
-            sio.savemat(ResultantFolder_I + '/Configuration.mat', Configuration_Mat)
-            system_cmd = 'python3 -c ' + '\'import sys;\
-                sys.path.append("' + os.getcwd() + '");\
-                from LinearRegression_CZ_Sort import LinearRegression_KFold_Sort_Permutation_Sub;\
-                import os;\
-                import scipy.io as sio;\
-                configuration = sio.loadmat("' + ResultantFolder_I + '/Configuration.mat");\
-                Subjects_Data_Mat_Path = configuration["Subjects_Data_Mat_Path"];\
-                Subjects_Score = configuration["Subjects_Score"];\
-                ResultantFolder_I = configuration["ResultantFolder_I"];\
-                LinearRegression_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path[0], Subjects_Score[0], ResultantFolder_I[0])\' ';
-            system_cmd = system_cmd + ' > "' + ResultantFolder_I + '/LinearRegression.log" 2>&1\n'
-            Finish_File.append(ResultantFolder_I + '/Res_NFold.mat')
-            script = open(ResultantFolder_I + '/script.sh', 'w') 
-            script.write(system_cmd)
-            script.close()
-
-    Jobs_Quantity = len(Finish_File)
-    if len(Times_IDRange_Todo) > Max_Queued:
-        Submit_Quantity = Max_Queued
-    else:
-        Submit_Quantity = len(Times_IDRange_Todo)
-    for i in np.arange(Submit_Quantity):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[i])
-        #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.e"';
-        #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[i]) + Option;
-        #print(cmd);
-        #os.system(cmd)
-        os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-    Finished_Quantity = 0;
-    while 1:        
-        for i in np.arange(len(Finish_File)):
-             if os.path.exists(Finish_File[i]):
-                 Finished_Quantity = Finished_Quantity + 1
-                 print(Finish_File[i])
-                 del(Finish_File[i])
-                 print(time.strftime('%Y-%m-%d-%H-%M-%S',time.localtime(time.time())))
-                 print('Finish quantity = ' + str(Finished_Quantity))
-                 if Submit_Quantity < len(Times_IDRange_Todo):
-                     ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[Submit_Quantity]);
-                     #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.e"';     
-                     #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + Option
-                     #print(cmd);
-                     #os.system(cmd);
-                     os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-                     Submit_Quantity = Submit_Quantity + 1
-                 break;
-        if Finished_Quantity >= Jobs_Quantity:
-            break;    
-
-def LinearRegression_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, ResultantFolder, Parallel_Quantity):
+    Subjects_Data = Data_Open(Subjects_Data)
+    Permutation_Function = functools.partial(LinearRegression_LOOCV, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, Permutation_Flag=1)
+    Permutation_Run(Permutation_Function, Times_IDRange, ResultantFolder, Max_Queued, Log_Name='LinearRegression.log', Seed=Seed, Store_Flag=Store_Flag)
+
+def LinearRegression_LOOCV_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, ResultantFolder, Parallel_Quantity, Seed=None):
     #
     # For permutation test, This function will call 'LinearRegression_LOOCV' function
     #
     # Subjects_Data_Mat_Path:
     #     The path of .mat file that contain a variable named 'Subjects_Data'
     #     Variable 'Subjects_Data' is a n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Other variables are the same with function 'LinearRegression_KFold_Sort'
+    # Seed: see 'LinearRegression_LOOCV'
     #
 
-    data = sio.loadmat(Subjects_Data_Mat_Path)
-    Subjects_Data = data['Subjects_Data']
-    LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, 1);
+    Subjects_Data = Data_Open(Subjects_Data_Mat_Path)
+    LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, 1, Seed=Seed);
 
-def LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, Permutation_Flag):
+def LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, Permutation_Flag, Analytic_Flag=0, Seed=None):
     #
     # LinearRegression regression with leave-one-out cross-validation (LOOCV)   
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # ResultantFolder:
@@ -126,32 +85,71 @@ def LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, Permu
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Analytic_Flag:
+    #     1: closed-form LOOCV, the same predictions with refitting the scaling and the model in each loop (up to rounding errors)
+    #        If the training data have full column rank (generally more subjects than features), the predictions of linear regression
+    #        with intercept do not change with the MinMax scaling of each loop, and all the LOO predictions come from one SVD
+    #        of the data with the PRESS identity, see 'LinearRegression_PRESS_Weight'
+    #        Otherwise (e.g., fewer subjects than features), the minimum-norm solution depends on the scaling, and each loop is solved
+    #        from the Gram matrix of all the subjects corrected for the MinMax range of its training subjects, see 'LinearRegression_Kernel_Predict'
+    #        'LinearRegression_LOOCV_Validate' in LinearRegression_CZ_LOOCV_Validate compares the predictions with Analytic_Flag = 0
+    #     0: refit the scaling and the model in each loop (default)
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'LinearRegression_LOOCV_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
     Subjects_Quantity = len(Subjects_Score)
+
+    if Analytic_Flag:
+        LOO_Weight = LinearRegression_PRESS_Weight(Subjects_Data)
+        if LOO_Weight is None:
+            # The Gram matrix of the MinMax scaled data, and the min and max of each feature after excluding any subject
+            Order = Scale_Order(Subjects_Data, 2)
+            Kernel = Kernel_Cache(Subjects_Data, [])
     
+    Random_Generator = Split_Generator(Seed)
     Predicted_Score = np.zeros((1, Subjects_Quantity))
     Predicted_Score = Predicted_Score[0]
     for j in np.arange(Subjects_Quantity):
 
-        Subjects_Data_test = Subjects_Data[j, :]
-        Subjects_Data_test = Subjects_Data_test.reshape(1,-1)
         Subjects_Score_test = Subjects_Score[j]
-        Subjects_Data_train = np.delete(Subjects_Data, j, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, j) 
 
         if Permutation_Flag:
             # If doing permutation, the training scores should be permuted, while the testing scores remain
             Subjects_Index_Random = np.arange(len(Subjects_Score_train));
-            np.random.shuffle(Subjects_Index_Random);
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
             Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
             if j == 0:
                 RandIndex = {'Fold_0': Subjects_Index_Random}
             else:
                 RandIndex['Fold_' + str(j)] = Subjects_Index_Random
 
+        if Analytic_Flag:
+            Training_Index = np.delete(np.arange(Subjects_Quantity), j)
+            if LOO_Weight is not None:
+                # The prediction is linear in the training scores
+                Predicted_Score[j] = np.dot(LOO_Weight[j, Training_Index], Subjects_Score_train)
+            else:
+                # Gram matrix with the range of the training subjects of this loop
+                Changed_Index, Base_Range, Fold_Range = Scale_Exclude_Change(Order, [], [j])
+                Gram = Kernel['Kernel'] + Scale_Gram(Subjects_Data[:, Changed_Index], Kernel['Shift'][Changed_Index], \
+                    1 / Fold_Range ** 2 - 1 / Base_Range ** 2)
+                Predicted_Score[j] = LinearRegression_Kernel_Predict(Gram[np.ix_(Training_Index, Training_Index)], Gram[np.ix_([j], Training_Index)], \
+                    Subjects_Score_train, max(np.shape(Subjects_Data)))[0]
+            continue
+
+        # The data are copied only without the closed form
+        Subjects_Data_test = Subjects_Data[j, :]
+        Subjects_Data_test = Subjects_Data_test.reshape(1,-1)
+        Subjects_Data_train = np.delete(Subjects_Data, j, axis=0)
+
         normalize = preprocessing.MinMaxScaler()
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
         Subjects_Data_test = normalize.transform(Subjects_Data_test)
@@ -169,6 +167,71 @@ def LinearRegression_LOOCV(Subjects_Data, Subjects_Score, ResultantFolder, Permu
     ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
     sio.savemat(ResultantFile, Res_NFold)
     return (Corr, MAE)
+
+def LinearRegression_PRESS_Weight(Subjects_Data):
+    #
+    # Leave-one-out predictions of linear regression with intercept as weights of the training scores, from one SVD of the data
+    # With the hat matrix H = 1 * 1' / n + U * U' (U: left singular vectors of the centered data), the PRESS identity gives
+    #     prediction_j = (sum_i H_ji * y_i - H_jj * y_j) / (1 - H_jj) = sum_(i != j) H_ji * y_i / (1 - H_jj)
+    # The predictions do not change with any scaling of each feature (e.g., the MinMax scaling of each loop),
+    # as long as the training data of each loop have full column rank
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    #
+    # Return:
+    #     LOO_Weight, n*n matrix, the prediction of subject j is LOO_Weight[j, i] * y_i summed over the other subjects,
+    #     so the training scores can be permuted; None if the training data of a loop do not have full column rank
+    #     (generally fewer subjects than features), then the minimum-norm solution depends on the scaling
+    #
+
+    Subjects_Quantity, Features_Quantity = np.shape(Subjects_Data)
+    if Subjects_Quantity - 1 <= Features_Quantity:
+        return None
+    # Scaled by the range of all the subjects for numerical accuracy, which does not change the predictions
+    Data_Range = Scale_Handle_Zeros(np.max(Subjects_Data, axis=0) - np.min(Subjects_Data, axis=0))
+    Subjects_Data = Subjects_Data / Data_Range
+    U, s, Vt = np.linalg.svd(Subjects_Data - np.mean(Subjects_Data, axis=0), full_matrices=False)
+    if s[-1] <= s[0] * Subjects_Quantity * np.finfo(np.float64).eps:
+        return None
+    Hat = np.dot(U, U.T) + 1 / Subjects_Quantity
+    Leverage = np.diag(Hat).copy()
+    if np.min(1 - Leverage) <= Subjects_Quantity * np.finfo(np.float64).eps:
+        return None
+    LOO_Weight = Hat / (1 - Leverage)[:, np.newaxis]
+    np.fill_diagonal(LOO_Weight, 0)
+    return LOO_Weight
+
+def LinearRegression_Kernel_Predict(Training_Gram, Testing_Gram, Training_Score, Rank_Scale):
+    #
+    # Predictions of linear regression with intercept from the Gram matrices, the same with linear_model.LinearRegression,
+    # i.e., the minimum-norm least squares solution when the training data do not have full column rank
+    # The prediction is k' * pinv(K) * y after centering the subjects, K is the Gram matrix of the training subjects
+    #
+    # Training_Gram:
+    #     n*n matrix, n is training subjects quantity, e.g., the Gram matrix of the MinMax scaled data from 'Scale_Gram'
+    # Testing_Gram:
+    #     t*n matrix, inner products between the testing and training subjects, t is testing subjects quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    # Rank_Scale:
+    #     The eigenvalues smaller than Rank_Scale * eps * the largest eigenvalue are taken as zero, generally max(n, m)
+    #
+    # Return:
+    #     Predict_Score, t*1 vector
+    #
+
+    Score_Mean = np.mean(Training_Score)
+    Training_Gram_Mean = np.mean(Training_Gram, axis=1)
+    Testing_Gram = Testing_Gram - np.mean(Testing_Gram, axis=1)[:, np.newaxis] - Training_Gram_Mean[np.newaxis, :] + np.mean(Training_Gram_Mean)
+    Training_Gram = Training_Gram - Training_Gram_Mean[:, np.newaxis] - Training_Gram_Mean[np.newaxis, :] + np.mean(Training_Gram_Mean)
+    Eigen_Value, Eigen_Vector = np.linalg.eigh(Training_Gram)
+    Rank_Index = Eigen_Value > Eigen_Value[-1] * Rank_Scale * np.finfo(np.float64).eps
+    Eigen_Value = Eigen_Value[Rank_Index]
+    Eigen_Vector = Eigen_Vector[:, Rank_Index]
+    Score_Projection = np.dot(Eigen_Vector.T, Training_Score - Score_Mean)
+    Predict_Score = np.dot(np.dot(Testing_Gram, Eigen_Vector), Score_Projection / Eigen_Value) + Score_Mean
+    return Predict_Score
     
 def LinearRegression_Weight(Subjects_Data, Subjects_Score, ResultantFolder):
     #
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+# Parity of the closed-form LOOCV of linear regression (Analytic_Flag = 1 of 'LinearRegression_LOOCV') with refitting
+# the scaling and the model in each loop (Analytic_Flag = 0)
+# 'LinearRegression_LOOCV_Validate' runs both on reference datasets of the three regimes of the closed form, with and without
+# permutation, and checks the predictions are the same up to rounding errors
+# It can also be run as a script: python LinearRegression_CZ_LOOCV_Validate.py [ResultantFolder]
+#
+
+import os
+import sys
+import numpy as np
+import scipy.io as sio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from LinearRegression_CZ_LOOCV import LinearRegression_LOOCV
+
+def LinearRegression_LOOCV_Reference(Subjects_Quantity=30, Seed=0):
+    #
+    # Reference datasets for 'LinearRegression_LOOCV_Validate', simulated with a fixed seed
+    #     'More_Subjects': more subjects than features, the training data of each loop have full column rank,
+    #                      and the closed form is the PRESS identity, see 'LinearRegression_PRESS_Weight'
+    #     'Fewer_Subjects': fewer subjects than features, the minimum-norm solution from the Gram matrix of each loop,
+    #                       see 'LinearRegression_Kernel_Predict'
+    #     'Subjects_Minus_One': as many features as the training subjects of each loop, the boundary of the two above,
+    #                           where the centered training data are rank deficient
+    #
+    # Subjects_Quantity:
+    #     Quantity of subjects of each dataset
+    # Seed:
+    #     Seed of np.random.RandomState
+    #
+    # Return:
+    #     Datasets, dict of the datasets keyed by name, each a dict with 'Subjects_Data' and 'Subjects_Score'
+    #
+
+    Random_State = np.random.RandomState(Seed)
+    Datasets = {}
+    for Name, Features_Quantity in (('More_Subjects', Subjects_Quantity // 3), ('Fewer_Subjects', Subjects_Quantity * 3), \
+            ('Subjects_Minus_One', Subjects_Quantity - 1)):
+        # Features of different offsets and ranges, so the MinMax scaling of each loop is not trivial
+        Subjects_Data = Random_State.randn(Subjects_Quantity, Features_Quantity) * Random_State.uniform(0.5, 5, Features_Quantity) \
+            + Random_State.uniform(-10, 10, Features_Quantity)
+        Subjects_Score = np.dot(Subjects_Data[:, :3], [1, -0.5, 0.25]) + Random_State.randn(Subjects_Quantity)
+        Datasets[Name] = {'Subjects_Data': Subjects_Data, 'Subjects_Score': Subjects_Score}
+    return Datasets
+
+def LinearRegression_LOOCV_Validate(ResultantFolder, Datasets=None, Seed=0, Tolerance=1e-8):
+    #
+    # Run 'LinearRegression_LOOCV' with Analytic_Flag = 0 and 1 on each dataset, without and with permutation, and compare the predictions
+    #
+    # ResultantFolder:
+    #     Path of the folder storing the results, the results of each dataset are in ResultantFolder/<Name>/<Permutation>_Refit and
+    #     ResultantFolder/<Name>/<Permutation>_Analytic, <Permutation> is 'Actual' or 'Permutation', and the comparison of all the datasets
+    #     is in ResultantFolder/Res_LOOCV_Validate.mat
+    # Datasets:
+    #     dict of the datasets keyed by name, each a dict with 'Subjects_Data' and 'Subjects_Score'
+    #     None: the output of 'LinearRegression_LOOCV_Reference' (default)
+    # Seed:
+    #     Seed of the permutation, the same for Analytic_Flag = 0 and 1, so the permuted scores are the same
+    # Tolerance:
+    #     The largest absolute difference of the predictions, relative to the standard deviation of the scores
+    #
+    # Return:
+    #     Res_Validate, dict with
+    #         'Name': the names of the datasets
+    #         'Difference_Actual', 'Difference_Permutation': the largest relative difference of the predictions of each dataset
+    #         'Corr_Refit', 'Corr_Analytic': Corr of each dataset without permutation
+    #         'Pass': 1 if the differences of each dataset are within tolerance
+    #
+
+    if Datasets is None:
+        Datasets = LinearRegression_LOOCV_Reference()
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    Name_List = sorted(Datasets)
+    Dataset_Quantity = len(Name_List)
+    Res_Validate = {'Name': np.array(Name_List, dtype=object), 'Difference_Actual': np.zeros(Dataset_Quantity), \
+        'Difference_Permutation': np.zeros(Dataset_Quantity), 'Corr_Refit': np.zeros(Dataset_Quantity), \
+        'Corr_Analytic': np.zeros(Dataset_Quantity), 'Pass': np.zeros(Dataset_Quantity, dtype=int)}
+    for i in np.arange(Dataset_Quantity):
+        ResultantFolder_I = os.path.join(ResultantFolder, Name_List[i])
+        if not os.path.exists(ResultantFolder_I):
+            os.mkdir(ResultantFolder_I)
+        Score_Std = np.std(Datasets[Name_List[i]]['Subjects_Score'])
+        for Permutation_Flag, Permutation_Name in ((0, 'Actual'), (1, 'Permutation')):
+            Predicted_Score = []
+            for Analytic_Flag, Analytic_Name in ((0, 'Refit'), (1, 'Analytic')):
+                Analytic_Folder = os.path.join(ResultantFolder_I, Permutation_Name + '_' + Analytic_Name)
+                Corr, MAE = LinearRegression_LOOCV(Datasets[Name_List[i]]['Subjects_Data'], Datasets[Name_List[i]]['Subjects_Score'], \
+                    Analytic_Folder, Permutation_Flag, Analytic_Flag, Seed)
+                if not Permutation_Flag:
+                    Res_Validate['Corr_' + Analytic_Name][i] = Corr
+                Predicted_Score.append(np.ravel(sio.loadmat(os.path.join(Analytic_Folder, 'Res_NFold.mat'))['Predicted_Score']))
+            Res_Validate['Difference_' + Permutation_Name][i] = np.max(np.abs(Predicted_Score[1] - Predicted_Score[0])) / Score_Std
+        Res_Validate['Pass'][i] = int(Res_Validate['Difference_Actual'][i] <= Tolerance and \
+            Res_Validate['Difference_Permutation'][i] <= Tolerance)
+    sio.savemat(os.path.join(ResultantFolder, 'Res_LOOCV_Validate.mat'), Res_Validate)
+    return Res_Validate
+
+if __name__ == '__main__':
+    ResultantFolder = sys.argv[1] if len(sys.argv) > 1 else 'LinearRegression_LOOCV_Validate'
+    Res_Validate = LinearRegression_LOOCV_Validate(ResultantFolder)
+    for i in np.arange(len(Res_Validate['Name'])):
+        print(Res_Validate['Name'][i] + ': difference ' + str(Res_Validate['Difference_Actual'][i]) + ', with permutation ' + \
+            str(Res_Validate['Difference_Permutation'][i]) + ', Pass ' + str(Res_Validate['Pass'][i]))
+    sys.exit(0 if np.all(Res_Validate['Pass']) else 1)
@@ -10,12 +10,16 @@
 # (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
 #
 import os
+import sys
 import scipy.io as sio
 import numpy as np
 from sklearn import linear_model
 from sklearn import preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Split import Split_Fold
+from Common_CZ_Data import Data_Open
   
-def LinearRegression_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder):
+def LinearRegression_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, Seed=None):
     #
     # linear regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
@@ -23,6 +27,7 @@ def LinearRegression_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -30,25 +35,25 @@ def LinearRegression_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity
     #     5 or 10 is recommended generally, the small the better accepted by community, but the results may be worse as traning samples are fewer
     # ResultantFolder:
     #     Path of the folder storing the results
+    # Seed:
+    #     None: the split is drawn from the random state of numpy (default)
+    #     An integer: the split is drawn from this seed (see 'Split_Fold' in Common_CZ_Split), and the same Seed gives the same
+    #     split for all the models
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     
     Subjects_Quantity = len(Subjects_Score)
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    RandIndex = np.arange(Subjects_Quantity)
-    np.random.shuffle(RandIndex)
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Seed)['Test_Index']
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = RandIndex[EachFold_Size * j + np.arange(EachFold_Size)]
-        if Remain > j:
-            Fold_J_Index = np.insert(Fold_J_Index, len(Fold_J_Index), RandIndex[EachFold_Size * Fold_Quantity + j])
+        Fold_J_Index = Fold_Index[j]
 
         Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
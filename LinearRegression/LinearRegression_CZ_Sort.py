@@ -10,18 +10,26 @@
 # (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
 #
 import os
+import sys
+import functools
 import scipy.io as sio
 import numpy as np
 import time
 from sklearn import linear_model
 from sklearn import preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Permutation import Permutation_Run, Permutation_Pool, Permutation_Adaptive
+from Common_CZ_Split import Split_Fold, Split_Seed, Split_Generator, Split_Shuffle
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Data import Data_Open
   
-def LinearRegression_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, ResultantFolder, Max_Queued, QueueOptions):
+def LinearRegression_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, ResultantFolder, Max_Queued, QueueOptions, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None, Store_Flag=0):
     #
     # Linear regression with K-fold cross-validation
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Times_IDRange:
@@ -32,90 +40,51 @@ def LinearRegression_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times
     # ResultantFolder:
     #     Path of the folder storing the results
     # Max_Queued:
-    #     The maximum jobs to be submitted to SGE cluster at the same time 
+    #     The maximum permutations running at the same time on this computer, see 'Permutation_Run'
     # QueueOptions:
-    #     Generally is '-q all.q' for SGE cluster 
+    #     Not used, kept for compatibility (permutations were submitted as jobs of SGE cluster)
+    # Observed_Corr:
+    #     Optional, Mean_Corr of 'LinearRegression_KFold_Sort' without permutation
+    #     If given, the permutations of Times_IDRange are run in waves until p < P_Threshold or p > P_Threshold is decided,
+    #     with the probability of a wrong decision at most Error_Rate, see 'Permutation_Adaptive' in Common_CZ_Permutation;
+    #     the quantity of permutations run, the partial null distribution, the p-value and the decision are in ResultantFolder/Res_Adaptive.mat
+    # P_Threshold, Error_Rate:
+    #     Only for Observed_Corr, see 'Permutation_Adaptive'
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Store_Flag:
+    #     1: the results of all the permutations are kept in ResultantFolder/Res_Store.ckpt instead of a folder for each,
+    #        see Common_CZ_Store; 'Store_Null' gives the null distribution, and 'Store_Export_Mat' the .mat files
+    #     0: the results of the i-th permutation are in ResultantFolder/Time_i (default)
     #    
-    if not os.path.exists(ResultantFolder):
-        os.mkdir(ResultantFolder)
-    Subjects_Data_Mat = {'Subjects_Data': Subjects_Data}
-    Subjects_Data_Mat_Path = ResultantFolder + '/Subjects_Data.mat'
-    sio.savemat(Subjects_Data_Mat_Path, Subjects_Data_Mat)
-    Finish_File = []
-    Times_IDRange_Todo = np.int64(np.array([]))
-    for i in np.arange(len(Times_IDRange)):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
-        if not os.path.exists(ResultantFolder_I):
-            os.mkdir(ResultantFolder_I)
-        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
-            Times_IDRange_Todo = np.insert(Times_IDRange_Todo, len(Times_IDRange_Todo), Times_IDRange[i])
-            Configuration_Mat = {'Subjects_Data_Mat_Path': Subjects_Data_Mat_Path, 'Subjects_Score': Subjects_Score, 'Fold_Quantity': Fold_Quantity, \
-                'ResultantFolder_I': ResultantFolder_I};
-            sio.savemat(ResultantFolder_I + '/Configuration.mat', Configuration_Mat)
-            system_cmd = 'python3 -c ' + '\'import sys;\
-                sys.path.append("' + os.getcwd() + '");\
-                from LeastSquares_CZ_Sort import LinearRegression_KFold_Sort_Permutation_Sub;\
-                import os;\
-                import scipy.io as sio;\
-                configuration = sio.loadmat("' + ResultantFolder_I + '/Configuration.mat");\
-                Subjects_Data_Mat_Path = configuration["Subjects_Data_Mat_Path"];\
-                Subjects_Score = configuration["Subjects_Score"];\
-                Fold_Quantity = configuration["Fold_Quantity"];\
-                ResultantFolder_I = configuration["ResultantFolder_I"];\
-                LinearRegression_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path[0], Subjects_Score[0], Fold_Quantity[0][0], ResultantFolder_I[0])\' ';
-            system_cmd = system_cmd + ' > "' + ResultantFolder_I + '/LeastSquares.log" 2>&1\n'
-            Finish_File.append(ResultantFolder_I + '/Res_NFold.mat')
-            script = open(ResultantFolder_I + '/script.sh', 'w') 
-            script.write(system_cmd)
-            script.close()
+    Subjects_Data = Data_Open(Subjects_Data)
+    Permutation_Function = functools.partial(LinearRegression_KFold_Sort, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, \
+        Fold_Quantity=Fold_Quantity, Permutation_Flag=1)
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided, by one pool of processes for all the waves
+        Pool = Permutation_Pool(Permutation_Function, Max_Queued, 'LeastSquares.log')
+        Run_Function = functools.partial(Permutation_Run, Permutation_Function, ResultantFolder=ResultantFolder, Max_Queued=Max_Queued, \
+            Log_Name='LeastSquares.log', Seed=Seed, Store_Flag=Store_Flag, Pool=Pool)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'Res_NFold.mat', 'Mean_Corr', P_Threshold, Error_Rate, max(Max_Queued, 10), Store_Flag, Pool)
+    Permutation_Run(Permutation_Function, Times_IDRange, ResultantFolder, Max_Queued, Log_Name='LeastSquares.log', Seed=Seed, Store_Flag=Store_Flag)
 
-    Jobs_Quantity = len(Finish_File)
-    if len(Times_IDRange_Todo) > Max_Queued:
-        Submit_Quantity = Max_Queued
-    else:
-        Submit_Quantity = len(Times_IDRange_Todo)
-    for i in np.arange(Submit_Quantity):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[i])
-        #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.e"';
-        #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[i]) + Option;
-        #print(cmd);
-        #os.system(cmd)
-        os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-    Finished_Quantity = 0;
-    while 1:        
-        for i in np.arange(len(Finish_File)):
-             if os.path.exists(Finish_File[i]):
-                 Finished_Quantity = Finished_Quantity + 1
-                 print(Finish_File[i])
-                 del(Finish_File[i])
-                 print(time.strftime('%Y-%m-%d-%H-%M-%S',time.localtime(time.time())))
-                 print('Finish quantity = ' + str(Finished_Quantity))
-                 if Submit_Quantity < len(Times_IDRange_Todo):
-                     ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[Submit_Quantity]);
-                     #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.e"';     
-                     #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + Option
-                     #print(cmd);
-                     #os.system(cmd);
-                     os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-                     Submit_Quantity = Submit_Quantity + 1
-                 break;
-        if Finished_Quantity >= Jobs_Quantity:
-            break;
-
-def LinearRegression_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, ResultantFolder):
+def LinearRegression_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, ResultantFolder, Seed=None):
     #
     # For permutation test, This function will call 'LinearRegression_KFold_Sort' function
     #
     # Subjects_Data_Mat_Path:
     #     The path of .mat file that contain a variable named 'Subjects_Data'
     #     Variable 'Subjects_Data' is a n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Other variables are the same with function 'LinearRegression_KFold_Sort'
+    # Seed: see 'LinearRegression_KFold_Sort'
     #
-    data = sio.loadmat(Subjects_Data_Mat_Path)
-    Subjects_Data = data['Subjects_Data']
-    LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, 1);
+    Subjects_Data = Data_Open(Subjects_Data_Mat_Path)
+    LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, 1, Seed=Seed);
 
-def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, Permutation_Flag):
+def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, Permutation_Flag, Seed=None):
     #
     # Linear regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
@@ -127,6 +96,7 @@ def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Re
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -137,8 +107,14 @@ def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Re
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'LinearRegression_KFold_Sort_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
     #
    
+    Subjects_Data = Data_Open(Subjects_Data)
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
     Subjects_Quantity = len(Subjects_Score)
@@ -147,21 +123,15 @@ def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Re
     Subjects_Data = Subjects_Data[Sorted_Index, :]
     Subjects_Score = Subjects_Score[Sorted_Index]
 
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    MaxSize = EachFold_Size * Fold_Quantity
-    EachFold_Max = np.ones(Fold_Quantity, np.int) * MaxSize
-    tmp = np.arange(Fold_Quantity - 1, -1, -1)
-    EachFold_Max = EachFold_Max - tmp;
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    for j in np.arange(Remain):
-        EachFold_Max[j] = EachFold_Max[j] + Fold_Quantity
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = np.arange(j, EachFold_Max[j], Fold_Quantity)
+        Fold_J_Index = Fold_Index[j]
         Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
         Subjects_Data_train = np.delete(Subjects_Data, Fold_J_Index, axis=0)
@@ -170,7 +140,7 @@ def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Re
         if Permutation_Flag:
             # If doing permutation, the training scores should be permuted, while the testing scores remain
             Subjects_Index_Random = np.arange(len(Subjects_Score_train));
-            np.random.shuffle(Subjects_Index_Random);
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
             Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
             if j == 0:
                 RandIndex = {'Fold_0': Subjects_Index_Random}
@@ -204,11 +174,126 @@ def LinearRegression_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Re
     sio.savemat(ResultantFile, Res_NFold)
     return (Mean_Corr, Mean_MAE)  
     
-def LinearRegression_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, ResultantFolder):
+def LinearRegression_KFold_Sort_MultiTarget(Subjects_Data, Subjects_Score, Fold_Quantity, ResultantFolder, Permutation_Flag, Layout_Score=None, Seed=None):
+    #
+    # Linear regression with sorted K-fold cross-validation for many scores (targets) of the same subjects in one run
+    # The results of the t-th target are in ResultantFolder/Target_t, the same files with 'LinearRegression_KFold_Sort';
+    # the mean correlation and MAE of all the targets are in ResultantFolder/Res_NFold_MultiTarget.mat
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*T matrix, T is targets quantity
+    # Layout_Score:
+    #     How the subjects are sorted into the folds, as the sorted folds depend on the scores
+    #     None: the folds of each target are from its own scores, the same with 'LinearRegression_KFold_Sort' for each target (default)
+    #     n*1 vector: the folds of all the targets are from the sorting of this vector, e.g., Subjects_Score[:, 0] or a composite score
+    #           The data of each fold are scaled once, and all the targets are fitted by one least squares with T right-hand sides;
+    #           for permutation, the subjects of the training scores are permuted together for all the targets
+    # Seed:
+    #     See 'LinearRegression_KFold_Sort'; with Layout_Score = None, the t-th target is permuted with Split_Seed(Seed, t)
+    # Other variables are the same with function 'LinearRegression_KFold_Sort'
+    #
+    # Return:
+    #     Mean_Corr, T*1 vector
+    #     Mean_MAE, T*1 vector
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+    Target_Quantity = np.shape(Subjects_Score)[1]
+    if Layout_Score is None:
+        Target_Results = [LinearRegression_KFold_Sort_Target(Subjects_Data, Subjects_Score[:, [t]], Subjects_Score[:, t], \
+            Fold_Quantity, ResultantFolder, Permutation_Flag, [t], Split_Seed(Seed, t)) \
+            for t in np.arange(Target_Quantity)]
+        Mean_Corr = np.concatenate([Target_Result[0] for Target_Result in Target_Results])
+        Mean_MAE = np.concatenate([Target_Result[1] for Target_Result in Target_Results])
+    else:
+        Mean_Corr, Mean_MAE = LinearRegression_KFold_Sort_Target(Subjects_Data, Subjects_Score, Layout_Score, Fold_Quantity, \
+            ResultantFolder, Permutation_Flag, np.arange(Target_Quantity), Seed)
+
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold_MultiTarget.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def LinearRegression_KFold_Sort_Target(Subjects_Data, Subjects_Score, Layout_Score, Fold_Quantity, ResultantFolder, Permutation_Flag, Target_ID, Seed=None):
+    #
+    # Sub-function of 'LinearRegression_KFold_Sort_MultiTarget', the targets of Subjects_Score share the folds from the sorting of Layout_Score
+    #
+    # Subjects_Score:
+    #     n*T matrix
+    # Target_ID:
+    #     T*1 vector, the results of the t-th column are in ResultantFolder/Target_<Target_ID[t]>
+    # Other variables are the same with function 'LinearRegression_KFold_Sort_MultiTarget'
+    #
+
+    Subjects_Quantity, Target_Quantity = np.shape(Subjects_Score)
+    ResultantFolder_Target = [os.path.join(ResultantFolder, 'Target_' + str(Target_ID[t])) for t in np.arange(Target_Quantity)]
+    for ResultantFolder_T in ResultantFolder_Target:
+        if not os.path.exists(ResultantFolder_T):
+            os.mkdir(ResultantFolder_T)
+    # Sort the subjects by Layout_Score, the data of each fold are taken in this order into one buffer, see 'Fold_Data' in Common_CZ_Fold
+    Sorted_Index = np.argsort(Layout_Score)
+    Subjects_Score = Subjects_Score[Sorted_Index]
+
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
+    Fold_Data_Buffer = Fold_Buffer(Subjects_Data)
+
+    Fold_Corr = np.zeros((Fold_Quantity, Target_Quantity))
+    Fold_MAE = np.zeros((Fold_Quantity, Target_Quantity))
+    for j in np.arange(Fold_Quantity):
+
+        Fold_J_Index = Fold_Index[j]
+        Subjects_Score_test = Subjects_Score[Fold_J_Index]
+        Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index, axis=0)
+
+        if Permutation_Flag:
+            # If doing permutation, the training scores should be permuted, while the testing scores remain
+            Subjects_Index_Random = np.arange(len(Subjects_Score_train));
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
+
+        Subjects_Data_train, Subjects_Data_test = Fold_Data(Subjects_Data, Sorted_Index[Fold_J_Index], Fold_Data_Buffer, \
+            np.delete(Sorted_Index, Fold_J_Index))
+
+        clf = linear_model.LinearRegression()
+        clf.fit(Subjects_Data_train, Subjects_Score_train)
+        Fold_J_Score = clf.predict(Subjects_Data_test)
+
+        for t in np.arange(Target_Quantity):
+            Fold_Corr[j, t] = np.corrcoef(Fold_J_Score[:, t], Subjects_Score_test[:, t])[0, 1]
+            Fold_MAE[j, t] = np.mean(np.abs(np.subtract(Fold_J_Score[:, t], Subjects_Score_test[:, t])))
+            Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test[:, t], 'Predict_Score':Fold_J_Score[:, t], \
+                'Corr':Fold_Corr[j, t], 'MAE':Fold_MAE[j, t]}
+            sio.savemat(os.path.join(ResultantFolder_Target[t], 'Fold_' + str(j) + '_Score.mat'), Fold_J_result)
+
+    Fold_Corr = np.nan_to_num(Fold_Corr)
+    Mean_Corr = np.mean(Fold_Corr, axis=0)
+    Mean_MAE = np.mean(Fold_MAE, axis=0)
+    for t in np.arange(Target_Quantity):
+        Res_NFold = {'Mean_Corr':Mean_Corr[t], 'Mean_MAE':Mean_MAE[t]};
+        sio.savemat(os.path.join(ResultantFolder_Target[t], 'Res_NFold.mat'), Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def LinearRegression_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, ResultantFolder, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None):
     #
     # Permutation test for 'LinearRegression_APredictB'
+    # Observed_Corr, P_Threshold, Error_Rate:
+    #     Optional, Predict_Corr of 'LinearRegression_APredictB' without permutation; if given, the permutations stop once p < P_Threshold or
+    #     p > P_Threshold is decided, see 'Permutation_Adaptive' in Common_CZ_Permutation, the summary is in ResultantFolder/Res_Adaptive.mat
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
     #
    
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided
+        Run_Function = functools.partial(LinearRegression_APredictB_Permutation, Training_Data=Training_Data, Training_Score=Training_Score, \
+            Testing_Data=Testing_Data, Testing_Score=Testing_Score, ResultantFolder=ResultantFolder, Seed=Seed)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'APredictB.mat', 'Predict_Corr', P_Threshold, Error_Rate)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     for i in np.arange(len(Times_IDRange)):
@@ -216,14 +301,15 @@ def LinearRegression_APredictB_Permutation(Training_Data, Training_Score, Testin
         if not os.path.exists(ResultantFolder_I):
             os.mkdir(ResultantFolder_I)
         if not os.path.exists(ResultantFolder_I + '/APredictB.mat'):
-            LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, ResultantFolder_I, 1)
+            LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, ResultantFolder_I, 1, Split_Seed(Seed, Times_IDRange[i]))
     
-def LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, ResultantFolder, Permutation_Flag):
+def LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, ResultantFolder, Permutation_Flag, Seed=None):
     #
     # Linear regression with training data to predict testing data
     #
     # Training_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     Training_Data and Testing_Data can also be the paths of .npy or HDF5 files, which are memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Training_Score:
     #     n*1 vector, n is subjects quantity
     # Testing_Data:
@@ -235,8 +321,15 @@ def LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Test
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'LinearRegression_APredictB_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
     #
     
+    Training_Data = Data_Open(Training_Data)
+    Testing_Data = Data_Open(Testing_Data)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     
@@ -244,7 +337,7 @@ def LinearRegression_APredictB(Training_Data, Training_Score, Testing_Data, Test
         # If do permutation, the training scores should be permuted, while the testing scores remain
         # Fold12
         Training_Index_Random = np.arange(len(Training_Score))
-        np.random.shuffle(Training_Index_Random)
+        Split_Shuffle(Training_Index_Random, Split_Generator(Seed))
         Training_Score = Training_Score[Training_Index_Random]
         Random_Index = {'Training_Index_Random': Training_Index_Random}
         sio.savemat(ResultantFolder + '/Random_Index.mat', Random_Index);
@@ -10,13 +10,24 @@
 # (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
 #
 import os
+import sys
 import scipy.io as sio
 import numpy as np
 from sklearn import linear_model
 from sklearn import preprocessing
 from joblib import Parallel, delayed
+from Ridge_CZ_Solver import Ridge_Path_Predict, Ridge_Kernel_Path_Predict
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Scale import Scale_Fold_Range, Scale_Gram, Scale_Handle_Zeros
+from Common_CZ_Path import Path_Evaluate
+from Common_CZ_Score import Score_Evaluate, Score_Select, Score_Standardize
+from Common_CZ_Schedule import Schedule_Run, Schedule_Fold
+from Common_CZ_Split import Split_Fold, Split_Seed
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Kernel import Kernel_Nested
+from Common_CZ_Data import Data_Open
 
-def Ridge_KFold_RandomCV_MultiTimes(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity):
+def Ridge_KFold_RandomCV_MultiTimes(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity, Schedule_Flag=0, BLAS_Threads=1, Seed=None, Kernel_Flag=0):
     #
     # Ridge regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
@@ -25,15 +36,28 @@ def Ridge_KFold_RandomCV_MultiTimes(Subjects_Data, Subjects_Score, Fold_Quantity
     #
     # CVRepeatTimes:
     #      Set times of the repeatition, i.e., 20
+    # Schedule_Flag:
+    #     1: schedule the fits of all the repeats and folds in Parallel_Quantity processes, see 'Ridge_KFold_RandomCV_MultiTimes_Schedule'
+    #     0: the repeats and folds one by one (default)
+    # BLAS_Threads:
+    #     Only for Schedule_Flag = 1, quantity of BLAS threads of each process
+    # Seed:
+    #     None: the splits are drawn from the random state of numpy (default)
+    #     Otherwise, the i-th repeat is 'Ridge_KFold_RandomCV' with Split_Seed(Seed, i), see 'Split_Fold' in Common_CZ_Split
+    # Kernel_Flag:
+    #     Only for Schedule_Flag = 0, see 'Ridge_KFold_RandomCV'
     # Other variables, see help of function Ridge_KFold_RandomCV
     #
+    if Schedule_Flag:
+        Ridge_KFold_RandomCV_MultiTimes_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity, BLAS_Threads, Seed)
+        return
     if not os.path.exists(ResultantFolder):
         os.makedirs(ResultantFolder);
     Corr_MTimes = np.zeros(CVRepeatTimes);
     MAE_MTimes = np.zeros(CVRepeatTimes);
     for i in np.arange(CVRepeatTimes):
         ResultantFolder_TimeI = ResultantFolder + '/Time_' + str(i)
-        Corr_I, MAE_I = Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder_TimeI, Parallel_Quantity);
+        Corr_I, MAE_I = Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder_TimeI, Parallel_Quantity, Seed=Split_Seed(Seed, i), Kernel_Flag=Kernel_Flag);
         Corr_MTimes[i] = Corr_I
         MAE_MTimes[i] = MAE_I
     Mean_Corr = np.mean(Corr_MTimes);
@@ -43,13 +67,126 @@ def Ridge_KFold_RandomCV_MultiTimes(Subjects_Data, Subjects_Score, Fold_Quantity
     ResultantFile = os.path.join(ResultantFolder, 'Prediction_MultiTimesMean.mat');
     sio.savemat(ResultantFile, Res);  
 
-def Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity):
+def Ridge_KFold_RandomCV_MultiTimes_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity, BLAS_Threads=1, Seed=None):
+    #
+    # The same with 'Ridge_KFold_RandomCV_MultiTimes', while the fits are scheduled in a pool of Parallel_Quantity processes, see 'Schedule_Run'
+    # The fits of all the (repeat, outer fold, inner repeat, inner fold) are one queue, all the alphas of an inner fold are evaluated
+    # from one decomposition (see 'Ridge_Path_Predict'), and then the fits of all the (repeat, outer fold) with their optimal alphas
+    # are another queue
+    # The random splits are drawn in the same order with 'Ridge_KFold_RandomCV_MultiTimes', so they are the same with the same Seed
+    # or the same random state of numpy
+    #
+    # BLAS_Threads:
+    #     Quantity of BLAS threads of each process, Parallel_Quantity * BLAS_Threads should not be larger than the quantity of cores
+    # Other variables are the same with function 'Ridge_KFold_RandomCV_MultiTimes'
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.makedirs(ResultantFolder);
+    Subjects_Quantity = len(Subjects_Score)
+    Alpha_Quantity = len(Alpha_Range)
+
+    # Splits of all the repeats and outer folds, and of all the inner repeats and inner folds of each outer fold
+    Fold_Index = []
+    Inner_Fold_Index = []
+    for i in np.arange(CVRepeatTimes):
+        Fold_Index.append(Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Split_Seed(Seed, i))['Test_Index'])
+        Inner_Fold_Index.append([])
+        for j in np.arange(Fold_Quantity):
+            Inner_Fold_Index[i].append([Split_Fold(Subjects_Quantity - len(Fold_Index[i][j]), Fold_Quantity, 'Random', Split_Seed(Seed, i, j, r))['Test_Index'] \
+                for r in np.arange(CVRepeatTimes)])
+
+    # Queue of the inner fits
+    Task_Args = []
+    for i in np.arange(CVRepeatTimes):
+        for j in np.arange(Fold_Quantity):
+            Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_Index[i][j])
+            Training_Score = Subjects_Score[Training_Index]
+            for r in np.arange(CVRepeatTimes):
+                for k in np.arange(Fold_Quantity):
+                    Inner_Fold_K_Index = Inner_Fold_Index[i][j][r][k]
+                    Inner_Fold_K_Train_Index = np.delete(np.arange(len(Training_Index)), Inner_Fold_K_Index)
+                    Task_Args.append((Training_Index[Inner_Fold_K_Train_Index], Training_Index[Inner_Fold_K_Index], \
+                        Training_Score[Inner_Fold_K_Train_Index], Ridge_Path_Predict, Alpha_Range))
+    Inner_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Optimal_Alpha = np.zeros((CVRepeatTimes, Fold_Quantity))
+    Task_ID = 0
+    for i in np.arange(CVRepeatTimes):
+        ResultantFolder_TimeI = ResultantFolder + '/Time_' + str(i)
+        if not os.path.exists(ResultantFolder_TimeI):
+            os.mkdir(ResultantFolder_TimeI)
+        for j in np.arange(Fold_Quantity):
+            Training_Score = np.delete(Subjects_Score, Fold_Index[i][j])
+            Inner_Corr_Mean = np.zeros((CVRepeatTimes, Alpha_Quantity))
+            Inner_MAE_inv_Mean = np.zeros((CVRepeatTimes, Alpha_Quantity))
+            for r in np.arange(CVRepeatTimes):
+                Inner_Corr = np.zeros((Fold_Quantity, Alpha_Quantity))
+                Inner_MAE_inv = np.zeros((Fold_Quantity, Alpha_Quantity))
+                for k in np.arange(Fold_Quantity):
+                    Inner_Corr[k, :], Inner_MAE_inv[k, :] = Path_Evaluate(Inner_Results[Task_ID], Training_Score[Inner_Fold_Index[i][j][r][k]])
+                    Task_ID = Task_ID + 1
+                Inner_Corr = np.nan_to_num(Inner_Corr)
+                Inner_Corr_Mean[r, :] = np.mean(Inner_Corr, axis=0)
+                Inner_MAE_inv_Mean[r, :] = np.mean(Inner_MAE_inv, axis=0)
+            Inner_Evaluation, Optimal_Alpha_Index = Score_Select(Inner_Corr_Mean, Inner_MAE_inv_Mean)
+            # The z-scored means of the repeats
+            Inner_Corr_CVMean = Score_Standardize(np.mean(Inner_Corr_Mean, axis=0))
+            Inner_MAE_inv_CVMean = Score_Standardize(np.mean(Inner_MAE_inv_Mean, axis=0))
+            Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Corr_CVMean':Inner_Corr_CVMean, 'Inner_MAE_inv_CVMean':Inner_MAE_inv_CVMean, 'Inner_Evaluation':Inner_Evaluation}
+            sio.savemat(ResultantFolder_TimeI + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
+            Optimal_Alpha[i, j] = Alpha_Range[Optimal_Alpha_Index]
+
+    # Queue of the outer fits
+    Task_Args = []
+    for i in np.arange(CVRepeatTimes):
+        for j in np.arange(Fold_Quantity):
+            Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_Index[i][j])
+            Task_Args.append((Training_Index, Fold_Index[i][j], Subjects_Score[Training_Index], Ridge_Path_Predict, [Optimal_Alpha[i, j]]))
+    Outer_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Corr_MTimes = np.zeros(CVRepeatTimes);
+    MAE_MTimes = np.zeros(CVRepeatTimes);
+    for i in np.arange(CVRepeatTimes):
+        ResultantFolder_TimeI = ResultantFolder + '/Time_' + str(i)
+        Fold_Corr = [];
+        Fold_MAE = [];
+        for j in np.arange(Fold_Quantity):
+            Fold_J_Index = Fold_Index[i][j]
+            Subjects_Score_test = Subjects_Score[Fold_J_Index]
+            Fold_J_Score = Outer_Results[i * Fold_Quantity + j][:, 0]
+            Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
+            Fold_J_Corr = Fold_J_Corr[0,1]
+            Fold_Corr.append(Fold_J_Corr)
+            Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
+            Fold_MAE.append(Fold_J_MAE)
+
+            Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE}
+            Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
+            ResultantFile = os.path.join(ResultantFolder_TimeI, Fold_J_FileName)
+            sio.savemat(ResultantFile, Fold_J_result)
+
+        Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
+        Corr_MTimes[i] = np.mean(Fold_Corr)
+        MAE_MTimes[i] = np.mean(Fold_MAE)
+        Res_NFold = {'Mean_Corr':Corr_MTimes[i], 'Mean_MAE':MAE_MTimes[i]};
+        ResultantFile = os.path.join(ResultantFolder_TimeI, 'Res_NFold.mat')
+        sio.savemat(ResultantFile, Res_NFold)
+    Mean_Corr = np.mean(Corr_MTimes);
+    Mean_MAE = np.mean(MAE_MTimes);
+
+    Res = {'Mean_Corr': Mean_Corr, 'Mean_MAE': Mean_MAE, 'Cor_MTimes': Corr_MTimes, 'MAE_MTimes': MAE_MTimes};
+    ResultantFile = os.path.join(ResultantFolder, 'Prediction_MultiTimesMean.mat');
+    sio.savemat(ResultantFile, Res);
+
+def Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, Seed=None, Kernel_Flag=0):
     #
     # Ridge regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -65,32 +202,38 @@ def Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ran
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer
+    # Seed:
+    #     None: the split is drawn from the random state of numpy (default)
+    #     An integer: the split is drawn from this seed (see 'Split_Fold' in Common_CZ_Split), and the same Seed gives the same
+    #     outer and inner splits for all the models
+    # Kernel_Flag:
+    #     1: kernel (dual) ridge regression from the Gram matrices of the scaled data, see 'Ridge_KFold_RandomCV_Kernel'
+    #        Faster when subjects are much fewer than features, e.g., connectivity data
+    #     0: linear_model.Ridge on the scaled data of each fold (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
+    if Kernel_Flag:
+        return Ridge_KFold_RandomCV_Kernel(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, Seed)
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
 
     Subjects_Quantity = len(Subjects_Score)
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    RandIndex = np.arange(Subjects_Quantity)
-    np.random.shuffle(RandIndex)
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Seed)['Test_Index']
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = RandIndex[EachFold_Size * j + np.arange(EachFold_Size)]
-        if Remain > j:
-            Fold_J_Index = np.insert(Fold_J_Index, len(Fold_J_Index), RandIndex[EachFold_Size * Fold_Quantity + j])
+        Fold_J_Index = Fold_Index[j]
 
         Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
         Subjects_Data_train = np.delete(Subjects_Data, Fold_J_Index, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index) 
 
-        Optimal_Alpha = Ridge_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity)
+        Optimal_Alpha = Ridge_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, Seed=Split_Seed(Seed, j))
 
         normalize = preprocessing.MinMaxScaler()
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
@@ -119,7 +262,68 @@ def Ridge_KFold_RandomCV(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Ran
     sio.savemat(ResultantFile, Res_NFold)
     return (Mean_Corr, Mean_MAE)  
 
-def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity):
+def Ridge_KFold_RandomCV_Kernel(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, Parallel_Quantity, Seed=None):
+    #
+    # The same with 'Ridge_KFold_RandomCV', while ridge regression is solved in the dual form, from the Gram matrices of the scaled data
+    # For each outer fold, the Gram matrices of the outer fold and of all the inner folds of all the inner repeats come from
+    # one pass over the features (see 'Kernel_Nested' in Common_CZ_Kernel), instead of one pass for each inner repeat;
+    # the Gram matrices of all the outer folds are not kept at once, as there are Fold_Quantity * CVRepeatTimes_ForInner inner folds
+    # for each outer fold
+    # The splits are drawn in the same order with 'Ridge_KFold_RandomCV', so the results are the same up to rounding errors
+    #
+    # Variables are the same with function 'Ridge_KFold_RandomCV'
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+
+    Subjects_Quantity = len(Subjects_Score)
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Seed)['Test_Index']
+
+    Fold_Corr = [];
+    Fold_MAE = [];
+
+    for j in np.arange(Fold_Quantity):
+
+        Fold_J_Index = Fold_Index[j]
+        Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_J_Index)
+        Subjects_Score_test = Subjects_Score[Fold_J_Index]
+        Subjects_Score_train = Subjects_Score[Training_Index]
+
+        # The inner splits of 'Ridge_OptimalAlpha_KFold'
+        Seed_J = Split_Seed(Seed, j)
+        Inner_Fold_Index = [Split_Fold(len(Training_Index), Fold_Quantity, 'Random', Split_Seed(Seed_J, i))['Test_Index'] \
+            for i in np.arange(CVRepeatTimes_ForInner)]
+        Kernel = Kernel_Nested(Subjects_Data, [Fold_J_Index], [sum(Inner_Fold_Index, [])])
+        Inner_Gram = [Kernel['Inner_Gram'][0][i * Fold_Quantity:(i + 1) * Fold_Quantity] for i in np.arange(CVRepeatTimes_ForInner)]
+
+        Optimal_Alpha = Ridge_OptimalAlpha_KFold(None, Subjects_Score_train, Fold_Quantity, Alpha_Range, CVRepeatTimes_ForInner, ResultantFolder, \
+            Parallel_Quantity, Seed=Seed_J, Inner_Kernel={'Test_Index': Inner_Fold_Index, 'Gram': Inner_Gram})
+
+        Gram = Kernel['Gram'][0]
+        Fold_J_Score = Ridge_Kernel_Path_Predict(Gram[np.ix_(Training_Index, Training_Index)], Gram[np.ix_(Fold_J_Index, Training_Index)], \
+            Subjects_Score_train, [Optimal_Alpha])[:, 0]
+
+        Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
+        Fold_J_Corr = Fold_J_Corr[0,1]
+        Fold_Corr.append(Fold_J_Corr)
+        Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
+        Fold_MAE.append(Fold_J_MAE)
+
+        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE}
+        Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
+        ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
+        sio.savemat(ResultantFile, Fold_J_result)
+
+    Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
+    Mean_Corr = np.mean(Fold_Corr)
+    Mean_MAE = np.mean(Fold_MAE)
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, CVRepeatTimes, ResultantFolder, Parallel_Quantity, Debug_Flag=0, Path_Flag=1, Seed=None, Inner_Kernel=None):
     #
     # Select optimal regularization parameter using nested cross-validation
     #
@@ -140,68 +344,107 @@ def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer
+    # Debug_Flag:
+    #     1: also write the result of each parameter into ResultantFolder as a .mat file, for debugging
+    #     0: keep the results of each parameter in memory only (default)
+    # Path_Flag:
+    #     1: evaluate all the alphas from one decomposition of the inner training data, see 'Ridge_Path_Predict' (default)
+    #        If subjects are fewer than features, the Gram matrix of each fold is computed with the MinMax range of its training data
+    #        (see 'Scale_Fold_Range' and 'Scale_Gram'), without a scaled copy of the data
+    #     0: fit linear_model.Ridge separately for each alpha, in parallel
+    # Seed:
+    #     None: the splits are drawn from the random state of numpy (default)
+    #     Otherwise, the split of the i-th repeat is drawn from Split_Seed(Seed, i), see 'Split_Fold' in Common_CZ_Split
+    # Inner_Kernel:
+    #     Optional, dict with 'Test_Index' and 'Gram', Test_Index[i] is the list of the testing index of the inner folds of the i-th repeat
+    #     and Gram[i][k] is the Gram matrix of the training subjects scaled by the range of the training subjects of the k-th inner fold,
+    #     e.g., from 'Kernel_Nested' in Common_CZ_Kernel; the splits are not drawn, and Training_Data is not used and can be None
     #
     
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder);
     
     Subjects_Quantity = len(Training_Score)
-    Inner_EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
+    Gram_Flag = Path_Flag and (Inner_Kernel is not None or Subjects_Quantity < np.shape(Training_Data)[1])
+    if Inner_Kernel is not None:
+        # The splits and the Gram matrices of the inner folds are given
+        pass
+    elif Gram_Flag:
+        # Gram matrix with the MinMax range of all the training data, corrected for each fold
+        Data_Range = Scale_Handle_Zeros(np.max(Training_Data, axis=0) - np.min(Training_Data, axis=0))
+        Shift = np.mean(Training_Data, axis=0)
+        Training_Gram = Scale_Gram(Training_Data, Shift, 1 / Data_Range ** 2)
+    else:
+        # The data of each inner fold are taken by index into one buffer, see 'Fold_Data' in Common_CZ_Fold
+        Fold_Data_Buffer = Fold_Buffer(Training_Data)
 
     Inner_Corr_Mean = np.zeros((CVRepeatTimes, len(Alpha_Range)))
     Inner_MAE_inv_Mean = np.zeros((CVRepeatTimes, len(Alpha_Range)))
     for i in np.arange(CVRepeatTimes):
 
-        RandIndex = np.arange(Subjects_Quantity)
-        np.random.shuffle(RandIndex)
+        if Inner_Kernel is not None:
+            Inner_Fold_Index = Inner_Kernel['Test_Index'][i]
+        else:
+            Inner_Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity, 'Random', Split_Seed(Seed, i))['Test_Index']
     
         Inner_Corr = np.zeros((Fold_Quantity, len(Alpha_Range)))
         Inner_MAE_inv = np.zeros((Fold_Quantity, len(Alpha_Range)))
         Alpha_Quantity = len(Alpha_Range)
 
+        if Gram_Flag and Inner_Kernel is None:
+            # MinMax range of the training data of all the inner folds at once
+            Fold_Range = Scale_Fold_Range(Training_Data, Inner_Fold_Index)[1]
+
         for k in np.arange(Fold_Quantity):
         
-            Inner_Fold_K_Index = RandIndex[Inner_EachFold_Size * k + np.arange(Inner_EachFold_Size)]
-            if Remain > k:
-                Inner_Fold_K_Index = np.insert(Inner_Fold_K_Index, len(Inner_Fold_K_Index), RandIndex[Inner_EachFold_Size * Fold_Quantity + k])
-
-            Inner_Fold_K_Data_test = Training_Data[Inner_Fold_K_Index, :]
+            Inner_Fold_K_Index = Inner_Fold_Index[k]
             Inner_Fold_K_Score_test = Training_Score[Inner_Fold_K_Index]
-            Inner_Fold_K_Data_train = np.delete(Training_Data, Inner_Fold_K_Index, axis=0)
             Inner_Fold_K_Score_train = np.delete(Training_Score, Inner_Fold_K_Index)
+
+            if Gram_Flag:
+                # The same with the scaled data, without copying the data of this fold
+                # The range changes only for the features with the min or max in this fold
+                Inner_Fold_K_Train_Index = np.delete(np.arange(Subjects_Quantity), Inner_Fold_K_Index)
+                if Inner_Kernel is not None:
+                    Gram = Inner_Kernel['Gram'][i][k]
+                else:
+                    Changed_Index = np.nonzero(Fold_Range[k] != Data_Range)[0]
+                    Gram = Training_Gram + Scale_Gram(Training_Data[:, Changed_Index], Shift[Changed_Index], \
+                        1 / Fold_Range[k, Changed_Index] ** 2 - 1 / Data_Range[Changed_Index] ** 2)
+                Predict_Score = Ridge_Kernel_Path_Predict(Gram[np.ix_(Inner_Fold_K_Train_Index, Inner_Fold_K_Train_Index)], \
+                    Gram[np.ix_(Inner_Fold_K_Index, Inner_Fold_K_Train_Index)], Inner_Fold_K_Score_train, Alpha_Range)
+            else:
+                Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Training_Data, Inner_Fold_K_Index, Fold_Data_Buffer)
+                if Path_Flag:
+                    Predict_Score = Ridge_Path_Predict(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range)
         
-            Scale = preprocessing.MinMaxScaler()
-            Inner_Fold_K_Data_train = Scale.fit_transform(Inner_Fold_K_Data_train)
-            Inner_Fold_K_Data_test = Scale.transform(Inner_Fold_K_Data_test)    
-        
-            Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Ridge_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder) for l in np.arange(len(Alpha_Range)))        
-        
-            for l in np.arange(Alpha_Quantity):
-                print(l)
-                Fold_l_Mat_Path = ResultantFolder + '/Alpha_' + str(l) + '.mat';
-                Fold_l_Mat = sio.loadmat(Fold_l_Mat_Path)
-                Inner_Corr[k, l] = Fold_l_Mat['Corr'][0][0]
-                Inner_MAE_inv[k, l] = Fold_l_Mat['MAE_inv']
-                os.remove(Fold_l_Mat_Path)
+            if Path_Flag:
+                # All the alphas are evaluated from one decomposition of the inner training data
+                Inner_Corr[k, :], Inner_MAE_inv[k, :] = Path_Evaluate(Predict_Score, Inner_Fold_K_Score_test)
+                if Debug_Flag:
+                    for l in np.arange(Alpha_Quantity):
+                        Fold_result = {'Corr': Inner_Corr[k, l], 'MAE_inv':Inner_MAE_inv[k, l]}
+                        sio.savemat(ResultantFolder + '/Alpha_' + str(l) + '.mat', Fold_result)
+            else:
+                Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Ridge_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder, Debug_Flag) for l in np.arange(len(Alpha_Range)))
+                for l in np.arange(Alpha_Quantity):
+                    Inner_Corr[k, l], Inner_MAE_inv[k, l] = Alpha_Results[l]
             
             Inner_Corr = np.nan_to_num(Inner_Corr)
         Inner_Corr_Mean[i, :] = np.mean(Inner_Corr, axis=0)
         Inner_MAE_inv_Mean[i, :] = np.mean(Inner_MAE_inv, axis=0)
-    Inner_Corr_CVMean = np.mean(Inner_Corr_Mean, axis=0)
-    Inner_MAE_inv_CVMean = np.mean(Inner_MAE_inv_Mean, axis=0)
-    Inner_Corr_CVMean = (Inner_Corr_CVMean - np.mean(Inner_Corr_CVMean)) / np.std(Inner_Corr_CVMean)
-    Inner_MAE_inv_CVMean = (Inner_MAE_inv_CVMean - np.mean(Inner_MAE_inv_CVMean)) / np.std(Inner_MAE_inv_CVMean)
-    Inner_Evaluation = Inner_Corr_CVMean + Inner_MAE_inv_CVMean
+    Inner_Evaluation, Optimal_Alpha_Index = Score_Select(Inner_Corr_Mean, Inner_MAE_inv_Mean)
+    # The z-scored means of the repeats
+    Inner_Corr_CVMean = Score_Standardize(np.mean(Inner_Corr_Mean, axis=0))
+    Inner_MAE_inv_CVMean = Score_Standardize(np.mean(Inner_MAE_inv_Mean, axis=0))
     
     Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Corr_CVMean':Inner_Corr_CVMean, 'Inner_MAE_inv_CVMean':Inner_MAE_inv_CVMean, 'Inner_Evaluation':Inner_Evaluation}
     sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
     
-    Optimal_Alpha_Index = np.argmax(Inner_Evaluation) 
     Optimal_Alpha = Alpha_Range[Optimal_Alpha_Index]
     return (Optimal_Alpha)
 
-def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder):
+def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder, Debug_Flag=0):
     #
     # Sub-function for optimal regularization parameter selection
     #
@@ -219,17 +462,20 @@ def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, A
     #     The indice of the alpha we tested in the alpha range
     # ResultantFolder:
     #     Folder to storing the results
+    # Debug_Flag:
+    #     1: also write the result of this parameter into ResultantFolder as a .mat file, for debugging
+    #     0: only return the result, nothing is written (default)
     #
     
     clf = linear_model.Ridge(alpha=Alpha)
     clf.fit(Training_Data, Training_Score)
     Predict_Score = clf.predict(Testing_Data)
-    Fold_Corr = np.corrcoef(Predict_Score, Testing_Score)
-    Fold_Corr = Fold_Corr[0,1]
-    Fold_MAE_inv = np.divide(1, np.mean(np.abs(Predict_Score - Testing_Score)))
-    Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
-    ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
-    sio.savemat(ResultantFile, Fold_result)
+    Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Testing_Score)
+    if Debug_Flag:
+        Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
+        ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
+        sio.savemat(ResultantFile, Fold_result)
+    return (Fold_Corr, Fold_MAE_inv)
     
 def Ridge_Weight(Subjects_Data, Subjects_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
     #
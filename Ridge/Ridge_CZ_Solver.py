@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+#
+# Written by Zaixu Cui: zaixucui@gmail.com;
+#                       Zaixu.Cui@pennmedicine.upenn.edu
+#
+# If you use this code, please cite:
+#                       Cui et al., 2018, Cerebral Cortex;
+#                       Cui and Gong, 2018, NeuroImage;
+#                       Cui et al., 2016, Human Brain Mapping.
+# (google scholar: https://scholar.google.com.hk/citations?user=j7amdXoAAAAJ&hl=zh-TW&oi=ao)
+#
+
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Scale import Scale_Exclude_Change, Scale_Gram
+from Common_CZ_Sparse import Sparse_Check
+
+def Ridge_Path_Predict(Training_Data, Training_Score, Testing_Data, Alpha_Range):
+    #
+    # Ridge regression for all the alphas in Alpha_Range with only one decomposition of the training data
+    # The predictions are the same with fitting linear_model.Ridge(alpha=Alpha) separately for each alpha,
+    # i.e., the intercept is fitted (not penalized) by centering the training data and scores
+    # If subjects are fewer than features (generally for connectivity data), the n*n Gram matrix is eigendecomposed,
+    # otherwise, the SVD of the n*m training data is used
+    # For sparse data (see Common_CZ_Sparse), the Gram matrices are computed from the sparse data without centering,
+    # which is then done by 'Ridge_Kernel_Path_Predict'
+    #
+    # Training_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    # Testing_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    #
+    # Return:
+    #     Predict_Score, n*len(Alpha_Range) matrix, n is testing subjects quantity
+    #     The l-th column is the prediction with Alpha_Range[l]
+    #
+
+    if Sparse_Check(Training_Data):
+        return Ridge_Kernel_Path_Predict(Training_Data.dot(Training_Data.T).toarray(), Testing_Data.dot(Training_Data.T).toarray(), \
+            Training_Score, Alpha_Range)
+
+    Alpha_Range = np.asarray(Alpha_Range, dtype=np.float64)
+    Training_Mean = np.mean(Training_Data, axis=0)
+    Score_Mean = np.mean(Training_Score)
+    Training_Data = Training_Data - Training_Mean
+    Testing_Data = Testing_Data - Training_Mean
+    Training_Score = Training_Score - Score_Mean
+
+    Subjects_Quantity, Features_Quantity = np.shape(Training_Data)
+    if Subjects_Quantity < Features_Quantity:
+        # K = X * X', K = U * diag(s^2) * U'
+        # Prediction = X_test * X' * U * diag(1 / (s^2 + alpha)) * U' * y
+        Gram = np.dot(Training_Data, Training_Data.T)
+        Eigen_Value, Eigen_Vector = np.linalg.eigh(Gram)
+        Eigen_Value = np.maximum(Eigen_Value, 0)
+        Testing_Projection = np.dot(np.dot(Testing_Data, Training_Data.T), Eigen_Vector)
+        Score_Projection = np.dot(Eigen_Vector.T, Training_Score)
+        Shrinkage = 1 / (Eigen_Value[:, np.newaxis] + Alpha_Range[np.newaxis, :])
+    else:
+        # X = U * diag(s) * V'
+        # Prediction = X_test * V * diag(s / (s^2 + alpha)) * U' * y
+        U, s, Vt = np.linalg.svd(Training_Data, full_matrices=False)
+        Testing_Projection = np.dot(Testing_Data, Vt.T)
+        Score_Projection = np.dot(U.T, Training_Score)
+        Shrinkage = s[:, np.newaxis] / (s[:, np.newaxis] ** 2 + Alpha_Range[np.newaxis, :])
+
+    Predict_Score = np.dot(Testing_Projection, Shrinkage * Score_Projection[:, np.newaxis]) + Score_Mean
+    return Predict_Score
+
+def Ridge_Kernel_Path_Predict(Training_Gram, Testing_Gram, Training_Score, Alpha_Range):
+    #
+    # The same with 'Ridge_Path_Predict', but from the Gram matrices instead of the data,
+    # e.g., the Gram matrices of the MinMax scaled data computed by 'Scale_Gram' without a scaled copy of the data
+    # The Gram matrices can be of the data shifted by any constant for each feature, which is absorbed by the intercept
+    #
+    # Training_Gram:
+    #     n*n matrix, n is training subjects quantity
+    # Testing_Gram:
+    #     t*n matrix, inner products between the testing and training subjects, t is testing subjects quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    #
+    # Return:
+    #     Predict_Score, t*len(Alpha_Range) matrix
+    #
+
+    Alpha_Range = np.asarray(Alpha_Range, dtype=np.float64)
+    Score_Mean = np.mean(Training_Score)
+    # Centering of the training subjects, in the space of the Gram matrix
+    Training_Gram_Mean = np.mean(Training_Gram, axis=1)
+    Testing_Gram = Testing_Gram - np.mean(Testing_Gram, axis=1)[:, np.newaxis] - Training_Gram_Mean[np.newaxis, :] + np.mean(Training_Gram_Mean)
+    Eigen_Value, Eigen_Vector = Ridge_Gram_Eigen(Training_Gram)
+    Testing_Projection = np.dot(Testing_Gram, Eigen_Vector)
+    Score_Projection = np.dot(Eigen_Vector.T, Training_Score - Score_Mean)
+    Shrinkage = 1 / (Eigen_Value[:, np.newaxis] + Alpha_Range[np.newaxis, :])
+    Predict_Score = np.dot(Testing_Projection, Shrinkage * Score_Projection[:, np.newaxis]) + Score_Mean
+    return Predict_Score
+
+def Ridge_Kernel_Batch_Predict(Training_Gram, Testing_Gram, Training_Score, Alpha):
+    #
+    # Ridge regression of several score vectors on the same data at once, each with its own alpha,
+    # e.g., the permuted scores of all the permutations, from one decomposition of the Gram matrix
+    # The predictions of each column are the same with 'Ridge_Kernel_Path_Predict' with its alpha
+    #
+    # Training_Gram:
+    #     n*n matrix, n is training subjects quantity
+    # Testing_Gram:
+    #     t*n matrix, inner products between the testing and training subjects, t is testing subjects quantity
+    # Training_Score:
+    #     n*P matrix, P is the quantity of score vectors
+    # Alpha:
+    #     P*1 vector, the alpha of each score vector
+    #
+    # Return:
+    #     Predict_Score, t*P matrix
+    #     Dual_Coef, n*P matrix, the weights are Z' * Dual_Coef, Z is the (shifted) training data of Training_Gram
+    #
+
+    Alpha = np.asarray(Alpha, dtype=np.float64)
+    Score_Mean = np.mean(Training_Score, axis=0)
+    Training_Gram_Mean = np.mean(Training_Gram, axis=1)
+    Testing_Gram = Testing_Gram - np.mean(Testing_Gram, axis=1)[:, np.newaxis] - Training_Gram_Mean[np.newaxis, :] + np.mean(Training_Gram_Mean)
+    Eigen_Value, Eigen_Vector = Ridge_Gram_Eigen(Training_Gram)
+    Score_Projection = np.dot(Eigen_Vector.T, Training_Score - Score_Mean[np.newaxis, :])
+    Shrinkage = 1 / (Eigen_Value[:, np.newaxis] + Alpha[np.newaxis, :])
+    Dual_Coef = np.dot(Eigen_Vector, Shrinkage * Score_Projection)
+    Predict_Score = np.dot(Testing_Gram, Dual_Coef) + Score_Mean[np.newaxis, :]
+    return (Predict_Score, Dual_Coef)
+
+def Ridge_LOO_Predict(Training_Gram, Training_Score, Alpha_Range):
+    #
+    # Leave-one-out predictions of ridge regression for all the alphas in Alpha_Range, without refitting
+    # Ridge regression with a fitted intercept is the solution of the bordered linear system
+    #     [K + alpha*I, 1; 1', 0] * [c; b] = [y; 0], K is the Gram matrix
+    # and the leave-one-out residual of subject i is c_i / inv([K + alpha*I, 1; 1', 0])_ii,
+    # so all the leave-one-out predictions come from one eigendecomposition of K
+    # The Gram matrix is fixed for all the n loops, i.e., the scaling is not refitted without the left-out subject,
+    # see 'Ridge_LOO_MinMax_Predict' for the same predictions with preprocessing.MinMaxScaler fitted in each loop
+    #
+    # Training_Gram:
+    #     n*n matrix, n is subjects quantity
+    # Training_Score:
+    #     n*1 vector, n is subjects quantity
+    #     or n*P matrix, e.g., the permuted scores of P permutations, all from the same decomposition
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    #
+    # Return:
+    #     Predicted_Score, n*len(Alpha_Range) matrix, or n*len(Alpha_Range)*P array for n*P Training_Score
+    #     The (i, l) element is the prediction of the i-th subject by the model trained on the other subjects with Alpha_Range[l]
+    #
+
+    Alpha_Range = np.asarray(Alpha_Range, dtype=np.float64)
+    Score_Matrix = np.reshape(Training_Score, (len(Training_Score), -1))
+    Eigen_Value, Eigen_Vector = Ridge_Gram_Eigen(Training_Gram)
+    # D = 1 / (s^2 + alpha), inv(K + alpha*I) = U * diag(D) * U'
+    D = 1 / (Eigen_Value[:, np.newaxis] + Alpha_Range[np.newaxis, :])
+    Ones_Projection = np.sum(Eigen_Vector, axis=0)
+    Score_Projection = np.dot(Eigen_Vector.T, Score_Matrix)
+    # inv(K + alpha*I) * 1, inv(K + alpha*I) * y and diag(inv(K + alpha*I)), for all the alphas
+    Ones_Solution = np.dot(Eigen_Vector, D * Ones_Projection[:, np.newaxis])
+    Score_Solution = np.einsum('ik,kl,kp->ilp', Eigen_Vector, D, Score_Projection, optimize=True)
+    Inverse_Diagonal = np.dot(Eigen_Vector ** 2, D)
+    Ones_Sum = np.dot(Ones_Projection ** 2, D)
+    Intercept = np.dot((Ones_Projection[:, np.newaxis] * D).T, Score_Projection) / Ones_Sum[:, np.newaxis]
+    # Border the system with the intercept
+    c = Score_Solution - Ones_Solution[:, :, np.newaxis] * Intercept[np.newaxis, :, :]
+    Bordered_Diagonal = Inverse_Diagonal - Ones_Solution ** 2 / Ones_Sum[np.newaxis, :]
+    Predicted_Score = Score_Matrix[:, np.newaxis, :] - c / Bordered_Diagonal[:, :, np.newaxis]
+    if np.ndim(Training_Score) == 1:
+        Predicted_Score = Predicted_Score[:, :, 0]
+    return Predicted_Score
+
+def Ridge_LOO_MinMax_Predict(Subjects_Data, Subjects_Score, Alpha_Range, Order, Shift, Gram, Exclude_Index=[]):
+    #
+    # Leave-one-out predictions inside the subjects out of Exclude_Index, with preprocessing.MinMaxScaler fitted
+    # on the training subjects of each loop, the same with refitting the scaling and linear_model.Ridge in each loop
+    # The range of a feature changes only when the left-out subject has its min or max,
+    # so the Gram matrix of each loop is the Gram matrix of all the training subjects corrected on these few features,
+    # and the loops without any change come from one decomposition, see 'Ridge_LOO_Predict'
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*1 vector, the values in the positions of Exclude_Index are not used
+    #     or n*P matrix, e.g., the permuted scores of P permutations, sharing the decompositions of all the loops
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    # Order:
+    #     Output of 'Scale_Order' of Subjects_Data, the Depth should be larger than len(Exclude_Index) + 1
+    # Shift:
+    #     m*1 vector, the shift of each feature used in Gram
+    # Gram:
+    #     n*n matrix, 'Scale_Gram' of Subjects_Data with Shift and the range of the subjects out of Exclude_Index
+    # Exclude_Index:
+    #     Index of the subjects not used, e.g., the testing subject of the outer LOOCV
+    #
+    # Return:
+    #     Predicted_Score, (n-len(Exclude_Index))*len(Alpha_Range) matrix, in the order of the subjects out of Exclude_Index
+    #     or (n-len(Exclude_Index))*len(Alpha_Range)*P array for n*P Subjects_Score
+    #
+
+    Training_Index = np.setdiff1d(np.arange(np.shape(Subjects_Data)[0]), Exclude_Index)
+    Training_Gram = Gram[np.ix_(Training_Index, Training_Index)]
+    Training_Score = Subjects_Score[Training_Index]
+    Predicted_Score = Ridge_LOO_Predict(Training_Gram, Training_Score, Alpha_Range)
+    for i in np.arange(len(Training_Index)):
+        Changed_Index, Base_Range, Fold_Range = Scale_Exclude_Change(Order, Exclude_Index, [Training_Index[i]])
+        if not len(Changed_Index):
+            continue
+        # Gram matrix with the range of the training subjects of this loop
+        Fold_Gram = Training_Gram + Scale_Gram(Subjects_Data[np.ix_(Training_Index, Changed_Index)], Shift[Changed_Index], \
+            1 / Fold_Range ** 2 - 1 / Base_Range ** 2)
+        Fold_Index = np.delete(np.arange(len(Training_Index)), i)
+        if np.ndim(Training_Score) == 1:
+            Predicted_Score[i] = Ridge_Kernel_Path_Predict(Fold_Gram[np.ix_(Fold_Index, Fold_Index)], Fold_Gram[np.ix_([i], Fold_Index)], \
+                Training_Score[Fold_Index], Alpha_Range)[0]
+        else:
+            Predicted_Score[i] = Ridge_Kernel_MultiTarget_Predict(Fold_Gram[np.ix_(Fold_Index, Fold_Index)], Fold_Gram[np.ix_([i], Fold_Index)], \
+                Training_Score[Fold_Index], Alpha_Range)[0]
+    return Predicted_Score
+
+def Ridge_Gram_Eigen(Gram):
+    #
+    # Eigendecomposition of the Gram matrix after centering the subjects
+    # Centering does not change the ridge solution with a fitted intercept, but makes the decomposition more accurate
+    #
+    # Gram:
+    #     n*n matrix, n is subjects quantity
+    #
+    # Return:
+    #     Eigen_Value, n*1 vector, non-negative
+    #     Eigen_Vector, n*n matrix
+    #
+
+    Gram_Mean = np.mean(Gram, axis=1)
+    Gram = Gram - Gram_Mean[:, np.newaxis] - Gram_Mean[np.newaxis, :] + np.mean(Gram_Mean)
+    Eigen_Value, Eigen_Vector = np.linalg.eigh(Gram)
+    Eigen_Value = np.maximum(Eigen_Value, 0)
+    return (Eigen_Value, Eigen_Vector)
+
+def Ridge_Kernel_Weight(Subjects_Data, Subjects_Score, Gram, Shift, Data_Range, Alpha, Block_Size=4096, Weight_File=None):
+    #
+    # Weights of ridge regression on the MinMax scaled data, from the Gram matrix (dual form) instead of fitting in the feature space
+    # The same with clf.coef_ of linear_model.Ridge(alpha=Alpha) fitted on the data scaled by preprocessing.MinMaxScaler
+    # The dual coefficients c solve (K + alpha*I) * c = y after centering, and sum(c) = 0, so the weights are Z' * c
+    # with Z the data scaled by Data_Range and shifted by any constant, i.e., only one pass over the data
+    # The features are read block by block, so the memory is n*n plus n*Block_Size, not n*m, e.g., for a memory-mapped Subjects_Data
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*1 vector, n is subjects quantity
+    # Gram:
+    #     n*n matrix, 'Scale_Gram' of Subjects_Data with Shift and 1 / Data_Range^2
+    # Shift:
+    #     m*1 vector, the shift of each feature used in Gram
+    # Data_Range:
+    #     m*1 vector, MinMax range of each feature, with near-constant features set to 1 (see 'Scale_Handle_Zeros')
+    # Alpha:
+    #     Value of alpha
+    # Block_Size:
+    #     Quantity of features processed at a time
+    # Weight_File:
+    #     Optional, path of a .npy file, the weights are written into it block by block (see np.lib.format.open_memmap)
+    #     instead of being kept in memory, for millions of features
+    #
+    # Return:
+    #     Weight, m*1 vector, or the m*1 np.memmap of Weight_File
+    #
+
+    Eigen_Value, Eigen_Vector = Ridge_Gram_Eigen(Gram)
+    Score_Projection = np.dot(Eigen_Vector.T, Subjects_Score - np.mean(Subjects_Score))
+    Dual_Coef = np.dot(Eigen_Vector, Score_Projection / (Eigen_Value + Alpha))
+    Dual_Sum = np.sum(Dual_Coef)
+    Features_Quantity = np.shape(Subjects_Data)[1]
+    if Weight_File is None:
+        Weight = np.zeros(Features_Quantity)
+    else:
+        Weight = np.lib.format.open_memmap(Weight_File, mode='w+', dtype=np.float64, shape=(Features_Quantity,))
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Weight[Block] = (np.dot(Dual_Coef, Subjects_Data[:, Block]) - Shift[Block] * Dual_Sum) / Data_Range[Block]
+    if Weight_File is not None:
+        Weight.flush()
+    return Weight
+
+def Ridge_Weight_Predict(Testing_Data, Training_Score, Weight, Shift, Data_Range, Block_Size=4096):
+    #
+    # Predictions of ridge regression from the weights of 'Ridge_Kernel_Weight', with the testing data read block by block
+    # The same with clf.predict of linear_model.Ridge fitted on the MinMax scaled training data: the fitted intercept
+    # predicts the mean training score at the mean of the training data, so the prediction is mean(y) + sum_f (x_f - Shift_f) / Range_f * w_f
+    #
+    # Testing_Data:
+    #     t*m matrix, t is testing subjects quantity, m is features quantity
+    # Training_Score:
+    #     n*1 vector, n is training subjects quantity
+    # Weight:
+    #     m*1 vector, or np.memmap, the output of 'Ridge_Kernel_Weight'
+    # Shift:
+    #     m*1 vector, the mean of each feature of the training data, e.g., 'Shift' of 'Kernel_Cache' in Common_CZ_Kernel
+    # Data_Range:
+    #     m*1 vector, MinMax range of each feature of the training data, with near-constant features set to 1
+    # Block_Size:
+    #     Quantity of features processed at a time
+    #
+    # Return:
+    #     Predict_Score, t*1 vector
+    #
+
+    Features_Quantity = np.shape(Testing_Data)[1]
+    Predict_Score = np.full(np.shape(Testing_Data)[0], np.mean(Training_Score))
+    for Block_Start in np.arange(0, Features_Quantity, Block_Size):
+        Block = slice(Block_Start, min(Block_Start + Block_Size, Features_Quantity))
+        Predict_Score += np.dot((Testing_Data[:, Block] - Shift[Block]) / Data_Range[Block], Weight[Block])
+    return Predict_Score
+
+def Ridge_Kernel_MultiTarget_Predict(Training_Gram, Testing_Gram, Training_Score, Alpha_Range):
+    #
+    # The same with 'Ridge_Kernel_Path_Predict' for several score vectors on the same data at once,
+    # e.g., many behavioural scores, all the targets and all the alphas from one eigendecomposition
+    #
+    # Training_Gram:
+    #     n*n matrix, n is training subjects quantity
+    # Testing_Gram:
+    #     t*n matrix, inner products between the testing and training subjects, t is testing subjects quantity
+    # Training_Score:
+    #     n*T matrix, T is the quantity of targets
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    #
+    # Return:
+    #     Predict_Score, t*len(Alpha_Range)*T array
+    #     Predict_Score[:, l, s] is the prediction of the s-th target with Alpha_Range[l]
+    #
+
+    Alpha_Range = np.asarray(Alpha_Range, dtype=np.float64)
+    Score_Mean = np.mean(Training_Score, axis=0)
+    Training_Gram_Mean = np.mean(Training_Gram, axis=1)
+    Testing_Gram = Testing_Gram - np.mean(Testing_Gram, axis=1)[:, np.newaxis] - Training_Gram_Mean[np.newaxis, :] + np.mean(Training_Gram_Mean)
+    Eigen_Value, Eigen_Vector = Ridge_Gram_Eigen(Training_Gram)
+    Testing_Projection = np.dot(Testing_Gram, Eigen_Vector)
+    Score_Projection = np.dot(Eigen_Vector.T, Training_Score - Score_Mean[np.newaxis, :])
+    Shrinkage = 1 / (Eigen_Value[:, np.newaxis] + Alpha_Range[np.newaxis, :])
+    Predict_Score = np.einsum('in,nl,ns->ils', Testing_Projection, Shrinkage, Score_Projection, optimize=True) + Score_Mean[np.newaxis, np.newaxis, :]
+    return Predict_Score
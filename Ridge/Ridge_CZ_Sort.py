@@ -11,20 +11,38 @@
 #
 
 import os
+import functools
+import sys
 import scipy.io as sio
 import numpy as np
 import time
 from sklearn import linear_model
 from sklearn import preprocessing
 from joblib import Parallel, delayed
+from Ridge_CZ_Solver import Ridge_Path_Predict, Ridge_Kernel_Path_Predict, Ridge_Kernel_Batch_Predict, Ridge_Kernel_Weight, Ridge_Kernel_MultiTarget_Predict, Ridge_Weight_Predict
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from Common_CZ_Scale import Scale_Fold_Range, Scale_Gram, Scale_Handle_Zeros
+from Common_CZ_Permutation import Permutation_Run, Permutation_Pool, Permutation_Adaptive
+from Common_CZ_Split import Split_Fold, Split_Seed, Split_Generator, Split_Shuffle
+from Common_CZ_Path import Path_Evaluate
+from Common_CZ_Score import Score_Evaluate, Score_Select
+from Common_CZ_Schedule import Schedule_Run, Schedule_Fold
+from Common_CZ_Checkpoint import Checkpoint_Open, Checkpoint_Append, Checkpoint_Close, Checkpoint_Hash
+from Common_CZ_Fold import Fold_Buffer, Fold_Data
+from Common_CZ_Kernel import Kernel_Nested
+from Common_CZ_Store import Store_Open, Store_Collect
+from Common_CZ_Data import Data_Open
+from Common_CZ_Precision import Precision_Data
+from Common_CZ_Sparse import Sparse_Check, Sparse_Delete, Sparse_Scaler
   
-def Ridge_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions):
+def Ridge_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Max_Queued, QueueOptions, Batch_Flag=0, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None, Store_Flag=0):
     
     #
     # Ridge regression with K-fold cross-validation
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Times_IDRange:
@@ -39,94 +57,167 @@ def Ridge_KFold_Sort_Permutation(Subjects_Data, Subjects_Score, Times_IDRange, F
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
     # Max_Queued:
-    #     The maximum jobs to be submitted to SGE cluster at the same time 
+    #     The maximum permutations running at the same time on this computer, see 'Permutation_Run'
     # QueueOptions:
-    #     Generally is '-q all.q' for SGE cluster 
+    #     Not used, kept for compatibility (permutations were submitted as jobs of SGE cluster)
+    # Batch_Flag:
+    #     1: run all the permutations together in this process, see 'Ridge_KFold_Sort_Permutation_Batch'
+    #     0: run each permutation by 'Ridge_KFold_Sort' in a pool of Max_Queued processes (default)
+    # Observed_Corr:
+    #     Optional, Mean_Corr of 'Ridge_KFold_Sort' without permutation
+    #     If given, the permutations of Times_IDRange are run in waves until p < P_Threshold or p > P_Threshold is decided,
+    #     with the probability of a wrong decision at most Error_Rate, see 'Permutation_Adaptive' in Common_CZ_Permutation;
+    #     the quantity of permutations run, the partial null distribution, the p-value and the decision are in ResultantFolder/Res_Adaptive.mat
+    # P_Threshold, Error_Rate:
+    #     Only for Observed_Corr, see 'Permutation_Adaptive'
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Store_Flag:
+    #     1: the results of all the permutations are kept in ResultantFolder/Res_Store.ckpt instead of a folder for each,
+    #        see Common_CZ_Store; 'Store_Null' gives the null distribution, and 'Store_Export_Mat' the .mat files
+    #     0: the results of the i-th permutation are in ResultantFolder/Time_i (default)
     #
 
-    if not os.path.exists(ResultantFolder):
-        os.mkdir(ResultantFolder)
-    Subjects_Data_Mat = {'Subjects_Data': Subjects_Data}
-    Subjects_Data_Mat_Path = ResultantFolder + '/Subjects_Data.mat'
-    sio.savemat(Subjects_Data_Mat_Path, Subjects_Data_Mat)
-    Finish_File = []
-    Times_IDRange_Todo = np.int64(np.array([]))
-    for i in np.arange(len(Times_IDRange)):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
-        if not os.path.exists(ResultantFolder_I):
-            os.mkdir(ResultantFolder_I)
-        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
-            Times_IDRange_Todo = np.insert(Times_IDRange_Todo, len(Times_IDRange_Todo), Times_IDRange[i])
-            Configuration_Mat = {'Subjects_Data_Mat_Path': Subjects_Data_Mat_Path, 'Subjects_Score': Subjects_Score, 'Fold_Quantity': Fold_Quantity, \
-                'Alpha_Range': Alpha_Range, 'ResultantFolder_I': ResultantFolder_I, 'Parallel_Quantity': Parallel_Quantity};
-            sio.savemat(ResultantFolder_I + '/Configuration.mat', Configuration_Mat)
-            system_cmd = 'python3 -c ' + '\'import sys;\
-                sys.path.append("' + os.getcwd() + '");\
-                from Ridge_CZ_Sort import Ridge_KFold_Sort_Permutation_Sub;\
-                import os;\
-                import scipy.io as sio;\
-                configuration = sio.loadmat("' + ResultantFolder_I + '/Configuration.mat");\
-                Subjects_Data_Mat_Path = configuration["Subjects_Data_Mat_Path"];\
-                Subjects_Score = configuration["Subjects_Score"];\
-                Fold_Quantity = configuration["Fold_Quantity"];\
-                Alpha_Range = configuration["Alpha_Range"];\
-                ResultantFolder_I = configuration["ResultantFolder_I"];\
-                Parallel_Quantity = configuration["Parallel_Quantity"];\
-                Ridge_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path[0], Subjects_Score[0], Fold_Quantity[0][0], Alpha_Range[0], ResultantFolder_I[0], Parallel_Quantity[0][0])\' ';
-            system_cmd = system_cmd + ' > "' + ResultantFolder_I + '/Ridge.log" 2>&1\n'
-            Finish_File.append(ResultantFolder_I + '/Res_NFold.mat')
-            script = open(ResultantFolder_I + '/script.sh', 'w') 
-            script.write(system_cmd)
-            script.close()
-
-    Jobs_Quantity = len(Finish_File)
-    if len(Times_IDRange_Todo) > Max_Queued:
-        Submit_Quantity = Max_Queued
-    else:
-        Submit_Quantity = len(Times_IDRange_Todo)
-    for i in np.arange(Submit_Quantity):
-        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[i])
-        #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[i]) + '.e"';
-        #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[i]) + Option;
-        #print(cmd);
-        #os.system(cmd)
-        os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-    Finished_Quantity = 0;
-    while 1:        
-        for i in np.arange(len(Finish_File)):
-             if os.path.exists(Finish_File[i]):
-                 Finished_Quantity = Finished_Quantity + 1
-                 print(Finish_File[i])
-                 del(Finish_File[i])
-                 print(time.strftime('%Y-%m-%d-%H-%M-%S',time.localtime(time.time())))
-                 print('Finish quantity = ' + str(Finished_Quantity))
-                 if Submit_Quantity < len(Times_IDRange_Todo):
-                     ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange_Todo[Submit_Quantity]);
-                     #Option = ' -V -o "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.o" -e "' + ResultantFolder_I + '/perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + '.e"';     
-                     #cmd = 'qsub ' + ResultantFolder_I + '/script.sh ' + QueueOptions + ' -N perm_' + str(Times_IDRange_Todo[Submit_Quantity]) + Option
-                     #print(cmd);
-                     #os.system(cmd);
-                     os.system('at -f "' + ResultantFolder_I + '/script.sh" now')
-                     Submit_Quantity = Submit_Quantity + 1
-                 break;
-        if Finished_Quantity >= Jobs_Quantity:
-            break;    
-
-def Ridge_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity):
+    Subjects_Data = Data_Open(Subjects_Data)
+    if Observed_Corr is not None and Batch_Flag:
+        # The permutations are run in waves until the p-value is decided
+        Run_Function = functools.partial(Ridge_KFold_Sort_Permutation, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, \
+            Fold_Quantity=Fold_Quantity, Alpha_Range=Alpha_Range, ResultantFolder=ResultantFolder, Parallel_Quantity=Parallel_Quantity, \
+            Max_Queued=Max_Queued, QueueOptions=QueueOptions, Batch_Flag=Batch_Flag, Seed=Seed, Store_Flag=Store_Flag)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'Res_NFold.mat', 'Mean_Corr', P_Threshold, Error_Rate, max(Max_Queued, 10), Store_Flag)
+    if Batch_Flag:
+        if Store_Flag:
+            # The permutations in the store are not run again, the others are written into their folders, then moved into the store
+            Store = Store_Open(ResultantFolder)
+            Times_IDRange = Store_Collect(Store, ResultantFolder, Times_IDRange)
+        Ridge_KFold_Sort_Permutation_Batch(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Seed)
+        if Store_Flag:
+            Store_Collect(Store, ResultantFolder, Times_IDRange)
+        return
+    Permutation_Function = functools.partial(Ridge_KFold_Sort, Subjects_Data=Subjects_Data, Subjects_Score=Subjects_Score, Fold_Quantity=Fold_Quantity, \
+        Alpha_Range=Alpha_Range, Parallel_Quantity=Parallel_Quantity, Permutation_Flag=1)
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided, by one pool of processes for all the waves
+        Pool = Permutation_Pool(Permutation_Function, Max_Queued, 'Ridge.log')
+        Run_Function = functools.partial(Permutation_Run, Permutation_Function, ResultantFolder=ResultantFolder, Max_Queued=Max_Queued, \
+            Log_Name='Ridge.log', Seed=Seed, Store_Flag=Store_Flag, Pool=Pool)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'Res_NFold.mat', 'Mean_Corr', P_Threshold, Error_Rate, max(Max_Queued, 10), Store_Flag, Pool)
+    Permutation_Run(Permutation_Function, Times_IDRange, ResultantFolder, Max_Queued, Log_Name='Ridge.log', Seed=Seed, Store_Flag=Store_Flag)
+
+def Ridge_KFold_Sort_Permutation_Sub(Subjects_Data_Mat_Path, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Seed=None):
     #
     # For permutation test, This function will call 'Ridge_KFold_Sort' function
     #
     # Subjects_Data_Mat_Path:
     #     The path of .mat file that contain a variable named 'Subjects_Data'
     #     Variable 'Subjects_Data' is a n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Other variables are the same with function 'Ridge_KFold_Sort'
+    # Seed: see 'Ridge_KFold_Sort'
+    #
+
+    Subjects_Data = Data_Open(Subjects_Data_Mat_Path)
+    Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, 1, Seed=Seed);
+
+def Ridge_KFold_Sort_Permutation_Batch(Subjects_Data, Subjects_Score, Times_IDRange, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Seed=None):
     #
+    # Permutation test of 'Ridge_KFold_Sort' with all the permutations together
+    # Only the training scores change between the permutations, so for each outer fold, the Gram matrix of the scaled data
+    # is computed once and shared by the inner cross-validation of all the permutations (see 'Ridge_OptimalAlpha_KFold'),
+    # and the outer models of all the permutations are fitted as one multi-target problem (see 'Ridge_Kernel_Batch_Predict')
+    # The results of each permutation are the same with 'Ridge_KFold_Sort' with Permutation_Flag = 1,
+    # the scores are permuted in the same order as running the permutations one by one with the same random state
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*1 vector, n is subjects quantity
+    # Times_IDRange:
+    #     The index of permutation test, for example np.arange(1000)
+    #     The permutations with ResultantFolder/Time_i/Res_NFold.mat already existing are skipped
+    # Fold_Quantity:
+    #     Fold quantity for the cross-validation
+    # Alpha_Range:
+    #     Range of alpha, the regularization parameter balancing the training error and L2 penalty
+    # ResultantFolder:
+    #     Path of the folder storing the results, the results of the i-th permutation are in ResultantFolder/Time_i
+    # Parallel_Quantity:
+    #     Parallel multi-cores on one single computer, at least 1, the inner cross-validation of the permutations runs in parallel
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is the same with 'Ridge_KFold_Sort' with Seed = Split_Seed(Seed, i)
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    ResultantFolder_Todo = []
+    Times_Todo = []
+    for i in np.arange(len(Times_IDRange)):
+        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
+        if not os.path.exists(ResultantFolder_I):
+            os.mkdir(ResultantFolder_I)
+        if not os.path.exists(ResultantFolder_I + '/Res_NFold.mat'):
+            ResultantFolder_Todo.append(ResultantFolder_I)
+            Times_Todo.append(Times_IDRange[i])
+    Permutation_Quantity = len(ResultantFolder_Todo)
+    if not Permutation_Quantity:
+        return
 
-    data = sio.loadmat(Subjects_Data_Mat_Path)
-    Subjects_Data = data['Subjects_Data']
-    Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, 1);
+    Subjects_Quantity = len(Subjects_Score)
+    # Sort the subjects score
+    Sorted_Index = np.argsort(Subjects_Score)
+    Subjects_Data = Subjects_Data[Sorted_Index, :]
+    Subjects_Score = Subjects_Score[Sorted_Index]
+
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+
+    # The training scores of each permutation and each fold are permuted in the same order as 'Ridge_KFold_Sort'
+    Random_Index = []
+    for i in np.arange(Permutation_Quantity):
+        Random_Index.append([])
+        Random_Generator = Split_Generator(Split_Seed(Seed, Times_Todo[i]))
+        for j in np.arange(Fold_Quantity):
+            Subjects_Index_Random = np.arange(Subjects_Quantity - len(Fold_Index[j]))
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Random_Index[i].append(Subjects_Index_Random)
 
-def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag):
+    Shift = np.mean(Subjects_Data, axis=0)
+    Fold_Range = Scale_Fold_Range(Subjects_Data, Fold_Index)[1]
+    Fold_Corr = np.zeros((Permutation_Quantity, Fold_Quantity))
+    Fold_MAE = np.zeros((Permutation_Quantity, Fold_Quantity))
+    for j in np.arange(Fold_Quantity):
+
+        Fold_J_Index = Fold_Index[j]
+        Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_J_Index)
+        Subjects_Data_train = Subjects_Data[Training_Index, :]
+        Subjects_Score_test = Subjects_Score[Fold_J_Index]
+        Subjects_Score_train = np.zeros((len(Training_Index), Permutation_Quantity))
+        for i in np.arange(Permutation_Quantity):
+            Subjects_Score_train[:, i] = Subjects_Score[Training_Index][Random_Index[i][j]]
+
+        # Gram matrix of the data scaled by the range of the training subjects of this fold, for all the permutations
+        Gram = Scale_Gram(Subjects_Data, Shift, 1 / Fold_Range[j] ** 2)
+        Training_Gram = Gram[np.ix_(Training_Index, Training_Index)]
+        Alpha_Results = Parallel(n_jobs=Parallel_Quantity, backend="threading")(delayed(Ridge_OptimalAlpha_KFold)(Subjects_Data_train, \
+            Subjects_Score_train[:, i], Fold_Quantity, Alpha_Range, ResultantFolder_Todo[i], 1, Training_Gram=Training_Gram, Shift=Shift) \
+            for i in np.arange(Permutation_Quantity))
+        Optimal_Alpha = np.array([Alpha_Results[i][0] for i in np.arange(Permutation_Quantity)])
+
+        Fold_J_Score = Ridge_Kernel_Batch_Predict(Training_Gram, Gram[np.ix_(Fold_J_Index, Training_Index)], Subjects_Score_train, Optimal_Alpha)[0]
+        for i in np.arange(Permutation_Quantity):
+            Fold_Corr[i, j] = np.corrcoef(Fold_J_Score[:, i], Subjects_Score_test)[0, 1]
+            Fold_MAE[i, j] = np.mean(np.abs(np.subtract(Fold_J_Score[:, i], Subjects_Score_test)))
+            Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score[:, i], 'Corr':Fold_Corr[i, j], 'MAE':Fold_MAE[i, j], 'Alpha':Optimal_Alpha[i]}
+            sio.savemat(os.path.join(ResultantFolder_Todo[i], 'Fold_' + str(j) + '_Score.mat'), Fold_J_result)
+
+    Fold_Corr = np.nan_to_num(Fold_Corr)
+    for i in np.arange(Permutation_Quantity):
+        Res_NFold = {'Mean_Corr':np.mean(Fold_Corr[i]), 'Mean_MAE':np.mean(Fold_MAE[i])};
+        sio.savemat(os.path.join(ResultantFolder_Todo[i], 'Res_NFold.mat'), Res_NFold)
+
+def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Schedule_Flag=0, BLAS_Threads=1, Kernel_Flag=0, Seed=None, Checkpoint_Flag=0, Float32_Flag=0):
     #
     # Ridge regression with K-fold cross-validation
     # K-fold cross-validation is random, as the split of all subjects into K groups is random
@@ -138,6 +229,10 @@ def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range,
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
+    #     or a scipy.sparse CSR matrix (or the path of a .npz file of scipy.sparse.save_npz), which is MaxAbs scaled instead of
+    #     MinMax scaled, so the folds and the fits stay sparse, see Common_CZ_Sparse;
+    #     then Schedule_Flag and Kernel_Flag are not used
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Fold_Quantity:
@@ -153,8 +248,38 @@ def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range,
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Schedule_Flag:
+    #     1: schedule the fits of all the folds in Parallel_Quantity processes, see 'Ridge_KFold_Sort_Schedule'
+    #     0: the folds one by one (default)
+    # BLAS_Threads:
+    #     Only for Schedule_Flag = 1, quantity of BLAS threads of each process
+    # Kernel_Flag:
+    #     1: kernel (dual) ridge regression from the n*n Gram matrix of all the subjects, see 'Ridge_KFold_Sort_Kernel'
+    #        Faster when subjects are much fewer than features, e.g., connectivity data; Schedule_Flag is not used
+    #     0: linear_model.Ridge on the scaled data of each fold (default)
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'Ridge_KFold_Sort_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
+    # Checkpoint_Flag:
+    #     1: the selected parameters and the results of each finished outer fold are appended to ResultantFolder/Checkpoint.ckpt,
+    #        and a restarted run with the same data and setting skips these folds, see 'Checkpoint_Open' in Common_CZ_Checkpoint;
+    #        the checkpoint is removed when the run finishes (only for Schedule_Flag = 0 and Kernel_Flag = 0)
+    #     0: no checkpoint (default)
+    # Float32_Flag:
+    #     1: the data are converted to float32 and the scaling and fitting are in float32, half of the memory of float64,
+    #        see Common_CZ_Precision; 'Precision_Validate' compares the results with float64
+    #     0: the data as they are, generally float64 (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
+    Subjects_Data = Precision_Data(Subjects_Data, Float32_Flag)
+    if Kernel_Flag and not Sparse_Check(Subjects_Data):
+        return Ridge_KFold_Sort_Kernel(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Seed)
+    if Schedule_Flag and not Sparse_Check(Subjects_Data):
+        return Ridge_KFold_Sort_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, BLAS_Threads, Seed)
+
     if not os.path.exists(ResultantFolder):
             os.mkdir(ResultantFolder)
     Subjects_Quantity = len(Subjects_Score)
@@ -163,39 +288,44 @@ def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range,
     Subjects_Data = Subjects_Data[Sorted_Index, :]
     Subjects_Score = Subjects_Score[Sorted_Index]
 
-    EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    MaxSize = EachFold_Size * Fold_Quantity
-    EachFold_Max = np.ones(Fold_Quantity, np.int) * MaxSize
-    tmp = np.arange(Fold_Quantity - 1, -1, -1)
-    EachFold_Max = EachFold_Max - tmp;
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    for j in np.arange(Remain):
-        EachFold_Max[j] = EachFold_Max[j] + Fold_Quantity
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
+    if Checkpoint_Flag:
+        Checkpoint = Checkpoint_Open(ResultantFolder, {'Data': Checkpoint_Hash(Subjects_Data, Subjects_Score), 'Permutation_Flag': Permutation_Flag, 'Seed': Seed, \
+            'Fold_Quantity': Fold_Quantity, 'Alpha_Range': Alpha_Range})
     
     Fold_Corr = [];
     Fold_MAE = [];
 
     for j in np.arange(Fold_Quantity):
 
-        Fold_J_Index = np.arange(j, EachFold_Max[j], Fold_Quantity)
-        Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
+        Fold_J_Index = Fold_Index[j]
         Subjects_Score_test = Subjects_Score[Fold_J_Index]
-        Subjects_Data_train = np.delete(Subjects_Data, Fold_J_Index, axis=0)
         Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index) 
 
         if Permutation_Flag:
             # If doing permutation, the training scores should be permuted, while the testing scores remain
             Subjects_Index_Random = np.arange(len(Subjects_Score_train));
-            np.random.shuffle(Subjects_Index_Random);
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
             Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
             if j == 0:
                 RandIndex = {'Fold_0': Subjects_Index_Random}
             else:
                 RandIndex['Fold_' + str(j)] = Subjects_Index_Random
 
+        if Checkpoint_Flag and j in Checkpoint['Record']:
+            # The fold finished before the restart, its results are in Fold_<j>_Score.mat
+            Fold_Corr.append(Checkpoint['Record'][j]['Corr'])
+            Fold_MAE.append(Checkpoint['Record'][j]['MAE'])
+            continue
+
+        # The data are copied only for the folds to compute
+        Subjects_Data_test = Subjects_Data[Fold_J_Index, :]
+        Subjects_Data_train = Sparse_Delete(Subjects_Data, Fold_J_Index)
+
         Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(Subjects_Data_train, Subjects_Score_train, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity)
 
-        normalize = preprocessing.MinMaxScaler()
+        normalize = Sparse_Scaler(Subjects_Data_train)
         Subjects_Data_train = normalize.fit_transform(Subjects_Data_train)
         Subjects_Data_test = normalize.transform(Subjects_Data_test)
 
@@ -209,10 +339,12 @@ def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range,
         Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
         Fold_MAE.append(Fold_J_MAE)
     
-        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE}
+        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE, 'Alpha':Optimal_Alpha}
         Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
         ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
         sio.savemat(ResultantFile, Fold_J_result)
+        if Checkpoint_Flag:
+            Checkpoint_Append(Checkpoint, j, Fold_J_result)
 
     Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
     Mean_Corr = np.mean(Fold_Corr)
@@ -220,12 +352,366 @@ def Ridge_KFold_Sort(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range,
     Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
     ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
     sio.savemat(ResultantFile, Res_NFold)
+    if Checkpoint_Flag:
+        Checkpoint_Close(Checkpoint)
     return (Mean_Corr, Mean_MAE)
 
-def Ridge_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
+def Ridge_KFold_Sort_Schedule(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, BLAS_Threads=1, Seed=None):
+    #
+    # The same with 'Ridge_KFold_Sort', while the fits are scheduled in a pool of Parallel_Quantity processes, see 'Schedule_Run'
+    # The fits of all the (outer fold, inner fold) are one queue, all the alphas of an inner fold are evaluated from one decomposition
+    # (see 'Ridge_Path_Predict'), and then the fits of all the outer folds with their optimal alphas are another queue
+    # The splits and the permutation of the scores are the same with 'Ridge_KFold_Sort'
+    #
+    # BLAS_Threads:
+    #     Quantity of BLAS threads of each process, Parallel_Quantity * BLAS_Threads should not be larger than the quantity of cores
+    # Other variables are the same with function 'Ridge_KFold_Sort'
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+    Subjects_Quantity = len(Subjects_Score)
+    # The subjects are sorted by the scores, and the splits are the index of the subjects in Subjects_Data
+    Sorted_Index = np.argsort(Subjects_Score)
+    Subjects_Score = Subjects_Score[Sorted_Index]
+    Alpha_Quantity = len(Alpha_Range)
+
+    Random_Generator = Split_Generator(Seed)
+    Fold_Index = []
+    Training_Index = []
+    Training_Score = []
+    for j in np.arange(Fold_Quantity):
+        # The same folds with 'Ridge_KFold_Sort'
+        Fold_J_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index'][j]
+        Subjects_Score_train = np.delete(Subjects_Score, Fold_J_Index)
+        if Permutation_Flag:
+            # If doing permutation, the training scores should be permuted, while the testing scores remain
+            Subjects_Index_Random = np.arange(len(Subjects_Score_train))
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
+        Fold_Index.append(Fold_J_Index)
+        Training_Index.append(np.delete(Sorted_Index, Fold_J_Index))
+        Training_Score.append(Subjects_Score_train)
+
+    # Queue of the inner fits, with the same inner folds as 'Ridge_OptimalAlpha_KFold'
+    Task_Args = []
+    Inner_Score_test = []
+    for j in np.arange(Fold_Quantity):
+        Inner_Sorted_Index = np.argsort(Training_Score[j])
+        for k in np.arange(Fold_Quantity):
+            Inner_Fold_K_Position = Split_Fold(len(Inner_Sorted_Index), Fold_Quantity)['Test_Index'][k]
+            Inner_Fold_K_Index = Inner_Sorted_Index[Inner_Fold_K_Position]
+            Inner_Fold_K_Train_Index = np.delete(np.arange(len(Inner_Sorted_Index)), Inner_Fold_K_Index)
+            Inner_Score_test.append(Training_Score[j][Inner_Fold_K_Index])
+            Task_Args.append((Training_Index[j][Inner_Fold_K_Train_Index], Training_Index[j][Inner_Fold_K_Index], \
+                Training_Score[j][Inner_Fold_K_Train_Index], Ridge_Path_Predict, Alpha_Range))
+    Inner_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Optimal_Alpha = np.zeros(Fold_Quantity)
+    for j in np.arange(Fold_Quantity):
+        Inner_Corr = np.zeros((Fold_Quantity, Alpha_Quantity))
+        Inner_MAE_inv = np.zeros((Fold_Quantity, Alpha_Quantity))
+        for k in np.arange(Fold_Quantity):
+            Inner_Corr[k, :], Inner_MAE_inv[k, :] = Path_Evaluate(Inner_Results[j * Fold_Quantity + k], Inner_Score_test[j * Fold_Quantity + k])
+        Inner_Corr = np.nan_to_num(Inner_Corr)
+        Inner_Evaluation, Optimal_Alpha_Index = Score_Select(Inner_Corr, Inner_MAE_inv)
+        Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Evaluation':Inner_Evaluation}
+        sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
+        Optimal_Alpha[j] = Alpha_Range[Optimal_Alpha_Index]
+
+    # Queue of the outer fits
+    Task_Args = [(Training_Index[j], Sorted_Index[Fold_Index[j]], Training_Score[j], Ridge_Path_Predict, [Optimal_Alpha[j]]) for j in np.arange(Fold_Quantity)]
+    Outer_Results = Schedule_Run(Schedule_Fold, Subjects_Data, Task_Args, Parallel_Quantity, BLAS_Threads)
+
+    Fold_Corr = [];
+    Fold_MAE = [];
+    for j in np.arange(Fold_Quantity):
+        Subjects_Score_test = Subjects_Score[Fold_Index[j]]
+        Fold_J_Score = Outer_Results[j][:, 0]
+        Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
+        Fold_J_Corr = Fold_J_Corr[0,1]
+        Fold_Corr.append(Fold_J_Corr)
+        Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
+        Fold_MAE.append(Fold_J_MAE)
+
+        Fold_J_result = {'Index':Fold_Index[j], 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE, 'Alpha':Optimal_Alpha[j]}
+        Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
+        ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
+        sio.savemat(ResultantFile, Fold_J_result)
+
+    Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
+    Mean_Corr = np.mean(Fold_Corr)
+    Mean_MAE = np.mean(Fold_MAE)
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def Ridge_KFold_Sort_Kernel(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Seed=None):
+    #
+    # The same with 'Ridge_KFold_Sort', while ridge regression is solved in the dual form, from the Gram matrix K = X * X'
+    # The Gram matrices of the scaled data of all the outer folds and all their inner folds come from one pass over the features
+    # (see 'Kernel_Nested' in Common_CZ_Kernel), the training and testing blocks of each fold are taken from them by index,
+    # and all the alphas of an inner fold come from one eigendecomposition (see 'Ridge_OptimalAlpha_KFold')
+    # The predictions are the same with linear_model.Ridge up to rounding errors; the weights are not computed, see 'Ridge_Weight'
+    #
+    # Variables are the same with function 'Ridge_KFold_Sort'
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+    Subjects_Quantity = len(Subjects_Score)
+    # Sort the subjects score
+    # The data are not sorted, the Gram matrices are in the sorted order (see 'Kernel_Nested'), so the data are read only block by block
+    Sorted_Index = np.argsort(Subjects_Score)
+    Subjects_Score = Subjects_Score[Sorted_Index]
+
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
+
+    # The training scores of each fold, and the inner folds of 'Ridge_OptimalAlpha_KFold' which are split by the (permuted) training scores
+    Training_Score = []
+    Inner_Fold_Index = []
+    for j in np.arange(Fold_Quantity):
+        Subjects_Score_train = np.delete(Subjects_Score, Fold_Index[j])
+        if Permutation_Flag:
+            # If doing permutation, the training scores should be permuted, while the testing scores remain
+            Subjects_Index_Random = np.arange(len(Subjects_Score_train));
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
+            if j == 0:
+                RandIndex = {'Fold_0': Subjects_Index_Random}
+            else:
+                RandIndex['Fold_' + str(j)] = Subjects_Index_Random
+        Training_Score.append(Subjects_Score_train)
+        Inner_Sorted_Index = np.argsort(Subjects_Score_train)
+        Inner_Fold_Index.append([Inner_Sorted_Index[Inner_Fold_K_Position] for Inner_Fold_K_Position in \
+            Split_Fold(len(Subjects_Score_train), Fold_Quantity)['Test_Index']])
+    Kernel = Kernel_Nested(Subjects_Data, Fold_Index, Inner_Fold_Index, Sorted_Index)
+
+    Fold_Corr = [];
+    Fold_MAE = [];
+
+    for j in np.arange(Fold_Quantity):
+
+        Fold_J_Index = Fold_Index[j]
+        Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_J_Index)
+        Subjects_Score_test = Subjects_Score[Fold_J_Index]
+        Subjects_Score_train = Training_Score[j]
+
+        Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(None, Subjects_Score_train, Fold_Quantity, Alpha_Range, \
+            ResultantFolder, Parallel_Quantity, Inner_Kernel={'Gram': Kernel['Inner_Gram'][j]})
+
+        # Gram matrix with the range of the training subjects of this fold
+        Gram = Kernel['Gram'][j]
+        Fold_J_Score = Ridge_Kernel_Path_Predict(Gram[np.ix_(Training_Index, Training_Index)], Gram[np.ix_(Fold_J_Index, Training_Index)], \
+            Subjects_Score_train, [Optimal_Alpha])[:, 0]
+
+        Fold_J_Corr = np.corrcoef(Fold_J_Score, Subjects_Score_test)
+        Fold_J_Corr = Fold_J_Corr[0,1]
+        Fold_Corr.append(Fold_J_Corr)
+        Fold_J_MAE = np.mean(np.abs(np.subtract(Fold_J_Score,Subjects_Score_test)))
+        Fold_MAE.append(Fold_J_MAE)
+
+        Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test, 'Predict_Score':Fold_J_Score, 'Corr':Fold_J_Corr, 'MAE':Fold_J_MAE, 'Alpha':Optimal_Alpha}
+        Fold_J_FileName = 'Fold_' + str(j) + '_Score.mat'
+        ResultantFile = os.path.join(ResultantFolder, Fold_J_FileName)
+        sio.savemat(ResultantFile, Fold_J_result)
+
+    Fold_Corr = [0 if np.isnan(x) else x for x in Fold_Corr]
+    Mean_Corr = np.mean(Fold_Corr)
+    Mean_MAE = np.mean(Fold_MAE)
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def Ridge_KFold_Sort_MultiTarget(Subjects_Data, Subjects_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Layout_Score=None, Seed=None):
+    #
+    # Ridge regression with sorted K-fold cross-validation for many scores (targets) of the same subjects in one run
+    # The optimal alpha is selected for each target, and the results of the t-th target are in ResultantFolder/Target_t,
+    # the same files with 'Ridge_KFold_Sort'; the mean correlation and MAE of all the targets are in ResultantFolder/Res_NFold_MultiTarget.mat
+    # Ridge regression is solved in the dual form, see 'Ridge_KFold_Sort_Kernel'
+    #
+    # Subjects_Data:
+    #     n*m matrix, n is subjects quantity, m is features quantity
+    # Subjects_Score:
+    #     n*T matrix, T is targets quantity
+    # Layout_Score:
+    #     How the subjects are sorted into the folds, as the sorted folds depend on the scores
+    #     None: the folds of each target are from its own scores, the same with 'Ridge_KFold_Sort' for each target (default)
+    #           The folds differ between the targets, so only the code is shared, and the data are read once for each target
+    #     n*1 vector: the folds of all the targets are from the sorting of this vector, e.g., Subjects_Score[:, 0] or a composite score
+    #           The scaling, the Gram matrices of all the folds and their eigendecompositions are shared by all the targets,
+    #           and the data are read once; for permutation, the subjects of the training scores (and of Layout_Score) are permuted
+    #           together for all the targets
+    # Other variables are the same with function 'Ridge_KFold_Sort'
+    #
+    # Return:
+    #     Mean_Corr, T*1 vector
+    #     Mean_MAE, T*1 vector
+    # Seed:
+    #     See 'Ridge_KFold_Sort'; with Layout_Score = None, the t-th target is permuted with Split_Seed(Seed, t)
+    #
+
+    if not os.path.exists(ResultantFolder):
+            os.mkdir(ResultantFolder)
+    Target_Quantity = np.shape(Subjects_Score)[1]
+    if Layout_Score is None:
+        Target_Results = [Ridge_KFold_Sort_Target(Subjects_Data, Subjects_Score[:, [t]], Subjects_Score[:, t], Fold_Quantity, \
+            Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, [t], Split_Seed(Seed, t)) \
+            for t in np.arange(Target_Quantity)]
+        Mean_Corr = np.concatenate([Target_Result[0] for Target_Result in Target_Results])
+        Mean_MAE = np.concatenate([Target_Result[1] for Target_Result in Target_Results])
+    else:
+        Mean_Corr, Mean_MAE = Ridge_KFold_Sort_Target(Subjects_Data, Subjects_Score, Layout_Score, Fold_Quantity, Alpha_Range, \
+            ResultantFolder, Parallel_Quantity, Permutation_Flag, np.arange(Target_Quantity), Seed)
+
+    Res_NFold = {'Mean_Corr':Mean_Corr, 'Mean_MAE':Mean_MAE};
+    ResultantFile = os.path.join(ResultantFolder, 'Res_NFold_MultiTarget.mat')
+    sio.savemat(ResultantFile, Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def Ridge_KFold_Sort_Target(Subjects_Data, Subjects_Score, Layout_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Permutation_Flag, Target_ID, Seed=None):
+    #
+    # Sub-function of 'Ridge_KFold_Sort_MultiTarget', the targets of Subjects_Score share the folds from the sorting of Layout_Score
+    # The outer and inner folds are the same with 'Ridge_KFold_Sort' with Layout_Score as the scores
+    #
+    # Subjects_Score:
+    #     n*T matrix
+    # Target_ID:
+    #     T*1 vector, the results of the t-th column are in ResultantFolder/Target_<Target_ID[t]>
+    # Other variables are the same with function 'Ridge_KFold_Sort_MultiTarget'
+    #
+
+    Subjects_Quantity, Target_Quantity = np.shape(Subjects_Score)
+    ResultantFolder_Target = [os.path.join(ResultantFolder, 'Target_' + str(Target_ID[t])) for t in np.arange(Target_Quantity)]
+    for ResultantFolder_T in ResultantFolder_Target:
+        if not os.path.exists(ResultantFolder_T):
+            os.mkdir(ResultantFolder_T)
+    # Sort the subjects by Layout_Score, the data are taken in this order by 'Kernel_Nested' without a sorted copy
+    Sorted_Index = np.argsort(Layout_Score)
+    Subjects_Score = Subjects_Score[Sorted_Index]
+    Layout_Score = Layout_Score[Sorted_Index]
+
+    Fold_Index = Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']
+    Random_Generator = Split_Generator(Seed)
+
+    Training_Score = []
+    Inner_Fold_Index = []
+    for j in np.arange(Fold_Quantity):
+        Subjects_Score_train = np.delete(Subjects_Score, Fold_Index[j], axis=0)
+        Layout_Score_train = np.delete(Layout_Score, Fold_Index[j])
+        if Permutation_Flag:
+            # If doing permutation, the training scores should be permuted, while the testing scores remain
+            Subjects_Index_Random = np.arange(len(Layout_Score_train));
+            Split_Shuffle(Subjects_Index_Random, Random_Generator)
+            Subjects_Score_train = Subjects_Score_train[Subjects_Index_Random]
+            Layout_Score_train = Layout_Score_train[Subjects_Index_Random]
+        Training_Score.append(Subjects_Score_train)
+        Inner_Sorted_Index = np.argsort(Layout_Score_train)
+        Inner_Fold_Index.append([Inner_Sorted_Index[Inner_Fold_K_Position] for Inner_Fold_K_Position in \
+            Split_Fold(len(Layout_Score_train), Fold_Quantity)['Test_Index']])
+    Kernel = Kernel_Nested(Subjects_Data, Fold_Index, Inner_Fold_Index, Sorted_Index)
+
+    Fold_Corr = np.zeros((Fold_Quantity, Target_Quantity))
+    Fold_MAE = np.zeros((Fold_Quantity, Target_Quantity))
+    for j in np.arange(Fold_Quantity):
+
+        Fold_J_Index = Fold_Index[j]
+        Training_Index = np.delete(np.arange(Subjects_Quantity), Fold_J_Index)
+        Subjects_Score_test = Subjects_Score[Fold_J_Index]
+
+        Optimal_Alpha = Ridge_OptimalAlpha_KFold_MultiTarget(Training_Score[j], Fold_Quantity, Alpha_Range, ResultantFolder, \
+            {'Test_Index': Inner_Fold_Index[j], 'Gram': Kernel['Inner_Gram'][j]})
+
+        # All the targets from one eigendecomposition, each with its optimal alpha
+        Gram = Kernel['Gram'][j]
+        Fold_J_Score = Ridge_Kernel_Batch_Predict(Gram[np.ix_(Training_Index, Training_Index)], Gram[np.ix_(Fold_J_Index, Training_Index)], \
+            Training_Score[j], Optimal_Alpha)[0]
+
+        for t in np.arange(Target_Quantity):
+            Fold_Corr[j, t] = np.corrcoef(Fold_J_Score[:, t], Subjects_Score_test[:, t])[0, 1]
+            Fold_MAE[j, t] = np.mean(np.abs(np.subtract(Fold_J_Score[:, t], Subjects_Score_test[:, t])))
+            Fold_J_result = {'Index':Fold_J_Index, 'Test_Score':Subjects_Score_test[:, t], 'Predict_Score':Fold_J_Score[:, t], \
+                'Corr':Fold_Corr[j, t], 'MAE':Fold_MAE[j, t], 'Alpha':Optimal_Alpha[t]}
+            sio.savemat(os.path.join(ResultantFolder_Target[t], 'Fold_' + str(j) + '_Score.mat'), Fold_J_result)
+
+    Fold_Corr = np.nan_to_num(Fold_Corr)
+    Mean_Corr = np.mean(Fold_Corr, axis=0)
+    Mean_MAE = np.mean(Fold_MAE, axis=0)
+    for t in np.arange(Target_Quantity):
+        Res_NFold = {'Mean_Corr':Mean_Corr[t], 'Mean_MAE':Mean_MAE[t]};
+        sio.savemat(os.path.join(ResultantFolder_Target[t], 'Res_NFold.mat'), Res_NFold)
+    return (Mean_Corr, Mean_MAE)
+
+def Ridge_OptimalAlpha_KFold_MultiTarget(Training_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Inner_Kernel):
+    #
+    # Select the optimal alpha of each target with the nested cross-validation, the same criterion with 'Ridge_OptimalAlpha_KFold'
+    # All the targets and all the alphas of an inner fold come from one eigendecomposition, see 'Ridge_Kernel_MultiTarget_Predict'
+    #
+    # Training_Score:
+    #     n*T matrix, T is targets quantity
+    # Inner_Kernel:
+    #     dict with 'Test_Index', the testing index of each inner fold, and 'Gram', the Gram matrix of the training subjects scaled by the range
+    #     of the training subjects of each inner fold, e.g., from 'Kernel_Nested' in Common_CZ_Kernel
+    # Other variables are the same with function 'Ridge_OptimalAlpha_KFold'
+    #
+    # Return:
+    #     Optimal_Alpha, T*1 vector
+    #
+
+    Subjects_Quantity = np.shape(Training_Score)[0]
+    Inner_Corr = np.zeros((Fold_Quantity, len(Alpha_Range), np.shape(Training_Score)[1]))
+    Inner_MAE_inv = np.zeros((Fold_Quantity, len(Alpha_Range), np.shape(Training_Score)[1]))
+    for k in np.arange(Fold_Quantity):
+
+        Inner_Fold_K_Index = Inner_Kernel['Test_Index'][k]
+        Inner_Fold_K_Train_Index = np.delete(np.arange(Subjects_Quantity), Inner_Fold_K_Index)
+        Inner_Fold_K_Score_test = Training_Score[Inner_Fold_K_Index]
+        Gram = Inner_Kernel['Gram'][k]
+        Predict_Score = Ridge_Kernel_MultiTarget_Predict(Gram[np.ix_(Inner_Fold_K_Train_Index, Inner_Fold_K_Train_Index)], \
+            Gram[np.ix_(Inner_Fold_K_Index, Inner_Fold_K_Train_Index)], Training_Score[Inner_Fold_K_Train_Index], Alpha_Range)
+
+        # Correlation and inverse MAE of all the alphas and targets
+        Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Inner_Fold_K_Score_test)
+        Inner_Corr[k] = Fold_Corr
+        Inner_MAE_inv[k] = Fold_MAE_inv
+    Inner_Corr = np.nan_to_num(Inner_Corr)
+    Inner_Evaluation, Optimal_Alpha_Index = Score_Select(Inner_Corr, Inner_MAE_inv)
+
+    Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Evaluation':Inner_Evaluation}
+    sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
+
+    Optimal_Alpha = np.asarray(Alpha_Range)[Optimal_Alpha_Index]
+    return Optimal_Alpha
+
+def Ridge_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Batch_Flag=0, Observed_Corr=None, P_Threshold=0.05, Error_Rate=0.01, Seed=None, Kernel_Flag=0):
     #
     # Permutation test for 'Ridge_APredictB'
     #
+    # Batch_Flag:
+    #     1: run all the permutations together, see 'Ridge_APredictB_Permutation_Batch'
+    #     0: run 'Ridge_APredictB' for each permutation one by one (default)
+    # Observed_Corr, P_Threshold, Error_Rate:
+    #     Optional, Predict_Corr of 'Ridge_APredictB' without permutation; if given, the permutations stop once p < P_Threshold or
+    #     p > P_Threshold is decided, see 'Permutation_Adaptive' in Common_CZ_Permutation, the summary is in ResultantFolder/Res_Adaptive.mat
+    # Seed:
+    #     None: the permutations are drawn from the random state of numpy (default)
+    #     An integer: the i-th permutation is drawn from its own stream, Split_Seed(Seed, i), so the results do not depend on
+    #     the processes or computers the permutations run on, see 'Split_Generator' in Common_CZ_Split
+    # Kernel_Flag:
+    #     Only for Batch_Flag = 0, see 'Ridge_APredictB'
+    #
+    if Observed_Corr is not None:
+        # The permutations are run in waves until the p-value is decided
+        Run_Function = functools.partial(Ridge_APredictB_Permutation, Training_Data=Training_Data, Training_Score=Training_Score, \
+            Testing_Data=Testing_Data, Testing_Score=Testing_Score, Alpha_Range=Alpha_Range, Nested_Fold_Quantity=Nested_Fold_Quantity, \
+            ResultantFolder=ResultantFolder, Parallel_Quantity=Parallel_Quantity, Batch_Flag=Batch_Flag, Seed=Seed, Kernel_Flag=Kernel_Flag)
+        return Permutation_Adaptive(Run_Function, Times_IDRange, ResultantFolder, Observed_Corr, 'APredictB.mat', 'Predict_Corr', P_Threshold, Error_Rate)
+    if Batch_Flag:
+        Ridge_APredictB_Permutation_Batch(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Seed)
+        return
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
     for i in np.arange(len(Times_IDRange)):
@@ -233,14 +719,71 @@ def Ridge_APredictB_Permutation(Training_Data, Training_Score, Testing_Data, Tes
         if not os.path.exists(ResultantFolder_I):
             os.mkdir(ResultantFolder_I)
         if not os.path.exists(ResultantFolder_I + '/APredictB.mat'):
-            Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder_I, Parallel_Quantity, 1)
+            Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder_I, Parallel_Quantity, 1, Split_Seed(Seed, Times_IDRange[i]), Kernel_Flag)
 
-def Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Permutation_Flag):
+def Ridge_APredictB_Permutation_Batch(Training_Data, Training_Score, Testing_Data, Testing_Score, Times_IDRange, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Seed=None):
+    #
+    # Permutation test of 'Ridge_APredictB' with all the permutations together
+    # The Gram matrix of the scaled data is computed once and shared by the inner cross-validation of all the permutations,
+    # and the models of all the permutations are fitted as one multi-target problem, see 'Ridge_KFold_Sort_Permutation_Batch'
+    # The results of each permutation are the same with 'Ridge_APredictB' with Permutation_Flag = 1
+    # Other variables are the same with function 'Ridge_APredictB_Permutation'
+    #
+
+    if not os.path.exists(ResultantFolder):
+        os.mkdir(ResultantFolder)
+    ResultantFolder_Todo = []
+    Times_Todo = []
+    for i in np.arange(len(Times_IDRange)):
+        ResultantFolder_I = ResultantFolder + '/Time_' + str(Times_IDRange[i])
+        if not os.path.exists(ResultantFolder_I):
+            os.mkdir(ResultantFolder_I)
+        if not os.path.exists(ResultantFolder_I + '/APredictB.mat'):
+            ResultantFolder_Todo.append(ResultantFolder_I)
+            Times_Todo.append(Times_IDRange[i])
+    Permutation_Quantity = len(ResultantFolder_Todo)
+    if not Permutation_Quantity:
+        return
+
+    # The training scores of each permutation are permuted in the same order as 'Ridge_APredictB'
+    Training_Score_Random = np.zeros((len(Training_Score), Permutation_Quantity))
+    for i in np.arange(Permutation_Quantity):
+        Training_Index_Random = np.arange(len(Training_Score))
+        Split_Shuffle(Training_Index_Random, Split_Generator(Split_Seed(Seed, Times_Todo[i])))
+        Training_Score_Random[:, i] = Training_Score[Training_Index_Random]
+        Random_Index = {'Training_Index_Random': Training_Index_Random}
+        sio.savemat(ResultantFolder_Todo[i] + '/Random_Index.mat', Random_Index);
+
+    # Gram matrix of the training and testing data, scaled by the range of the training data
+    Training_Quantity = len(Training_Score)
+    Data_Min = np.min(Training_Data, axis=0)
+    Data_Range = Scale_Handle_Zeros(np.max(Training_Data, axis=0) - Data_Min)
+    Shift = np.mean(Training_Data, axis=0)
+    Gram = Scale_Gram(np.vstack((Training_Data, Testing_Data)), Shift, 1 / Data_Range ** 2)
+    Training_Gram = Gram[:Training_Quantity, :Training_Quantity]
+
+    Alpha_Results = Parallel(n_jobs=Parallel_Quantity, backend="threading")(delayed(Ridge_OptimalAlpha_KFold)(Training_Data, \
+        Training_Score_Random[:, i], Nested_Fold_Quantity, Alpha_Range, ResultantFolder_Todo[i], 1, Training_Gram=Training_Gram, Shift=Shift) \
+        for i in np.arange(Permutation_Quantity))
+    Optimal_Alpha = np.array([Alpha_Results[i][0] for i in np.arange(Permutation_Quantity)])
+
+    Predict_Score, Dual_Coef = Ridge_Kernel_Batch_Predict(Training_Gram, Gram[Training_Quantity:, :Training_Quantity], Training_Score_Random, Optimal_Alpha)
+    # Weights of the scaled data
+    Weight = np.dot(Dual_Coef.T, Training_Data - Shift) / Data_Range[np.newaxis, :]
+    for i in np.arange(Permutation_Quantity):
+        Predict_Corr = np.corrcoef(Predict_Score[:, i], Testing_Score)[0, 1]
+        Predict_MAE = np.mean(np.abs(np.subtract(Predict_Score[:, i], Testing_Score)))
+        Predict_result = {'Test_Score':Testing_Score, 'Predict_Score':Predict_Score[:, i], 'Weight':Weight[i], 'Predict_Corr':Predict_Corr, 'Predict_MAE':Predict_MAE, 'alpha':Optimal_Alpha[i]}
+        sio.savemat(ResultantFolder_Todo[i] + '/APredictB.mat', Predict_result)
+
+def Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Permutation_Flag, Seed=None, Kernel_Flag=0, Block_Size=4096, Float32_Flag=0):
     #
     # Ridge regression with training data to predict testing data
     #
     # Training_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     Training_Data and Testing_Data can also be the paths of .npy or HDF5 files, which are memory-mapped, see 'Data_Open' in Common_CZ_Data
+    #     or scipy.sparse CSR matrices, which are MaxAbs scaled instead of MinMax scaled, see Common_CZ_Sparse, then Kernel_Flag is not used
     # Training_Score:
     #     n*1 vector, n is subjects quantity
     # Testing_Data:
@@ -260,8 +803,28 @@ def Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score,
     # Permutation_Flag:
     #     1: this is for permutation, then the socres will be permuted
     #     0: this is not for permutation
+    # Seed:
+    #     Only for Permutation_Flag = 1
+    #     None: the scores are permuted with the random state of numpy (default)
+    #     An integer, or a tuple from 'Split_Seed': the scores are permuted with Split_Generator(Seed), see 'Split_Generator' in Common_CZ_Split;
+    #     the i-th permutation of 'Ridge_APredictB_Permutation' with Seed = S is recomputed with Seed = Split_Seed(S, i)
+    # Kernel_Flag:
+    #     1: the alpha is selected from the Gram matrices of the training data (see 'Kernel_Nested' in Common_CZ_Kernel), and the weights
+    #        and predictions come from the dual coefficients (see 'Ridge_Kernel_Weight' and 'Ridge_Weight_Predict'), reading the features
+    #        block by block, so the memory is bounded by n*n and n*Block_Size, not by n*m; the data can be memory-mapped
+    #     0: linear_model.Ridge on the scaled data (default)
+    # Block_Size:
+    #     Only for Kernel_Flag = 1, quantity of features read at a time
+    # Float32_Flag:
+    #     1: the data are converted to float32 and the scaling and fitting are in float32, half of the memory of float64,
+    #        see Common_CZ_Precision; 'Precision_Validate' compares the results with float64
+    #     0: the data as they are, generally float64 (default)
     #
     
+    Training_Data = Data_Open(Training_Data)
+    Testing_Data = Data_Open(Testing_Data)
+    Training_Data = Precision_Data(Training_Data, Float32_Flag)
+    Testing_Data = Precision_Data(Testing_Data, Float32_Flag)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
 
@@ -269,30 +832,42 @@ def Ridge_APredictB(Training_Data, Training_Score, Testing_Data, Testing_Score,
         # If do permutation, the training scores should be permuted, while the testing scores remain
         # Fold12
         Training_Index_Random = np.arange(len(Training_Score))
-        np.random.shuffle(Training_Index_Random)
+        Split_Shuffle(Training_Index_Random, Split_Generator(Seed))
         Training_Score = Training_Score[Training_Index_Random]
         Random_Index = {'Training_Index_Random': Training_Index_Random}
         sio.savemat(ResultantFolder + '/Random_Index.mat', Random_Index);
 
-    # Select optimal alpha using inner fold cross validation
-    Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Nested_Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity)
+    if Kernel_Flag and not Sparse_Check(Training_Data):
+        # The Gram matrices of the training subjects and of the inner folds from one pass, see 'Kernel_Nested' in Common_CZ_Kernel
+        Sorted_Index = np.argsort(Training_Score)
+        Inner_Fold_Index = [Sorted_Index[Inner_Fold_K_Position] for Inner_Fold_K_Position in \
+            Split_Fold(len(Training_Score), Nested_Fold_Quantity)['Test_Index']]
+        Kernel = Kernel_Nested(Training_Data, [np.array([], dtype=int)], [Inner_Fold_Index], Block_Size=Block_Size)
+        Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(None, Training_Score, Nested_Fold_Quantity, Alpha_Range, \
+            ResultantFolder, Parallel_Quantity, Inner_Kernel={'Gram': Kernel['Inner_Gram'][0]})
+        Coef = Ridge_Kernel_Weight(Training_Data, Training_Score, Kernel['Kernel'], Kernel['Shift'], Kernel['Data_Range'], Optimal_Alpha, Block_Size)
+        Predict_Score = Ridge_Weight_Predict(Testing_Data, Training_Score, Coef, Kernel['Shift'], Kernel['Data_Range'], Block_Size)
+    else:
+        # Select optimal alpha using inner fold cross validation
+        Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Nested_Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity)
 
-    Scale = preprocessing.MinMaxScaler()
-    Training_Data = Scale.fit_transform(Training_Data)
-    Testing_Data = Scale.transform(Testing_Data)  
+        Scale = Sparse_Scaler(Training_Data)
+        Training_Data = Scale.fit_transform(Training_Data)
+        Testing_Data = Scale.transform(Testing_Data)  
     
-    clf = linear_model.Ridge(alpha=Optimal_Alpha)
-    clf.fit(Training_Data, Training_Score)
-    Predict_Score = clf.predict(Testing_Data)
+        clf = linear_model.Ridge(alpha=Optimal_Alpha)
+        clf.fit(Training_Data, Training_Score)
+        Predict_Score = clf.predict(Testing_Data)
+        Coef = clf.coef_
 
     Predict_Corr = np.corrcoef(Predict_Score, Testing_Score)
     Predict_Corr = Predict_Corr[0,1]
     Predict_MAE = np.mean(np.abs(np.subtract(Predict_Score, Testing_Score)))
-    Predict_result = {'Test_Score':Testing_Score, 'Predict_Score':Predict_Score, 'Weight':clf.coef_, 'Predict_Corr':Predict_Corr, 'Predict_MAE':Predict_MAE, 'alpha':Optimal_Alpha}
+    Predict_result = {'Test_Score':Testing_Score, 'Predict_Score':Predict_Score, 'Weight':Coef, 'Predict_Corr':Predict_Corr, 'Predict_MAE':Predict_MAE, 'alpha':Optimal_Alpha}
     sio.savemat(ResultantFolder+'/APredictB.mat', Predict_result)
     return (Predict_Corr, Predict_MAE)  
 
-def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity):
+def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity, Debug_Flag=0, Path_Flag=1, Training_Gram=None, Shift=None, Inner_Kernel=None):
     #
     # Select optimal regularization parameter using nested cross-validation
     #
@@ -310,62 +885,97 @@ def Ridge_OptimalAlpha_KFold(Training_Data, Training_Score, Fold_Quantity, Alpha
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Debug_Flag:
+    #     1: also write the result of each parameter into ResultantFolder as a .mat file, for debugging
+    #     0: keep the results of each parameter in memory only (default)
+    # Path_Flag:
+    #     1: evaluate all the alphas from one decomposition of the inner training data, see 'Ridge_Path_Predict' (default)
+    #        If subjects are fewer than features, the Gram matrix of each fold is computed with the MinMax range of its training data
+    #        (see 'Scale_Fold_Range' and 'Scale_Gram'), without a scaled copy of the data
+    #     0: fit linear_model.Ridge separately for each alpha, in parallel
+    # Training_Gram:
+    #     Optional, 'Scale_Gram' of Training_Data with Shift and the MinMax range of all of Training_Data,
+    #     e.g., computed once for all the permutations, see 'Ridge_KFold_Sort_Permutation_Batch'
+    #     The Gram matrix of each fold is this one corrected on the features whose range changes
+    #     If not given, it is computed here when subjects are fewer than features
+    # Shift:
+    #     m*1 vector, the shift of each feature used in Training_Gram
+    # Inner_Kernel:
+    #     Optional, dict with 'Gram', the list of the Gram matrices of the training subjects scaled by the range of the training subjects
+    #     of each inner fold, in the order of the inner folds, e.g., 'Inner_Gram' of 'Kernel_Nested' in Common_CZ_Kernel
+    #     Then Training_Data is not used and can be None
     #
     
     Subjects_Quantity = len(Training_Score)
+    # The subjects are sorted by the scores, and the folds are the index of the subjects in the original order
     Sorted_Index = np.argsort(Training_Score)
-    Training_Data = Training_Data[Sorted_Index, :]
-    Training_Score = Training_Score[Sorted_Index]
     
-    Inner_EachFold_Size = np.int(np.fix(np.divide(Subjects_Quantity, Fold_Quantity)))
-    MaxSize = Inner_EachFold_Size * Fold_Quantity
-    EachFold_Max = np.ones(Fold_Quantity, np.int) * MaxSize
-    tmp = np.arange(Fold_Quantity - 1, -1, -1)
-    EachFold_Max = EachFold_Max - tmp
-    Remain = np.mod(Subjects_Quantity, Fold_Quantity)
-    for j in np.arange(Remain):
-    	EachFold_Max[j] = EachFold_Max[j] + Fold_Quantity
+    Inner_Fold_Index = [Sorted_Index[Inner_Fold_K_Position] for Inner_Fold_K_Position in Split_Fold(Subjects_Quantity, Fold_Quantity)['Test_Index']]
     
     Inner_Corr = np.zeros((Fold_Quantity, len(Alpha_Range)))
     Inner_MAE_inv = np.zeros((Fold_Quantity, len(Alpha_Range)))
     Alpha_Quantity = len(Alpha_Range)
+    Gram_Flag = Path_Flag and (Inner_Kernel is not None or Training_Gram is not None or Subjects_Quantity < np.shape(Training_Data)[1])
+    # The MinMax range is not used for sparse data, whose folds are taken and MaxAbs scaled by 'Fold_Data'
+    Gram_Flag = Gram_Flag and not Sparse_Check(Training_Data)
+    if Inner_Kernel is not None:
+        # The Gram matrices of the inner folds are given
+        pass
+    elif Gram_Flag:
+        # MinMax range of all the training data and of the training data of all the inner folds
+        Data_Range = Scale_Handle_Zeros(np.max(Training_Data, axis=0) - np.min(Training_Data, axis=0))
+        Fold_Range = Scale_Fold_Range(Training_Data, Inner_Fold_Index)[1]
+        if Training_Gram is None:
+            Shift = np.mean(Training_Data, axis=0)
+            Training_Gram = Scale_Gram(Training_Data, Shift, 1 / Data_Range ** 2)
+    else:
+        # The data of each inner fold are taken by index into one buffer, see 'Fold_Data' in Common_CZ_Fold
+        Fold_Data_Buffer = Fold_Buffer(Training_Data)
     for k in np.arange(Fold_Quantity):
         
-        Inner_Fold_K_Index = np.arange(k, EachFold_Max[k], Fold_Quantity)
-        Inner_Fold_K_Data_test = Training_Data[Inner_Fold_K_Index, :]
+        Inner_Fold_K_Index = Inner_Fold_Index[k]
         Inner_Fold_K_Score_test = Training_Score[Inner_Fold_K_Index]
-        Inner_Fold_K_Data_train = np.delete(Training_Data, Inner_Fold_K_Index, axis=0)
         Inner_Fold_K_Score_train = np.delete(Training_Score, Inner_Fold_K_Index)
+
+        if Gram_Flag:
+            # The same with the scaled data, without copying the data of this fold
+            Inner_Fold_K_Train_Index = np.delete(np.arange(Subjects_Quantity), Inner_Fold_K_Index)
+            if Inner_Kernel is not None:
+                Gram = Inner_Kernel['Gram'][k]
+            else:
+                # The range changes only for the features with the min or max in this fold
+                Changed_Index = np.nonzero(Fold_Range[k] != Data_Range)[0]
+                Gram = Training_Gram + Scale_Gram(Training_Data[:, Changed_Index], Shift[Changed_Index], \
+                    1 / Fold_Range[k, Changed_Index] ** 2 - 1 / Data_Range[Changed_Index] ** 2)
+            Predict_Score = Ridge_Kernel_Path_Predict(Gram[np.ix_(Inner_Fold_K_Train_Index, Inner_Fold_K_Train_Index)], \
+                Gram[np.ix_(Inner_Fold_K_Index, Inner_Fold_K_Train_Index)], Inner_Fold_K_Score_train, Alpha_Range)
+        else:
+            Inner_Fold_K_Data_train, Inner_Fold_K_Data_test = Fold_Data(Training_Data, Inner_Fold_K_Index, Fold_Data_Buffer)
+            if Path_Flag:
+                Predict_Score = Ridge_Path_Predict(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Alpha_Range)
         
-        Scale = preprocessing.MinMaxScaler()
-        Inner_Fold_K_Data_train = Scale.fit_transform(Inner_Fold_K_Data_train)
-        Inner_Fold_K_Data_test = Scale.transform(Inner_Fold_K_Data_test)    
-        
-        Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Ridge_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder) for l in np.arange(len(Alpha_Range)))        
-        
-        for l in np.arange(Alpha_Quantity):
-            print(l)
-            Fold_l_Mat_Path = ResultantFolder + '/Alpha_' + str(l) + '.mat';
-            Fold_l_Mat = sio.loadmat(Fold_l_Mat_Path)
-            Inner_Corr[k, l] = Fold_l_Mat['Corr'][0][0]
-            Inner_MAE_inv[k, l] = Fold_l_Mat['MAE_inv']
-            os.remove(Fold_l_Mat_Path)
+        if Path_Flag:
+            # All the alphas are evaluated from one decomposition of the inner training data
+            Inner_Corr[k, :], Inner_MAE_inv[k, :] = Path_Evaluate(Predict_Score, Inner_Fold_K_Score_test)
+            if Debug_Flag:
+                for l in np.arange(Alpha_Quantity):
+                    Fold_result = {'Corr': Inner_Corr[k, l], 'MAE_inv':Inner_MAE_inv[k, l]}
+                    sio.savemat(ResultantFolder + '/Alpha_' + str(l) + '.mat', Fold_result)
+        else:
+            Alpha_Results = Parallel(n_jobs=Parallel_Quantity,backend="threading")(delayed(Ridge_SubAlpha)(Inner_Fold_K_Data_train, Inner_Fold_K_Score_train, Inner_Fold_K_Data_test, Inner_Fold_K_Score_test, Alpha_Range[l], l, ResultantFolder, Debug_Flag) for l in np.arange(len(Alpha_Range)))
+            for l in np.arange(Alpha_Quantity):
+                Inner_Corr[k, l], Inner_MAE_inv[k, l] = Alpha_Results[l]
             
         Inner_Corr = np.nan_to_num(Inner_Corr)
-    Inner_Corr_Mean = np.mean(Inner_Corr, axis=0)
-    Inner_Corr_Mean = (Inner_Corr_Mean - np.mean(Inner_Corr_Mean)) / np.std(Inner_Corr_Mean)
-    Inner_MAE_inv_Mean = np.mean(Inner_MAE_inv, axis=0)
-    Inner_MAE_inv_Mean = (Inner_MAE_inv_Mean - np.mean(Inner_MAE_inv_Mean)) / np.std(Inner_MAE_inv_Mean)
-    Inner_Evaluation = Inner_Corr_Mean + Inner_MAE_inv_Mean
+    Inner_Evaluation, Optimal_Alpha_Index = Score_Select(Inner_Corr, Inner_MAE_inv)
     
     Inner_Evaluation_Mat = {'Inner_Corr':Inner_Corr, 'Inner_MAE_inv':Inner_MAE_inv, 'Inner_Evaluation':Inner_Evaluation}
     sio.savemat(ResultantFolder + '/Inner_Evaluation.mat', Inner_Evaluation_Mat)
     
-    Optimal_Alpha_Index = np.argmax(Inner_Evaluation) 
     Optimal_Alpha = Alpha_Range[Optimal_Alpha_Index]
     return (Optimal_Alpha, Inner_Corr, Inner_MAE_inv)
 
-def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder):
+def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, Alpha, Alpha_ID, ResultantFolder, Debug_Flag=0):
     #
     # Sub-function for optimal regularization parameter selection
     #
@@ -383,25 +993,29 @@ def Ridge_SubAlpha(Training_Data, Training_Score, Testing_Data, Testing_Score, A
     #     The indice of the alpha we tested in the alpha range
     # ResultantFolder:
     #     Folder to storing the results
+    # Debug_Flag:
+    #     1: also write the result of this parameter into ResultantFolder as a .mat file, for debugging
+    #     0: only return the result, nothing is written (default)
     #
 
     clf = linear_model.Ridge(alpha=Alpha)
     clf.fit(Training_Data, Training_Score)
     Predict_Score = clf.predict(Testing_Data)
-    Fold_Corr = np.corrcoef(Predict_Score, Testing_Score)
-    Fold_Corr = Fold_Corr[0,1]
-    Fold_MAE_inv = np.divide(1, np.mean(np.abs(Predict_Score - Testing_Score)))
-    Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
-    ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
-    sio.savemat(ResultantFile, Fold_result)
+    Fold_Corr, Fold_MAE, Fold_MAE_inv = Score_Evaluate(Predict_Score, Testing_Score)
+    if Debug_Flag:
+        Fold_result = {'Corr': Fold_Corr, 'MAE_inv':Fold_MAE_inv}
+        ResultantFile = ResultantFolder + '/Alpha_' + str(Alpha_ID) + '.mat'
+        sio.savemat(ResultantFile, Fold_result)
+    return (Fold_Corr, Fold_MAE_inv)
     
-def Ridge_Weight(Subjects_Data, Subjects_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity):
+def Ridge_Weight(Subjects_Data, Subjects_Score, Alpha_Range, Nested_Fold_Quantity, ResultantFolder, Parallel_Quantity, Kernel_Flag=0, Block_Size=4096, Weight_File_Flag=0):
     #
     # Function to generate the contribution weight of all features
     # We generally use all samples to construct a new model to extract the weight of all features
     #
     # Subjects_Data:
     #     n*m matrix, n is subjects quantity, m is features quantity
+    #     It can also be the path of a .npy or HDF5 file, which is memory-mapped, see 'Data_Open' in Common_CZ_Data
     # Subjects_Score:
     #     n*1 vector, n is subjects quantity
     # Alpha_Range:
@@ -414,19 +1028,53 @@ def Ridge_Weight(Subjects_Data, Subjects_Score, Alpha_Range, Nested_Fold_Quantit
     #     Path of the folder storing the results
     # Parallel_Quantity:
     #     Parallel multi-cores on one single computer, at least 1
+    # Kernel_Flag:
+    #     1: the weights are recovered from the dual coefficients of the Gram matrix of all the subjects, see 'Ridge_Kernel_Weight'
+    #        Faster when subjects are much fewer than features, and no scaled copy of the data is made
+    #        The features are read block by block, so the memory is bounded by n*n and n*Block_Size, not by n*m
+    #     0: linear_model.Ridge on the scaled data (default)
+    # Block_Size:
+    #     Only for Kernel_Flag = 1, quantity of features read at a time
+    # Weight_File_Flag:
+    #     Only for Kernel_Flag = 1
+    #     1: the weights are written block by block into ResultantFolder/w_Brain.npy, and normalized there,
+    #        w_Brain.mat has 'alpha' and 'w_Brain_File', the path of the .npy file, for millions of features
+    #     0: the weights are in w_Brain.mat (default)
     #
 
+    Subjects_Data = Data_Open(Subjects_Data)
     if not os.path.exists(ResultantFolder):
         os.mkdir(ResultantFolder)
 
-    # Select optimal alpha using inner fold cross validation
-    Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(Subjects_Data, Subjects_Score, Nested_Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity)
+    if Kernel_Flag:
+        # The Gram matrices of all the subjects and of the inner folds from one pass, see 'Kernel_Nested' in Common_CZ_Kernel
+        Sorted_Index = np.argsort(Subjects_Score)
+        Inner_Fold_Index = [Sorted_Index[Inner_Fold_K_Position] for Inner_Fold_K_Position in \
+            Split_Fold(len(Subjects_Score), Nested_Fold_Quantity)['Test_Index']]
+        Kernel = Kernel_Nested(Subjects_Data, [np.array([], dtype=int)], [Inner_Fold_Index], Block_Size=Block_Size)
+        Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(None, Subjects_Score, Nested_Fold_Quantity, Alpha_Range, \
+            ResultantFolder, Parallel_Quantity, Inner_Kernel={'Gram': Kernel['Inner_Gram'][0]})
+        Weight_File = os.path.join(ResultantFolder, 'w_Brain.npy') if Weight_File_Flag else None
+        Coef = Ridge_Kernel_Weight(Subjects_Data, Subjects_Score, Kernel['Kernel'], Kernel['Shift'], Kernel['Data_Range'], Optimal_Alpha, \
+            Block_Size, Weight_File)
+        if Weight_File_Flag:
+            # Normalized in place, block by block
+            Norm = np.sqrt(np.sum([np.sum(Coef[Block_Start:Block_Start + Block_Size] ** 2) for Block_Start in np.arange(0, len(Coef), Block_Size)]))
+            for Block_Start in np.arange(0, len(Coef), Block_Size):
+                Coef[Block_Start:Block_Start + Block_Size] /= Norm
+            Coef.flush()
+            sio.savemat(ResultantFolder + '/w_Brain.mat', {'w_Brain_File': Weight_File, 'alpha': Optimal_Alpha})
+            return;
+    else:
+        # Select optimal alpha using inner fold cross validation
+        Optimal_Alpha, Inner_Corr, Inner_MAE_inv = Ridge_OptimalAlpha_KFold(Subjects_Data, Subjects_Score, Nested_Fold_Quantity, Alpha_Range, ResultantFolder, Parallel_Quantity)
 
-    Scale = preprocessing.MinMaxScaler()
-    Subjects_Data = Scale.fit_transform(Subjects_Data)
-    clf = linear_model.Ridge(alpha=Optimal_Alpha)
-    clf.fit(Subjects_Data, Subjects_Score)
-    Weight = clf.coef_ / np.sqrt(np.sum(clf.coef_ **2))
+        Scale = preprocessing.MinMaxScaler()
+        Subjects_Data = Scale.fit_transform(Subjects_Data)
+        clf = linear_model.Ridge(alpha=Optimal_Alpha)
+        clf.fit(Subjects_Data, Subjects_Score)
+        Coef = clf.coef_
+    Weight = Coef / np.sqrt(np.sum(Coef **2))
     Weight_result = {'w_Brain':Weight, 'alpha':Optimal_Alpha}
     sio.savemat(ResultantFolder + '/w_Brain.mat', Weight_result)
     return;